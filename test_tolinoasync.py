@@ -0,0 +1,138 @@
+#tolino cloud asyncio client tests
+
+# Drives AsyncTolinoCloud against the local stand-in of tolinomock.py:
+# login flavors, token refresh, inventory, devices, upload, download and
+# delete, and many downloads on one event loop. Needs aiohttp.
+#
+#   python3 -m unittest test_tolinoasync
+
+
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+
+
+import os
+import asyncio
+import tempfile
+import unittest
+
+from tolinomock import MockTolino
+from tolinoasync import AsyncTolinoCloud
+from tolinocloud import TolinoException
+
+partner_id = 99
+
+class AsyncTolinoCloudTest(unittest.IsolatedAsyncioTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.mock = MockTolino(items=5, file_size=64 * 1024).start()
+        cls.mock.install(partner_id)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.mock.stop()
+
+    def configure(self, **options):
+        # fresh libraries, and the settings installed again as the
+        # login flavor changes them
+        self.mock.configure(**options)
+        self.mock.install(partner_id)
+
+    def setUp(self):
+        self.configure(items=5, file_size=64 * 1024)
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = self.tmp.name
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    async def client(self):
+        c = AsyncTolinoCloud(partner_id)
+        c.open()
+        await c.login('test@example.com', 'secret')
+        await c.register()
+        return c
+
+    async def test_login_flavors(self):
+        for flavor in MockTolino.flavors:
+            with self.subTest(flavor=flavor):
+                self.configure(items=5, flavor=flavor)
+                async with AsyncTolinoCloud(partner_id) as c:
+                    await c.login('test@example.com', 'secret')
+                    self.assertTrue(c.access_token)
+                    await c.logout()
+
+    async def test_wrong_password(self):
+        self.configure(items=5, password='right')
+        async with AsyncTolinoCloud(partner_id) as c:
+            with self.assertRaises(TolinoException):
+                await c.login('test@example.com', 'wrong')
+
+    async def test_refresh(self):
+        c = await self.client()
+        try:
+            token = c.access_token
+            await c.refresh()
+            self.assertNotEqual(c.access_token, token)
+            self.assertEqual(len(await c.inventory()), 5)
+        finally:
+            await c.close()
+
+    async def test_inventory_and_devices(self):
+        c = await self.client()
+        try:
+            inv = await c.inventory()
+            self.assertEqual(len(inv), 5)
+            self.assertEqual(len(set(i['id'] for i in inv)), 5)
+            devs = await c.devices()
+            self.assertIn(AsyncTolinoCloud.hardware_id, [d['id'] for d in devs])
+            await c.unregister()
+        finally:
+            await c.close()
+
+    async def test_upload_download_delete(self):
+        c = await self.client()
+        try:
+            data = b'%PDF-1.4\n' + os.urandom(200 * 1024)
+            filename = os.path.join(self.path, 'book.pdf')
+            with open(filename, 'wb') as f:
+                f.write(data)
+            id = await c.upload(filename)
+            self.assertIn(id, [i['id'] for i in await c.inventory()])
+
+            os.mkdir(os.path.join(self.path, 'out'))
+            fn = await c.download(os.path.join(self.path, 'out'), id)
+            with open(fn, 'rb') as f:
+                self.assertEqual(f.read(), data)
+            self.assertFalse(os.path.exists(fn + '.part'))
+
+            await c.delete(id)
+            self.assertNotIn(id, [i['id'] for i in await c.inventory()])
+            with self.assertRaises(TolinoException):
+                await c.delete(id)
+        finally:
+            await c.close()
+
+    async def test_many_downloads(self):
+        self.configure(items=20, file_size=256 * 1024)
+        c = await self.client()
+        try:
+            inv = await c.inventory()
+            files = await asyncio.gather(*[c.download(self.path, i['id']) for i in inv])
+            self.assertEqual(len(set(files)), 20)
+            for fn in files:
+                self.assertEqual(os.path.getsize(fn), 256 * 1024)
+        finally:
+            await c.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+#tolino cloud command line client tests
+
+# Runs tolinoclient.py in this process against the local stand-in of
+# tolinomock.py, for the paths that run several accounts at once.
+#
+#   python3 -m unittest test_tolinoclient
+
+
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+
+
+import io
+import os
+import sys
+import json
+import runpy
+import tempfile
+import unittest
+import contextlib
+
+from tolinomock import MockTolino, MockLibrary
+
+partner_id = 99
+
+client = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tolinoclient.py')
+
+class MultiAccountTest(unittest.TestCase):
+
+    accounts = 8
+    items = 12
+
+    @classmethod
+    def setUpClass(cls):
+        cls.mock = MockTolino(items=cls.items, file_size=4096, latency=0.01).start()
+        cls.mock.install(partner_id)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.mock.stop()
+
+    def setUp(self):
+        self.mock.configure(items=self.items, file_size=4096, latency=0.01)
+        self.mock.install(partner_id)
+        self.tmp = tempfile.TemporaryDirectory()
+        self.config = os.path.join(self.tmp.name, 'tolinoclientrc')
+        with open(self.config, 'w') as f:
+            f.write('[Defaults]\npartner = {}\npassword = secret\n'.format(partner_id))
+            for n in range(self.accounts):
+                f.write('[account{0}]\nuser = user{0}@example.com\nworkers = 2\n'.format(n))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def run_client(self, *argv):
+        # (exit code, stdout, stderr) of one tolinoclient.py run
+        out, err = io.StringIO(), io.StringIO()
+        argv = [client, '--config', self.config, '--no-daemon', '--parallel-accounts', str(self.accounts)] + list(argv)
+        old_argv = sys.argv
+        sys.argv = argv
+        try:
+            with contextlib.redirect_stdout(out), contextlib.redirect_stderr(err):
+                runpy.run_path(client, run_name='__main__')
+            code = 0
+        except SystemExit as e:
+            code = e.code if isinstance(e.code, int) else 1
+        finally:
+            sys.argv = old_argv
+        return code, out.getvalue(), err.getvalue()
+
+    def titles(self, n):
+        lib = MockLibrary('user{}@example.com'.format(n), self.items)
+        return sorted(doc['title'] for doc in lib.docs.values())
+
+    def test_inventory_records_per_account(self):
+        # every account sees its own library, under its own name
+        code, out, err = self.run_client('--all-accounts', 'inventory', '--format', 'ndjson',
+            '--fields', 'account,title')
+        self.assertEqual(code, 0, err)
+        seen = {}
+        for line in out.splitlines():
+            r = json.loads(line)
+            seen.setdefault(r['account'], []).append(r['title'])
+        self.assertEqual(sorted(seen), ['account{}'.format(n) for n in range(self.accounts)])
+        for n in range(self.accounts):
+            self.assertEqual(sorted(seen['account{}'.format(n)]), self.titles(n))
+        self.assertEqual(len(self.mock.libraries), self.accounts)
+
+    def test_tagged_text_output(self):
+        code, out, err = self.run_client('--all-accounts', 'devices')
+        self.assertEqual(code, 0, err)
+        for n in range(self.accounts):
+            self.assertIn('[account{0}] 0 device connected to tolino cloud account user{0}@example.com'.format(n),
+                out.splitlines())
+
+    def test_download_with_account_settings(self):
+        # workers from an account section is a number like --workers
+        path = os.path.join(self.tmp.name, 'download')
+        os.mkdir(path)
+        code, out, err = self.run_client('--account', 'account0', '--account', 'account1',
+            'download', '--all', '--dir', path)
+        self.assertEqual(code, 0, out + err)
+        for n in range(2):
+            self.assertEqual(len(os.listdir(os.path.join(path, 'account{}'.format(n)))), self.items)
+
+
+if __name__ == '__main__':
+    unittest.main()
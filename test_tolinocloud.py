@@ -0,0 +1,280 @@
+#tolino cloud client tests
+
+# Drives TolinoCloud against the local stand-in of tolinomock.py: the
+# session cache and token renewal, retries and the request limiter,
+# registration, windowed bulk downloads, resuming .part files,
+# upload_tree and sync.
+#
+#   python3 -m unittest test_tolinocloud
+
+
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+
+
+import os
+import json
+import random
+import tempfile
+import unittest
+
+from tolinomock import MockTolino
+from tolinocloud import TolinoCloud, TolinoException, AdaptiveLimiter
+
+partner_id = 99
+
+class TolinoCloudTest(unittest.TestCase):
+
+    items = 12
+    file_size = 64 * 1024
+
+    @classmethod
+    def setUpClass(cls):
+        cls.mock = MockTolino(items=cls.items, file_size=cls.file_size).start()
+        cls.mock.install(partner_id)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.mock.stop()
+
+    def configure(self, **options):
+        # fresh libraries, and the settings installed again
+        self.mock.configure(**options)
+        self.mock.install(partner_id)
+
+    def setUp(self):
+        self.configure(items=self.items, file_size=self.file_size)
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = self.tmp.name
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def client(self, user = 'test@example.com', **options):
+        c = TolinoCloud(partner_id, **options)
+        c.login(user, 'secret')
+        c.register()
+        return c
+
+    def requests(self, route):
+        return self.mock.requests.get(route, 0)
+
+    def write(self, rel, data):
+        filename = os.path.join(self.path, rel)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        with open(filename, 'wb') as f:
+            f.write(data)
+        return filename
+
+    def test_session_cache(self):
+        cache = os.path.join(self.path, 'sessions')
+        self.client(session_cache=cache)
+        logins = self.requests('login')
+
+        # a cached session skips the partner login
+        c = TolinoCloud(partner_id, session_cache=cache)
+        c.login('test@example.com', 'secret')
+        self.assertEqual(self.requests('login'), logins)
+        self.assertEqual(len(c.inventory()), self.items)
+
+        # one about to expire is refreshed instead
+        fn = c._session_file()
+        with open(fn) as f:
+            j = json.load(f)
+        j['token_expires'] = 0
+        with open(fn, 'w') as f:
+            json.dump(j, f)
+        tokens = self.requests('token')
+        c = TolinoCloud(partner_id, session_cache=cache)
+        c.login('test@example.com', 'secret')
+        self.assertEqual(self.requests('login'), logins)
+        self.assertEqual(self.requests('token'), tokens + 1)
+        self.assertEqual(len(c.inventory()), self.items)
+
+    def test_rejected_token_renewed(self):
+        c = self.client()
+        c.access_token = 'expired'
+        self.assertEqual(len(c.inventory()), self.items)
+        self.assertNotEqual(c.access_token, 'expired')
+
+    def test_retry_overloaded_server(self):
+        c = self.client()
+        c.retry_base_delay = 0.01
+        c.retry_max_delay = 0.05
+        random.seed(1)
+        self.mock.error_rate = 0.3
+        for n in range(5):
+            self.assertEqual(len(c.inventory()), self.items)
+        self.assertGreater(self.requests('failed'), 0)
+
+    def test_limiter_backs_off(self):
+        # more workers than the server takes at once: the turned away
+        # requests are retried, and the limit comes down
+        self.configure(items=self.items, file_size=self.file_size, latency=0.05, max_inflight=2)
+        c = self.client()
+        results = list(c.download_many(self.path, workers=8))
+        self.assertEqual([r['error'] for r in results], [None] * self.items)
+        self.assertGreater(self.requests('rejected'), 0)
+        self.assertLess(c.limiter.limit, 8)
+
+    def test_limiter_halves_once_per_burst(self):
+        limiter = AdaptiveLimiter(limit=8)
+        started = [limiter.acquire() for n in range(4)]
+        for t in started:
+            limiter.release()
+            limiter.observe(t, overload=True)
+        self.assertEqual(limiter.limit, 4)
+        # requests sent after the decrease may lower it again
+        t = limiter.acquire()
+        limiter.release()
+        limiter.observe(t, overload=True)
+        self.assertEqual(limiter.limit, 2)
+
+    def test_kept_registration(self):
+        c = self.client(keep_registration=True)
+        registers = self.requests('registerhw')
+        # an unknown document is no rejected device
+        with self.assertRaises(TolinoException):
+            c.delete('unknown')
+        self.assertEqual(self.requests('registerhw'), registers)
+        # a device removed on the server side is registered again
+        for lib in self.mock.libraries.values():
+            lib.devices.clear()
+        self.assertEqual(len(c.inventory()), self.items)
+        self.assertEqual(self.requests('registerhw'), registers + 1)
+
+    def test_download_many(self):
+        c = self.client()
+        results = list(c.download_many(self.path, workers=3))
+        self.assertEqual(sorted(r['done'] for r in results), list(range(1, self.items + 1)))
+        self.assertEqual([r['error'] for r in results], [None] * self.items)
+        for r in results:
+            self.assertEqual(os.path.getsize(r['filename']), self.file_size)
+        # each info resolved once, and not counted again by its download
+        self.assertEqual(self.requests('downloadinfo'), self.items)
+        self.assertEqual(c.download_info_stats, { 'hits' : 0, 'misses' : self.items, 'stale' : 0 })
+
+    def test_download_many_stops_with_caller(self):
+        self.configure(items=60, file_size=self.file_size)
+        c = self.client()
+        results = c.download_many(self.path, workers=2)
+        next(results)
+        results.close()
+        # the transfer window and the resolver's lookahead, not the library
+        self.assertLessEqual(self.requests('content'), 2 * 2)
+        self.assertLessEqual(self.requests('downloadinfo'), 1 + (c.resolve_lookahead + 2) * 2)
+
+    def test_resolve_download_infos_stops_with_caller(self):
+        self.configure(items=60, file_size=self.file_size)
+        c = self.client()
+        ids = [i['id'] for i in c.inventory()]
+        results = c.resolve_download_infos(ids, workers=2)
+        id, info, error = next(results)
+        self.assertIsNone(error)
+        self.assertEqual(info['url'], c.download_info(id)['url'])
+        results.close()
+        self.assertLessEqual(self.requests('downloadinfo'), 2 * 2)
+
+    def part_file(self, c, id, validator):
+        # the name a download of id gets, with a .part file of half of it
+        # that starts with zeros, and validator kept for it
+        di = c.download_info(id)
+        filename = os.path.join(self.path, di['filename'])
+        with open(filename + '.part', 'wb') as f:
+            f.write(bytes(self.file_size // 2))
+        if validator is not None:
+            with open(filename + '.part.validator', 'w') as f:
+                f.write(validator)
+        return filename
+
+    def current_validator(self, c, id):
+        r = c._content_request(c.download_info(id)['url'])
+        r.close()
+        return r.headers['ETag']
+
+    def test_resume_same_version(self):
+        c = self.client()
+        id = c.inventory()[0]['id']
+        filename = self.part_file(c, id, self.current_validator(c, id))
+        self.assertEqual(c.download(self.path, id), filename)
+        with open(filename, 'rb') as f:
+            data = f.read()
+        # the rest was appended to what the .part file held
+        self.assertEqual(data[:self.file_size // 2], bytes(self.file_size // 2))
+        self.assertEqual(data[self.file_size // 2:], self.mock.content[self.file_size // 2:])
+        self.assertFalse(os.path.exists(filename + '.part'))
+        self.assertFalse(os.path.exists(filename + '.part.validator'))
+
+    def test_resume_other_version(self):
+        c = self.client()
+        id = c.inventory()[0]['id']
+        for validator in ('"an-older-revision"', None):
+            with self.subTest(validator=validator):
+                filename = self.part_file(c, id, validator)
+                c.download(self.path, id)
+                with open(filename, 'rb') as f:
+                    self.assertEqual(f.read(), self.mock.content)
+
+    def test_upload_tree(self):
+        same = b'%PDF-1.4\n' + os.urandom(1000)
+        self.write('tree/a.pdf', b'%PDF-1.4\n' + os.urandom(1000))
+        self.write('tree/b.pdf', same)
+        self.write('tree/sub/c.pdf', same)
+        self.write('tree/notes.txt', b'not a book')
+        root = os.path.join(self.path, 'tree')
+        manifest = os.path.join(self.path, 'manifest.json')
+        c = self.client()
+
+        results = { os.path.relpath(r['path'], root) : r for r in c.upload_tree(root, manifest, workers=2) }
+        self.assertEqual(sorted(results), ['a.pdf', 'b.pdf', os.path.join('sub', 'c.pdf')])
+        self.assertEqual(self.requests('upload'), 2)
+        self.assertEqual(results['a.pdf']['status'], 'uploaded')
+        self.assertEqual(results['b.pdf']['status'], 'uploaded')
+        # a file of the same content shares its upload
+        dup = results[os.path.join('sub', 'c.pdf')]
+        self.assertEqual(dup['status'], 'present')
+        self.assertEqual(dup['id'], results['b.pdf']['id'])
+
+        # nothing new the next time, unless it was deleted in the cloud
+        results = list(c.upload_tree(root, manifest))
+        self.assertEqual([r['status'] for r in results], ['present'] * 3)
+        c.delete(dup['id'])
+        results = list(c.upload_tree(root, manifest))
+        self.assertEqual(sorted(r['status'] for r in results), ['present', 'present', 'uploaded'])
+        self.assertEqual(self.requests('upload'), 3)
+
+    def test_sync(self):
+        root = os.path.join(self.path, 'library')
+        self.write('library/own.pdf', b'%PDF-1.4\n' + os.urandom(1000))
+        manifest = os.path.join(self.path, 'manifest.json')
+        c = self.client()
+
+        planned = list(c.sync(root, manifest, dry_run=True))
+        self.assertEqual(sorted(a['op'] for a in planned), ['download'] * self.items + ['upload'])
+        self.assertFalse(os.path.exists(manifest))
+
+        results = list(c.sync(root, manifest, workers=3))
+        self.assertEqual([r['status'] for r in results], ['done'] * (self.items + 1))
+        self.assertEqual(len(c.inventory()), self.items + 1)
+        # everything is in step now
+        self.assertEqual(list(c.sync(root, manifest)), [])
+
+        # deletions on either side carry over with delete
+        os.remove(os.path.join(root, 'own.pdf'))
+        gone = [r for r in results if r['op'] == 'download'][0]
+        c.delete(gone['id'])
+        results = list(c.sync(root, manifest, delete=True))
+        self.assertEqual(sorted((r['op'], r['status']) for r in results), [('delete', 'done'), ('remove', 'done')])
+        self.assertFalse(os.path.exists(os.path.join(root, gone['path'])))
+        self.assertEqual(len(c.inventory()), self.items - 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
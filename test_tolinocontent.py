@@ -0,0 +1,162 @@
+#tolino cloud local content store tests
+
+# Checks how ContentStore places, revalidates and evicts files, on its
+# own and behind TolinoCloud downloads from the local stand-in of
+# tolinomock.py.
+#
+#   python3 -m unittest test_tolinocontent
+
+
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+
+
+import os
+import stat
+import tempfile
+import unittest
+
+from tolinomock import MockTolino
+from tolinocloud import TolinoCloud
+from tolinocontent import ContentStore
+
+partner_id = 99
+
+def writable(filename):
+    return bool(os.stat(filename).st_mode & stat.S_IWUSR)
+
+class ContentStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = self.tmp.name
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def file(self, name, data):
+        filename = os.path.join(self.path, name)
+        with open(filename, 'wb') as f:
+            f.write(data)
+        return filename
+
+    def store(self, **options):
+        s = ContentStore(os.path.join(self.path, 'content'), **options)
+        self.addCleanup(s.close)
+        return s
+
+    def test_store_keeps_download_writable(self):
+        s = self.store()
+        fn = self.file('book.pdf', b'x' * 100)
+        s.store(partner_id, 'user', 'id1', fn, etag='"1"')
+        self.assertTrue(writable(fn))
+        entry = s.lookup(partner_id, 'user', 'id1')
+        self.assertEqual((entry['size'], entry['filename']), (100, 'book.pdf'))
+        self.assertEqual(s.validators(entry), { 'If-None-Match' : '"1"' })
+        self.assertTrue(s.fresh(entry))
+
+    def test_serve_copies(self):
+        s = self.store()
+        s.store(partner_id, 'user', 'id1', self.file('book.pdf', b'x' * 100))
+        entry = s.lookup(partner_id, 'user', 'id1')
+        fn = s.serve(entry, os.path.join(self.path, 'served.pdf'))
+        self.assertTrue(writable(fn))
+        self.assertEqual(os.stat(fn).st_nlink, 1)
+        self.assertEqual(s.stats()['hits'], 1)
+        self.assertEqual(s.stats()['saved_bytes'], 100)
+
+    def test_serve_links_on_request(self):
+        s = self.store(link=True)
+        s.store(partner_id, 'user', 'id1', self.file('book.pdf', b'x' * 100))
+        entry = s.lookup(partner_id, 'user', 'id1')
+        fn = s.serve(entry, os.path.join(self.path, 'served.pdf'))
+        self.assertFalse(writable(fn))
+        self.assertEqual(os.stat(fn).st_nlink, 2)
+        # an existing file is replaced by a copy, not by a link
+        existing = self.file('existing.pdf', b'old')
+        s.serve(entry, existing)
+        self.assertTrue(writable(existing))
+        self.assertEqual(os.stat(existing).st_nlink, 1)
+        with open(existing, 'rb') as f:
+            self.assertEqual(f.read(), b'x' * 100)
+
+    def test_evict_least_recently_used(self):
+        s = self.store(max_size=250)
+        for n in range(3):
+            s.store(partner_id, 'user', 'id{}'.format(n), self.file('book{}.pdf'.format(n), bytes([n]) * 100))
+        self.assertIsNone(s.lookup(partner_id, 'user', 'id0'))
+        self.assertIsNotNone(s.lookup(partner_id, 'user', 'id2'))
+        self.assertLessEqual(s.size(), 250)
+        self.assertEqual(s.stats()['evicted'], 1)
+        s.clear()
+        self.assertEqual(s.stats()['entries'], 0)
+        self.assertEqual(s.size(), 0)
+
+    def test_same_content_stored_once(self):
+        s = self.store()
+        for user in ('user1', 'user2'):
+            s.store(partner_id, user, 'id1', self.file('book.pdf', b'x' * 100))
+        self.assertEqual(s.stats()['entries'], 2)
+        self.assertEqual(s.stats()['objects'], 1)
+        s.forget(partner_id, 'user1', 'id1')
+        self.assertIsNotNone(s.lookup(partner_id, 'user2', 'id1'))
+
+
+class CachedDownloadTest(unittest.TestCase):
+
+    items = 4
+
+    @classmethod
+    def setUpClass(cls):
+        cls.mock = MockTolino(items=cls.items, file_size=32 * 1024).start()
+        cls.mock.install(partner_id)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.mock.stop()
+
+    def setUp(self):
+        self.mock.configure(items=self.items, file_size=32 * 1024)
+        self.mock.install(partner_id)
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = self.tmp.name
+        self.store = ContentStore(os.path.join(self.path, 'content'))
+
+    def tearDown(self):
+        self.store.close()
+        self.tmp.cleanup()
+
+    def test_download_again(self):
+        c = TolinoCloud(partner_id, content_store=self.store)
+        c.login('test@example.com', 'secret')
+        c.register()
+        id = c.inventory()[0]['id']
+        fn = c.download(self.path, id)
+        os.remove(fn)
+
+        # fresh: no request at all
+        content = self.mock.requests.get('content', 0)
+        self.assertEqual(c.download(self.path, id), fn)
+        self.assertEqual(self.mock.requests.get('content', 0), content)
+        with open(fn, 'rb') as f:
+            self.assertEqual(f.read(), self.mock.content)
+
+        # stale: revalidated with a conditional request
+        self.store.max_age = 0
+        os.remove(fn)
+        self.assertEqual(c.download(self.path, id), fn)
+        self.assertEqual(self.mock.requests.get('content', 0), content + 1)
+        self.assertTrue(writable(fn))
+        stats = self.store.stats()
+        self.assertEqual((stats['misses'], stats['hits'], stats['revalidated']), (1, 1, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+#tolino cloud session daemon tests
+
+# Runs a TolinoDaemon on a temporary socket against the local stand-in
+# of tolinomock.py and talks to it with DaemonClient.
+#
+#   python3 -m unittest test_tolinodaemon
+
+
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+
+
+import os
+import time
+import tempfile
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from tolinomock import MockTolino, MockLibrary
+from tolinodaemon import TolinoDaemon, DaemonClient
+
+partner_id = 99
+
+class TolinoDaemonTest(unittest.TestCase):
+
+    items = 12
+
+    @classmethod
+    def setUpClass(cls):
+        cls.mock = MockTolino(items=cls.items, file_size=4096).start()
+        cls.mock.install(partner_id)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.mock.stop()
+
+    def setUp(self):
+        self.mock.configure(items=self.items, file_size=4096, latency=0.02)
+        self.mock.install(partner_id)
+        self.tmp = tempfile.TemporaryDirectory()
+        self.socket = os.path.join(self.tmp.name, 'daemon.sock')
+        self.daemon = TolinoDaemon(self.socket)
+        self.thread = threading.Thread(target=self.daemon.serve, daemon=True)
+        self.thread.start()
+        deadline = time.time() + 10
+        while not DaemonClient.running(self.socket):
+            self.assertLess(time.time(), deadline, 'daemon did not start')
+            time.sleep(0.02)
+
+    def tearDown(self):
+        self.daemon.stop()
+        self.thread.join(10)
+        self.tmp.cleanup()
+
+    def client(self, user):
+        return DaemonClient(self.socket, partner_id, user, 'secret')
+
+    def titles(self, user):
+        return sorted(doc['title'] for doc in MockLibrary(user, self.items).docs.values())
+
+    def test_accounts_log_in_at_once(self):
+        # first requests of several users of one partner, all at once,
+        # each get their own library
+        users = ['user{}@example.com'.format(n) for n in range(8)]
+        with ThreadPoolExecutor(max_workers=len(users)) as pool:
+            inventories = list(pool.map(lambda u: self.client(u).inventory(), users))
+        for user, inv in zip(users, inventories):
+            self.assertEqual(sorted(i['title'] for i in inv), self.titles(user))
+        # and keep them for the next requests
+        for user in users:
+            self.assertEqual(sorted(i['title'] for i in self.client(user).inventory()), self.titles(user))
+        self.assertEqual(self.daemon.handle({ 'op' : 'stats' })['accounts'], len(users))
+
+    def test_concurrent_requests_coalesce(self):
+        c = self.client('user@example.com')
+        c.inventory()
+        # slow enough that the requests overlap
+        self.mock.latency = 0.3
+        before = self.mock.requests.get('inventory', 0)
+        with ThreadPoolExecutor(max_workers=5) as pool:
+            results = list(pool.map(lambda n: c.inventory(), range(5)))
+        self.assertEqual([len(r) for r in results], [self.items] * 5)
+        self.assertLess(self.mock.requests.get('inventory', 0) - before, 5)
+
+    def test_upload_download_delete(self):
+        c = self.client('user@example.com')
+        filename = os.path.join(self.tmp.name, 'book.pdf')
+        with open(filename, 'wb') as f:
+            f.write(b'%PDF-1.4\n' + os.urandom(1000))
+        id = c.upload(filename, progress=None)
+        path = os.path.join(self.tmp.name, 'out')
+        os.mkdir(path)
+        fn = c.download(path, id)
+        with open(fn, 'rb') as f, open(filename, 'rb') as g:
+            self.assertEqual(f.read(), g.read())
+        c.delete(id)
+        self.assertNotIn(id, [i['id'] for i in c.inventory()])
+
+    def test_delete_many_stops_with_caller(self):
+        c = self.client('user@example.com')
+        ids = [i['id'] for i in c.inventory()]
+        results = c.delete_many(ids, workers=2)
+        next(results)
+        results.close()
+        self.assertLessEqual(self.mock.requests.get('deletecontent', 0), 4)
+        self.assertGreater(len(c.inventory()), len(ids) - 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+#tolino cloud local inventory store tests
+
+# Syncs InventoryStore from the local stand-in of tolinomock.py, full
+# and by delta, and searches it.
+#
+#   python3 -m unittest test_tolinostore
+
+
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+
+
+import os
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from tolinomock import MockTolino, MockLibrary
+from tolinocloud import TolinoCloud
+from tolinostore import InventoryStore
+
+partner_id = 99
+
+class InventoryStoreTest(unittest.TestCase):
+
+    items = 20
+
+    @classmethod
+    def setUpClass(cls):
+        cls.mock = MockTolino(items=cls.items, file_size=1024).start()
+        cls.mock.install(partner_id)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.mock.stop()
+
+    def setUp(self):
+        self.mock.configure(items=self.items, file_size=1024)
+        self.mock.install(partner_id)
+        self.tmp = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.tmp.name, 'inventory.db')
+        self.store = InventoryStore(self.filename)
+
+    def tearDown(self):
+        self.store.close()
+        self.tmp.cleanup()
+
+    def client(self, user = 'test@example.com'):
+        c = TolinoCloud(partner_id)
+        c.login(user, 'secret')
+        c.register()
+        return c
+
+    def test_sync_delta(self):
+        c = self.client()
+        self.assertIsNone(self.store.synced(partner_id, c.username))
+        self.assertEqual(self.store.sync(c), { 'added' : self.items, 'changed' : 0, 'removed' : 0 })
+        self.assertEqual(sorted(i['id'] for i in self.store.inventory(partner_id, c.username)),
+            sorted(i['id'] for i in c.inventory()))
+        synced = self.store.synced(partner_id, c.username)
+
+        # change the library on the server side
+        lib = self.mock.libraries[c.username]
+        ids = sorted(lib.docs)
+        lib.remove(ids[0])
+        lib.add(dict(lib.docs[ids[1]], title='Renamed'))
+        lib.add(dict(lib.docs[ids[2]], id='new-upload', title='Fresh'))
+
+        self.assertEqual(self.store.sync(c), { 'added' : 1, 'changed' : 1, 'removed' : 1 })
+        changes = self.store.changes(partner_id, c.username, synced)
+        self.assertEqual([i['id'] for i in changes['added']], ['new-upload'])
+        self.assertEqual([i['title'] for i in changes['changed']], ['Renamed'])
+        self.assertEqual(changes['removed'], [ids[0]])
+        self.assertEqual(len(self.store.inventory(partner_id, c.username)), self.items)
+
+        # nothing changed, nothing to do
+        self.assertEqual(self.store.sync(c), { 'added' : 0, 'changed' : 0, 'removed' : 0 })
+
+    def test_search(self):
+        c = self.client()
+        self.store.sync(c)
+        found = self.store.search(partner_id, c.username, 'title:Title type:edata')
+        self.assertEqual(sorted(i['id'] for i in found),
+            sorted(id for id, doc in self.mock.libraries[c.username].docs.items() if doc['type'] == 'EDATA'))
+        self.assertEqual(self.store.search(partner_id, c.username, 'purchased<2000'), [])
+        with self.assertRaises(ValueError):
+            self.store.search(partner_id, c.username, 'color:blue')
+
+    def test_concurrent_accounts(self):
+        # several accounts sync into one store at once, each through its
+        # own connection as separate processes would
+        users = ['user{}@example.com'.format(n) for n in range(4)]
+
+        def sync(user):
+            store = InventoryStore(self.filename)
+            try:
+                return store.sync(self.client(user))
+            finally:
+                store.close()
+
+        with ThreadPoolExecutor(max_workers=len(users)) as pool:
+            counts = list(pool.map(sync, users))
+        self.assertEqual([n['added'] for n in counts], [self.items] * len(users))
+        for user in users:
+            self.assertEqual(sorted(i['title'] for i in self.store.inventory(partner_id, user)),
+                sorted(doc['title'] for doc in MockLibrary(user, self.items).docs.values()))
+
+
+if __name__ == '__main__':
+    unittest.main()
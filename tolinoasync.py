@@ -0,0 +1,428 @@
+#tolino cloud access module for asyncio
+
+# The same REST calls as TolinoCloud, driven by the same partner
+# settings, but on an aiohttp session: one event loop can keep many
+# requests for many files or accounts in flight at once. Needs aiohttp.
+#
+#   async with AsyncTolinoCloud(13) as c:
+#       await c.login(user, password)
+#       await c.register()
+#       inv = await c.inventory()
+#       await asyncio.gather(*[c.download(path, i['id']) for i in inv])
+
+
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+
+
+import os
+import re
+import json
+import time
+import base64
+import asyncio
+import logging
+from urllib.parse import urlparse, parse_qs
+
+import aiohttp
+
+from tolinocloud import TolinoCloud, TolinoException
+
+class AsyncTolinoCloud:
+
+    hardware_id = TolinoCloud.hardware_id
+    partner_name = TolinoCloud.partner_name
+    partner_settings = TolinoCloud.partner_settings
+    buffer_size = TolinoCloud.buffer_size
+
+    _parse_metadata = TolinoCloud._parse_metadata
+    _parse_device = TolinoCloud._parse_device
+
+    def __init__(self, partner_id, limit = 32):
+        self.partner_id = partner_id
+        # maximum number of connections the session keeps open at once
+        self.limit = limit
+        self.session = None
+        self.username = None
+        self.password = None
+        self.access_token = None
+        self.refresh_token = None
+        self.token_expires = None
+        self.lock = asyncio.Lock()
+
+    async def __aenter__(self):
+        self.open()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    def open(self):
+        if self.session is None:
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.limit),
+                cookie_jar=aiohttp.CookieJar(unsafe=True))
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def _headers(self, extra = None):
+        headers = {
+            't_auth_token' : self.access_token,
+            'hardware_id'  : self.hardware_id,
+            'reseller_id'  : str(self.partner_id)
+        }
+        headers.update(extra or {})
+        return headers
+
+    async def _call(self, send):
+        # like TolinoCloud._call(): send() builds the request from the
+        # current access token and is repeated once after renewing it
+        token = self.access_token
+        r = await send()
+        if r.status == 401 and self.username:
+            r.release()
+            logging.debug('access token rejected, renewing it')
+            async with self.lock:
+                if self.access_token == token:
+                    try:
+                        await self.refresh()
+                    except TolinoException:
+                        await self._login(self.username, self.password)
+            r = await send()
+        return r
+
+    async def _json(self, r):
+        try:
+            return json.loads(await r.read())
+        except ValueError:
+            return None
+
+    async def login(self, username, password):
+        self.open()
+        self.username = username
+        self.password = password
+        await self._login(username, password)
+
+    async def _login(self, username, password):
+        s = self.session
+        c = self.partner_settings[self.partner_id]
+
+        # Login with partner site
+        # to retrieve site's cookies within browser session
+        if 'login_form_url' in c:
+            async with s.get(c['login_form_url'], params = {
+                'client_id'     : c['client_id'],
+                'response_type' : 'code',
+                'scope'         : c['scope'],
+                'redirect_uri'  : c['reader_url'],
+                'x_buchde.skin_id': c['x_buchde.skin_id'],
+                'x_buchde.mandant_id' : c['x_buchde.mandant_id']
+            }, allow_redirects=False) as r:
+                await r.read()
+        data = dict(c['login_form']['extra'])
+        data[c['login_form']['username']] = username
+        data[c['login_form']['password']] = password
+        async with s.post(c['login_url'], data=data) as r:
+            await r.read()
+        if not c['login_cookie'] in [cookie.key for cookie in s.cookie_jar]:
+            raise TolinoException('login to {} failed.'.
+                format(self.partner_name[self.partner_id]))
+
+        if 'tat_url' in c:
+            try:
+                async with s.get(c['tat_url']) as r:
+                    text = await r.text()
+                b64 = re.search(r'\&tat=(.*?)%3D', text).group(1)
+                self.access_token = base64.b64decode(b64+'==').decode('utf-8')
+            except (AttributeError, ValueError, aiohttp.ClientError):
+                raise TolinoException('oauth access token request failed.')
+            return
+
+        # Request OAUTH code
+        params = {
+            'client_id'     : c['client_id'],
+            'response_type' : 'code',
+            'scope'         : c['scope'],
+            'redirect_uri'  : c['reader_url']
+        }
+        if 'login_form_url' in c:
+            params['x_buchde.skin_id'] = c['x_buchde.skin_id']
+            params['x_buchde.mandant_id'] = c['x_buchde.mandant_id']
+        async with s.get(c['auth_url'], params=params, allow_redirects=False) as r:
+            await r.read()
+            try:
+                auth_code = parse_qs(urlparse(r.headers['Location']).query)['code'][0]
+            except (KeyError, IndexError):
+                raise TolinoException('oauth code request failed.')
+
+        # Fetch OAUTH access token
+        async with s.post(c['token_url'], data = {
+            'client_id'    : c['client_id'],
+            'grant_type'   : 'authorization_code',
+            'code'         : auth_code,
+            'scope'        : c['scope'],
+            'redirect_uri' : c['reader_url']
+        }, allow_redirects=False) as r:
+            j = await self._json(r)
+        try:
+            self.access_token = j['access_token']
+            self.refresh_token = j['refresh_token']
+            self.token_expires = int(time.time()) + int(j['expires_in'])
+        except (KeyError, TypeError, ValueError):
+            raise TolinoException('oauth access token request failed.')
+
+    async def refresh(self):
+        c = self.partner_settings[self.partner_id]
+
+        if not self.refresh_token or not 'token_url' in c:
+            raise TolinoException('oauth token refresh not supported.')
+        async with self.session.post(c['token_url'], data = {
+            'client_id'     : c['client_id'],
+            'grant_type'    : 'refresh_token',
+            'refresh_token' : self.refresh_token,
+            'scope'         : c['scope']
+        }, allow_redirects=False) as r:
+            j = await self._json(r) if r.status == 200 else None
+        try:
+            self.access_token = j['access_token']
+            self.refresh_token = j.get('refresh_token', self.refresh_token)
+            self.token_expires = int(time.time()) + int(j['expires_in'])
+        except (KeyError, TypeError, ValueError):
+            raise TolinoException('oauth token refresh failed.')
+
+    async def logout(self):
+        c = self.partner_settings[self.partner_id]
+
+        if 'revoke_url' in c:
+            send = self.session.post(c['revoke_url'], data = {
+                'client_id'  : c['client_id'],
+                'token_type' : 'refresh_token',
+                'token'      : self.refresh_token
+            })
+        else:
+            send = self.session.post(c['logout_url'])
+        async with send as r:
+            await r.read()
+            if r.status != 200:
+                raise TolinoException('logout failed.')
+
+    async def register(self):
+        c = self.partner_settings[self.partner_id]
+
+        r = await self._call(lambda: self.session.post(c['register_url'],
+            data = json.dumps({'hardware_name':'other'}),
+            headers = self._headers({
+                'content-type': 'application/json',
+                'client_type': 'TOLINO_WEBREADER',
+                'client_version': '4.4.1',
+                'hardware_type': 'HTML5'
+            })
+        ))
+        async with r:
+            if r.status != 200:
+                raise TolinoException('register {} failed.'.format(self.hardware_id))
+
+    async def unregister(self, device_id = TolinoCloud.hardware_id):
+        c = self.partner_settings[self.partner_id]
+
+        r = await self._call(lambda: self.session.post(c['unregister_url'],
+            data = json.dumps({
+                'deleteDevicesRequest':{
+                    'accounts' : [ {
+                        'auth_token'  : self.access_token,
+                        'reseller_id' : self.partner_id
+                    } ],
+                    'devices'  : [ {
+                        'device_id'   : device_id,
+                        'reseller_id' : self.partner_id
+                    } ]
+                }
+            }),
+            headers = {
+                'content-type': 'application/json',
+                't_auth_token': self.access_token,
+                'reseller_id' : str(self.partner_id)
+            }
+        ))
+        async with r:
+            if r.status != 200:
+                try:
+                    message = (await self._json(r))['ResponseInfo']['message']
+                except (KeyError, TypeError):
+                    raise TolinoException('unregister {} failed: reason unknown.'.format(device_id))
+                raise TolinoException('unregister {} failed: {}'.format(device_id, message))
+
+    async def devices(self):
+        c = self.partner_settings[self.partner_id]
+
+        r = await self._call(lambda: self.session.post(c['devices_url'],
+            data = json.dumps({
+                'deviceListRequest':{
+                    'accounts' : [ {
+                        'auth_token'  : self.access_token,
+                        'reseller_id' : self.partner_id
+                    } ]
+                }
+            }),
+            headers = {
+                'content-type': 'application/json',
+                't_auth_token': self.access_token,
+                'reseller_id' : str(self.partner_id)
+            }
+        ))
+        async with r:
+            if r.status != 200:
+                raise TolinoException('device list request failed.')
+            j = await self._json(r)
+        try:
+            return [self._parse_device(item) for item in j['deviceListResponse']['devices']]
+        except (KeyError, TypeError, ValueError):
+            raise TolinoException('device list request failed.')
+
+    async def inventory(self):
+        c = self.partner_settings[self.partner_id]
+
+        r = await self._call(lambda: self.session.get(c['inventory_url'],
+            params = {'strip': 'true'},
+            headers = self._headers()
+        ))
+        async with r:
+            if r.status != 200:
+                raise TolinoException('inventory list request failed.')
+            j = await self._json(r)
+        try:
+            # edata = own documents uploaded to Tolino Cloud
+            # ebook = purchased ebooks in Tolino Cloud
+            return [self._parse_metadata(item)
+                for t in ('edata', 'ebook') for item in j['PublicationInventory'][t]]
+        except (KeyError, TypeError):
+            raise TolinoException('inventory list request failed.')
+
+    async def upload(self, filename, name = None, ext = None):
+        # filename is a path or a binary file-like object, which aiohttp
+        # streams in pieces; a file-like object needs a name
+        c = self.partner_settings[self.partner_id]
+
+        if isinstance(filename, str):
+            if name is None:
+                name = filename.split('/')[-1]
+            if ext is None:
+                ext = filename.split('.')[-1]
+        elif name is None:
+            raise TolinoException('file upload needs a name.')
+        elif ext is None:
+            ext = name.split('.')[-1]
+
+        mime = {
+            'pdf'  : 'application/pdf',
+            'epub' : 'application/epub+zip'
+        }.get(ext.lower(), 'application/pdf')
+
+        source = open(filename, 'rb') if isinstance(filename, str) else filename
+        start = source.tell() if source.seekable() else None
+
+        async def chunks():
+            # read the file in the default executor, so the event loop
+            # keeps serving other requests meanwhile
+            loop = asyncio.get_running_loop()
+            while True:
+                chunk = await loop.run_in_executor(None, source.read, self.buffer_size)
+                if not chunk:
+                    break
+                yield chunk
+
+        sent = []
+        def send():
+            if sent:
+                # sending again after a renewed token, rewind the source
+                if start is None:
+                    raise TolinoException('file upload failed: stream cannot be sent again.')
+                source.seek(start)
+            sent.append(True)
+            form = aiohttp.FormData()
+            form.add_field('file', chunks(), filename=name, content_type=mime)
+            return self.session.post(c['upload_url'], data=form, headers=self._headers())
+
+        try:
+            r = await self._call(send)
+            async with r:
+                j = await self._json(r) if r.status == 200 else None
+        finally:
+            if source is not filename:
+                source.close()
+        try:
+            return j['metadata']['deliverableId']
+        except (KeyError, TypeError):
+            raise TolinoException('file upload failed.')
+
+    async def delete(self, id):
+        c = self.partner_settings[self.partner_id]
+
+        r = await self._call(lambda: self.session.get(c['delete_url'],
+            params = {'deliverableId': id},
+            headers = self._headers()
+        ))
+        async with r:
+            if r.status != 200:
+                try:
+                    message = (await self._json(r))['ResponseInfo']['message']
+                except (KeyError, TypeError):
+                    raise TolinoException('delete {} failed: reason unknown.'.format(id))
+                raise TolinoException('delete {} failed: {}'.format(id, message))
+
+    async def download_info(self, id):
+        c = self.partner_settings[self.partner_id]
+
+        b64 = base64.b64encode(bytes(id, 'utf-8')).decode('utf-8')
+        r = await self._call(lambda: self.session.get(c['downloadinfo_url'].format(b64, b64),
+            headers = self._headers()
+        ))
+        async with r:
+            if r.status != 200:
+                raise TolinoException('download info request failed.')
+            j = await self._json(r)
+        try:
+            url = j['DownloadInfo']['contentUrl']
+            return {
+                'url'      : url,
+                'filename' : url.split('/')[-1],
+                'filetype' : j['DownloadInfo']['format'],
+            }
+        except (KeyError, TypeError):
+            raise TolinoException('download info request failed.')
+
+    async def download(self, path, id):
+        di = await self.download_info(id)
+
+        # stream into a .part file, renamed once complete
+        filename = path + '/' + di['filename'] if path else di['filename']
+        part = filename + '.part'
+        r = await self._call(lambda: self.session.get(di['url'], headers=self._headers()))
+        async with r:
+            if r.status != 200:
+                try:
+                    message = (await self._json(r))['ResponseInfo']['message']
+                except (KeyError, TypeError):
+                    raise TolinoException('download request : reason unknown.')
+                raise TolinoException('download request failed: {}'.format(message))
+            # write in the default executor, like upload() reads, so
+            # the event loop keeps serving other transfers meanwhile
+            loop = asyncio.get_running_loop()
+            f = await loop.run_in_executor(None, open, part, 'wb')
+            try:
+                async for chunk in r.content.iter_chunked(self.buffer_size):
+                    await loop.run_in_executor(None, f.write, chunk)
+            finally:
+                await loop.run_in_executor(None, f.close)
+        os.replace(part, filename)
+        return filename
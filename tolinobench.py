@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+
+# tolino cloud benchmark suite
+#
+# Measures TolinoCloud end-to-end against the local mock server of
+# tolinomock.py: login latency, inventory parse time for several
+# library sizes and upload / download throughput. The mock runs in a
+# process of its own, so it doesn't compete with the client for the
+# interpreter. The startup benchmark times fresh interpreters running
+# the library import and the local-only command line paths instead.
+# Use --json to keep results for later comparison.
+
+
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from tolinocloud import TolinoCloud
+from tolinomock import MockTolino
+
+partner_id = 99
+
+class MockProcess:
+
+    # tolinomock.py in a child process, reconfigured between benchmarks
+
+    def __init__(self, flavor, latency, error_rate = 0.0, max_inflight = 0):
+        self.flavor = flavor
+        self.latency = latency
+        self.error_rate = error_rate
+        self.max_inflight = max_inflight
+        self.proc = subprocess.Popen([sys.executable,
+                os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tolinomock.py'),
+                '--flavor', flavor, '--latency', str(latency)],
+            stdout=subprocess.PIPE, universal_newlines=True)
+        settings = json.loads(self.proc.stdout.readline())
+        self.base_url = settings['login_url'].split('/shop/')[0]
+        self.install(settings)
+
+    def install(self, settings):
+        TolinoCloud.partner_settings[partner_id] = settings
+        TolinoCloud.partner_name[partner_id] = 'Mock'
+
+    def configure(self, **options):
+        options.setdefault('flavor', self.flavor)
+        options.setdefault('latency', self.latency)
+        options.setdefault('error_rate', self.error_rate)
+        options.setdefault('max_inflight', self.max_inflight)
+        r = requests.post(self.base_url + '/mock/config', data=json.dumps(options))
+        r.raise_for_status()
+        self.install(r.json())
+
+    def stats(self):
+        return requests.get(self.base_url + '/mock/stats').json()
+
+    def close(self):
+        self.proc.terminate()
+        self.proc.wait()
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+def client():
+    c = TolinoCloud(partner_id)
+    c.login('bench@example.com', 'secret')
+    c.register()
+    return c
+
+def bench_login(mock, args):
+    mock.configure(items=0)
+    times = []
+    for n in range(args.logins):
+        c = TolinoCloud(partner_id)
+        start = time.perf_counter()
+        c.login('bench@example.com', 'secret')
+        times.append(time.perf_counter() - start)
+        c.logout()
+    return {
+        'logins'   : len(times),
+        'mean_ms'  : 1000 * sum(times) / len(times),
+        'p50_ms'   : 1000 * percentile(times, 50),
+        'p95_ms'   : 1000 * percentile(times, 95),
+        'ops_s'    : len(times) / sum(times)
+    }
+
+def bench_inventory(mock, args):
+    results = []
+    for size in args.library_sizes:
+        mock.configure(items=size)
+        c = client()
+        c.inventory()
+        times = []
+        for n in range(args.repeat):
+            start = time.perf_counter()
+            count = len(c.inventory())
+            times.append(time.perf_counter() - start)
+        c.unregister()
+        c.logout()
+        results.append({
+            'items'    : count,
+            'best_s'   : min(times),
+            'mean_s'   : sum(times) / len(times),
+            'items_s'  : count / min(times)
+        })
+    return results
+
+def bench_upload(mock, args, tmp):
+    mock.configure(items=0)
+    c = client()
+    filename = os.path.join(tmp, 'bench.pdf')
+    with open(filename, 'wb') as f:
+        f.write(b'%PDF-1.4\n' + os.urandom(args.file_size))
+    size = os.path.getsize(filename)
+    c._size_pool(args.workers)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        ids = list(pool.map(lambda n: c.upload(filename), range(args.transfers)))
+    elapsed = time.perf_counter() - start
+    for id in ids:
+        c.delete(id)
+    c.unregister()
+    c.logout()
+    return {
+        'files'    : len(ids),
+        'size'     : size,
+        'workers'  : args.workers,
+        'seconds'  : elapsed,
+        'mb_s'     : len(ids) * size / elapsed / 1e6,
+        'ops_s'    : len(ids) / elapsed
+    }
+
+def bench_download(mock, args, tmp):
+    mock.configure(items=args.transfers, file_size=args.file_size)
+    c = client()
+    path = os.path.join(tmp, 'download')
+    os.mkdir(path)
+    ids = [i['id'] for i in c.inventory()]
+    start = time.perf_counter()
+    results = list(c.download_many(path, ids, args.workers, args.segments))
+    elapsed = time.perf_counter() - start
+    failed = [r for r in results if r['error']]
+    c.unregister()
+    c.logout()
+    return {
+        'files'    : len(results) - len(failed),
+        'failed'   : len(failed),
+        'size'     : args.file_size,
+        'workers'  : args.workers,
+        'segments' : args.segments,
+        'seconds'  : elapsed,
+        'mb_s'     : (len(results) - len(failed)) * args.file_size / elapsed / 1e6,
+        'ops_s'    : (len(results) - len(failed)) / elapsed
+    }
+
+# fresh interpreter runs timed by the startup benchmark
+startup_commands = (
+    ('python',             ['-c', 'pass']),
+    ('import tolinocloud', ['-c', 'import tolinocloud']),
+    ('client --partner 0', ['tolinoclient.py', '--config', os.devnull, '--partner', '0']),
+    ('client --help',      ['tolinoclient.py', '--config', os.devnull, '--help'])
+)
+
+def run_python(argv, cwd):
+    start = time.perf_counter()
+    p = subprocess.run([sys.executable] + argv, cwd=cwd,
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True)
+    return time.perf_counter() - start, p.stderr
+
+def bench_startup(args, tmp):
+    # Each command runs in its own copy of the modules. The first, cold
+    # run has to compile them, the others find their bytecode cached.
+    # import_ms sums what the command itself imports (after site),
+    # http_stack tells whether requests was loaded.
+    here = os.path.dirname(os.path.abspath(__file__))
+    results = []
+    for n, (name, argv) in enumerate(startup_commands):
+        cwd = os.path.join(tmp, 'startup{}'.format(n))
+        os.mkdir(cwd)
+        for fn in os.listdir(here):
+            if fn.startswith('tolino') and fn.endswith('.py'):
+                shutil.copy(os.path.join(here, fn), cwd)
+        cold, _ = run_python(argv, cwd)
+        times = [run_python(argv, cwd)[0] for r in range(args.runs)]
+        _, log = run_python(['-X', 'importtime'] + argv, cwd)
+        imports = [line.split('|') for line in log.splitlines() if line.startswith('import time:')]
+        # the first line is the header, top level modules are indented by one space
+        top = [(int(cumulative), module.strip()) for self_us, cumulative, module in imports[1:]
+            if not module.startswith('  ')]
+        modules = [m for t, m in top]
+        if 'site' in modules:
+            top = top[modules.index('site') + 1:]
+        results.append({
+            'command'    : name,
+            'runs'       : len(times),
+            'cold_ms'    : 1000 * cold,
+            'mean_ms'    : 1000 * sum(times) / len(times),
+            'p50_ms'     : 1000 * percentile(times, 50),
+            'import_ms'  : sum(t for t, m in top) / 1000,
+            'http_stack' : any(m.strip() == 'requests' for self_us, c, m in imports)
+        })
+    return results
+
+def report(results):
+    if 'login' in results:
+        r = results['login']
+        print('login     : {logins} logins, mean {mean_ms:.1f} ms, p50 {p50_ms:.1f} ms, '
+            'p95 {p95_ms:.1f} ms, {ops_s:.1f} ops/s'.format(**r))
+    for r in results.get('inventory', []):
+        print('inventory : {items:>7} items, best {best_s:.3f} s, mean {mean_s:.3f} s, '
+            '{items_s:.0f} items/s'.format(**r))
+    if 'upload' in results:
+        r = results['upload']
+        print('upload    : {files} x {size} bytes, {workers} workers, {seconds:.2f} s, '
+            '{mb_s:.1f} MB/s, {ops_s:.1f} ops/s'.format(**r))
+    if 'download' in results:
+        r = results['download']
+        print('download  : {files} x {size} bytes, {workers} workers, {segments} segments, '
+            '{seconds:.2f} s, {mb_s:.1f} MB/s, {ops_s:.1f} ops/s'.format(**r))
+        if r['failed']:
+            print('            {failed} downloads failed'.format(**r))
+    for r in results.get('startup', []):
+        print('startup   : {command:<18} cold {cold_ms:.0f} ms, mean {mean_ms:.0f} ms, p50 {p50_ms:.0f} ms, '
+            'imports {import_ms:.0f} ms{}'.format(', loads requests' if r['http_stack'] else '', **r))
+
+benchmarks = ('login', 'inventory', 'upload', 'download', 'startup')
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description='Benchmark TolinoCloud against a local mock server.')
+    parser.add_argument('benchmark', nargs='*',
+        help='benchmarks to run: {} (default: all)'.format(', '.join(benchmarks)))
+    parser.add_argument('--flavor', choices=MockTolino.flavors, default='oauth', help='partner login flow of the mock (default: oauth)')
+    parser.add_argument('--latency', type=float, default=0.0, help='mock response delay in seconds (default: 0)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of mock requests failing with 503 (default: 0)')
+    parser.add_argument('--max-inflight', type=int, default=0, help='mock answers requests beyond this many at once with 429 (default: no limit)')
+    parser.add_argument('--logins', type=int, default=20, help='number of logins (default: 20)')
+    parser.add_argument('--library-sizes', type=lambda s: [int(n) for n in s.split(',')],
+        default=[100, 1000, 10000], help='comma separated library sizes (default: 100,1000,10000)')
+    parser.add_argument('--repeat', type=int, default=3, help='inventory fetches per library size (default: 3)')
+    parser.add_argument('--transfers', type=int, default=8, help='number of uploads / downloads (default: 8)')
+    parser.add_argument('--file-size', type=int, default=16 * 1024 * 1024, help='bytes per upload / download (default: 16 MiB)')
+    parser.add_argument('--workers', type=int, default=4, help='parallel transfers (default: 4)')
+    parser.add_argument('--segments', type=int, default=1, help='range requests per download (default: 1)')
+    parser.add_argument('--runs', type=int, default=10, help='interpreter starts per startup command (default: 10)')
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    args = parser.parse_args(argv)
+    for name in args.benchmark:
+        if not name in benchmarks:
+            parser.error('unknown benchmark {}.'.format(name))
+
+    # the startup benchmark needs no server
+    mock = None
+    tmp = tempfile.mkdtemp()
+    results = {}
+    try:
+        for name in args.benchmark or benchmarks:
+            if name == 'startup':
+                results[name] = bench_startup(args, tmp)
+                continue
+            if mock is None:
+                mock = MockProcess(args.flavor, args.latency, args.error_rate, args.max_inflight)
+            if name == 'login':
+                results[name] = bench_login(mock, args)
+            elif name == 'inventory':
+                results[name] = bench_inventory(mock, args)
+            elif name == 'upload':
+                results[name] = bench_upload(mock, args, tmp)
+            elif name == 'download':
+                results[name] = bench_download(mock, args, tmp)
+    finally:
+        shutil.rmtree(tmp)
+        if mock is not None:
+            mock.close()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        report(results)
+
+if __name__ == '__main__':
+    main()
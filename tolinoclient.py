@@ -4,23 +4,213 @@
 # call without parameters for a brief help message
 # you can use a ".tolinoclientrc" config file
 
+# Only what every call needs is imported up front. tolinocloud (and
+# with it requests, urllib3 and ssl), the inventory store and the
+# tracer are imported by the commands that use them, so --help, the
+# partner list and shell completion start without the HTTP stack.
+
 import configparser
 import argparse
-import json
 import sys
 import datetime
-import logging
+import time
+import json
+import threading
+import os
 from os.path import expanduser
 
-from tolinocloud import TolinoCloud
+from tolinopartners import partner_name, partner_settings
+from tolinorecords import InventoryItem, Device
+import tolinocomplete
 
-def inventory(args):
-    c = TolinoCloud(args.partner)
+default_store = '~/.cache/tolinoclient/inventory.db'
+default_socket = '~/.cache/tolinoclient/daemon.sock'
+default_content = '~/.cache/tolinoclient/content'
+
+def content_store(args, always=False):
+    if not args.content_cache and not always:
+        return None
+    from tolinocontent import ContentStore
+    return ContentStore(args.content_cache or default_content,
+        max_size=args.content_cache_size * 1024 * 1024,
+        max_age=args.content_max_age * 3600,
+        link=args.content_link)
+
+def connect(args, register=False, daemon=False):
+    # commands the daemon can serve go through it when one is running
+    if daemon and not args.no_daemon and os.path.exists(expanduser(args.daemon_socket)):
+        from tolinodaemon import DaemonClient
+        if DaemonClient.running(args.daemon_socket):
+            return DaemonClient(args.daemon_socket, args.partner, args.user, args.password)
+    from tolinocloud import TolinoCloud
+    c = TolinoCloud(args.partner,
+        session_cache=args.session_cache,
+        keep_registration=args.keep_registration,
+        tracer=args.tracer,
+        content_store=content_store(args))
     c.login(args.user, args.password)
-    c.register()
-    inv = c.inventory()
-    c.unregister()
-    c.logout()
+    if register:
+        c.register()
+    return c
+
+def disconnect(c, args):
+    if not hasattr(c, 'session'):
+        # a DaemonClient, the daemon keeps its session
+        return
+    if c.registered and not args.keep_registration:
+        c.unregister()
+    # a cached session is kept alive for the next invocation
+    if not args.session_cache:
+        c.logout()
+
+def remember_completion(args, items = None, devs = None):
+    # keep ids for shell completion, with the options that let a
+    # background refresh log in to this account again (but no password)
+    if not args.completion_cache:
+        return
+    argv = ['--config', os.path.abspath(expanduser(args.config)), '--partner', str(args.partner), '--user', args.user]
+    if args.account:
+        argv += ['--account', args.account[0]]
+    if args.session_cache:
+        argv += ['--session-cache', args.session_cache]
+    if args.keep_registration:
+        argv += ['--keep-registration']
+    try:
+        tolinocomplete.save(args.completion_cache,
+            None if items is None else tolinocomplete.document_entries(items),
+            None if devs is None else tolinocomplete.device_entries(devs),
+            argv)
+    except OSError as e:
+        sys.stderr.write('could not update completion cache: {}\n'.format(e))
+
+class RecordWriter:
+
+    # Writes records (inventory items, devices) one by one as they come
+    # in, as a JSON array, newline delimited JSON, CSV or TSV with a
+    # header line. Only the given fields are written, dates stay epoch
+    # ms unless iso_dates asks for ISO 8601 in UTC. The field 'account'
+    # is the account name given to write(). Several threads may write
+    # to one RecordWriter, e.g. one per account.
+
+    formats = ('json', 'ndjson', 'csv', 'tsv')
+
+    date_fields = ('purchased', 'issued', 'registered', 'lastusage')
+
+    def __init__(self, out, format, fields, iso_dates = False, header = True):
+        self.out = out
+        self.format = format
+        self.fields = fields
+        self.dates = [n for n, key in enumerate(fields) if iso_dates and key in self.date_fields]
+        self.count = 0
+        self.lock = threading.Lock()
+        if format == 'csv':
+            import csv
+            self.csv = csv.writer(out, lineterminator='\n')
+        if format == 'json':
+            out.write('[')
+        elif format in ('csv', 'tsv') and header:
+            self._row(fields)
+
+    def _row(self, values):
+        if self.format == 'csv':
+            self.csv.writerow(values)
+        else:
+            self.out.write('\t'.join(str(v).replace('\t', ' ').replace('\n', ' ') for v in values) + '\n')
+
+    def write(self, record, account = None):
+        values = [account if key == 'account' else record.get(key) for key in self.fields]
+        for n in self.dates:
+            if values[n] is not None:
+                values[n] = datetime.datetime.fromtimestamp(values[n] / 1000.0, datetime.timezone.utc).isoformat()
+        with self.lock:
+            if self.format in ('json', 'ndjson'):
+                line = json.dumps(dict(zip(self.fields, values)), ensure_ascii=False)
+                if self.format == 'json':
+                    self.out.write(('\n' if not self.count else ',\n') + line)
+                else:
+                    self.out.write(line + '\n')
+            else:
+                self._row(['; '.join(v) if isinstance(v, tuple) else '' if v is None else v for v in values])
+            self.count += 1
+
+    def close(self):
+        if self.format == 'json':
+            self.out.write('\n]\n' if self.count else ']\n')
+        self.out.flush()
+
+def record_fields(args, record_type, several = False):
+    # the --fields to write, all by default, led by the account name
+    # when running for several accounts
+    known = ('account',) + record_type.__slots__
+    if not args.fields:
+        return (['account'] if several else []) + list(record_type.__slots__)
+    fields = [f.strip() for f in args.fields.split(',') if f.strip()]
+    unknown = [f for f in fields if not f in known]
+    if unknown or not fields:
+        print('unknown field {}, choose from {}.'.format(', '.join(unknown) or '-', ', '.join(known)))
+        sys.exit(1)
+    return fields
+
+# what the completion cache needs to know of each record
+completion_fields = {
+    InventoryItem : ('id', 'title', 'type'),
+    Device        : ('id', 'name', 'type')
+}
+
+def write_records(args, records, record_type):
+    # Stream records out in a machine readable --format, through the
+    # writer shared by all accounts if there is one. Returns only what
+    # the completion cache needs of them, not the records themselves.
+    w = getattr(args, 'record_writer', None)
+    shared = w is not None
+    if not shared:
+        w = RecordWriter(sys.stdout, args.format, record_fields(args, record_type), args.iso_dates, not args.no_header)
+    account = getattr(args, 'account_name', None)
+    keep = completion_fields[record_type] if args.completion_cache else None
+    kept = []
+    for r in records:
+        w.write(r, account)
+        if keep:
+            kept.append({ key : r[key] for key in keep })
+    if not shared:
+        w.close()
+    return kept
+
+def inventory(args):
+    if args.format != 'text':
+        # check --fields before logging in
+        record_fields(args, InventoryItem)
+    if args.store:
+        from tolinostore import InventoryStore
+        store = InventoryStore(args.store)
+        if not args.offline:
+            c = connect(args, register=True)
+            counts = store.sync(c)
+            disconnect(c, args)
+            # kept apart from the records, through the account tags if
+            # running for several accounts
+            out = sys.stdout if args.format == 'text' or hasattr(args, 'record_writer') else sys.stderr
+            out.write('{added} added, {changed} changed, {removed} removed since last sync.\n'.format(**counts))
+        inv = store.inventory(args.partner, args.user)
+        store.close()
+        if args.format != 'text':
+            remember_completion(args, write_records(args, inv, InventoryItem))
+            return
+    elif args.format != 'text':
+        # each item goes out as soon as it is parsed from the response
+        c = connect(args, register=True, daemon=True)
+        try:
+            items = c.iter_inventory() if hasattr(c, 'iter_inventory') else c.inventory()
+            inv = write_records(args, items, InventoryItem)
+        finally:
+            disconnect(c, args)
+        remember_completion(args, inv)
+        return
+    else:
+        c = connect(args, register=True, daemon=True)
+        inv = c.inventory()
+        disconnect(c, args)
+    remember_completion(args, inv)
     print('{} document{} stored in tolino cloud account {}'.format(len(inv), 's' if len(inv) > 1 else '', args.user))
     for i in inv:
         print('')
@@ -39,119 +229,597 @@ def inventory(args):
         if 'issued' in i:
             print('issued    : {}'.format(datetime.datetime.fromtimestamp(i['issued']/1000.0).strftime('%c')))
         print('purchased : {}'.format(datetime.datetime.fromtimestamp(i['purchased']/1000.0).strftime('%c')))
-        print('partner   : {} / {}'.format(i['partner'], TolinoCloud.partner_name[i['partner']]))
+        print('partner   : {} / {}'.format(i['partner'], partner_name[i['partner']]))
+
+
+def search(args):
+    from tolinostore import InventoryStore
+    store = InventoryStore(args.store)
+    synced = store.synced(args.partner, args.user)
+    if args.refresh or synced is None or time.time() - synced > args.max_age * 3600:
+        c = connect(args, register=True)
+        store.sync(c)
+        disconnect(c, args)
+    try:
+        found = store.search(args.partner, args.user, ' '.join(args.query))
+    except ValueError as e:
+        print(e)
+        sys.exit(1)
+    finally:
+        store.close()
+    for i in found:
+        print('{}  {}  {}  {}: {}'.format(i['id'], i['type'],
+            datetime.datetime.fromtimestamp(i['purchased']/1000.0).strftime('%Y-%m-%d'),
+            ', '.join(a for a in i['author'] if a), i['title']))
+    if not found:
+        sys.exit(1)
+
 
+def print_device(d):
+    print('')
+    print('device    : {}'.format(d['id']))
+    print('type      : {}'.format(d['type']))
+    print('name      : {}'.format(d['name']))
+    print('partner   : {} / {}'.format(d['partner'], partner_name.get(d['partner'], 'unknown')))
+    print('registered: {}'.format(datetime.datetime.fromtimestamp(d['registered']/1000.0).strftime('%c')))
+    print('last use  : {}'.format(datetime.datetime.fromtimestamp(d['lastusage']/1000.0).strftime('%c')))
 
 def devices(args):
-    c = TolinoCloud(args.partner)
-    c.login(args.user, args.password)
+    if args.action == 'prune':
+        prune_devices(args)
+        return
+    if args.format != 'text':
+        record_fields(args, Device)
+    c = connect(args, daemon=True)
     devs = c.devices()
-    c.logout()
+    disconnect(c, args)
+    remember_completion(args, devs=devs)
+    if args.format != 'text':
+        write_records(args, devs, Device)
+        return
     print('{} device{} connected to tolino cloud account {}'.format(len(devs), 's' if len(devs) > 1 else '', args.user))
     for d in devs:
-        print('')
-        print('device    : {}'.format(d['id']))
-        print('type      : {}'.format(d['type']))
-        print('name      : {}'.format(d['name']))
-        print('partner   : {} / {}'.format(d['partner'], TolinoCloud.partner_name[d['partner']]))
-        print('registered: {}'.format(datetime.datetime.fromtimestamp(d['registered']/1000.0).strftime('%c')))
-        print('last use  : {}'.format(datetime.datetime.fromtimestamp(d['lastusage']/1000.0).strftime('%c')))
+        print_device(d)
+
+def prune_devices(args):
+    if args.unused_days is None and args.type is None and args.reseller is None:
+        print('devices prune needs --unused-days, --type or --reseller.')
+        sys.exit(1)
+    if args.format != 'text':
+        record_fields(args, Device)
+    c = connect(args)
+    try:
+        devs = c.select_devices(c.devices(), args.unused_days, args.type, args.reseller)
+        if devs and not args.dry_run:
+            c.unregister(devs)
+    finally:
+        disconnect(c, args)
+    if args.format != 'text':
+        # the devices that were (or would be) unregistered
+        write_records(args, devs, Device)
+        return
+    print('{} {} device{} from tolino cloud account {}'.format('would unregister' if args.dry_run else 'unregistered',
+        len(devs), 's' if len(devs) != 1 else '', args.user))
+    for d in devs:
+        print_device(d)
+
+def refresh_completion(args):
+    c = connect(args, register=True)
+    try:
+        items = c.inventory()
+        devs = [d for d in c.devices() if d['id'] != c.hardware_id]
+    finally:
+        disconnect(c, args)
+    remember_completion(args, items, devs)
+
+def daemon(args):
+    from tolinodaemon import TolinoDaemon, DaemonClient
+    import signal
+    if DaemonClient.running(args.daemon_socket):
+        print('a daemon is already listening on {}.'.format(args.daemon_socket))
+        sys.exit(1)
+    d = TolinoDaemon(args.daemon_socket, args.session_cache, args.keep_registration, content_store(args))
+    # shutdown() waits for serve_forever(), so it can't run in the handler itself
+    signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=d.stop).start())
+    print('serving on {}.'.format(d.socket_path))
+    sys.stdout.flush()
+    d.serve()
+
+def cache(args):
+    store = content_store(args, always=True)
+    if args.action == 'clear':
+        store.clear()
+        print('content cache {} cleared.'.format(store.directory))
+        return
+    s = store.stats()
+    store.close()
+    mb = 1024 * 1024
+    print('content cache : {}'.format(store.directory))
+    print('documents     : {entries} ({objects} files)'.format(**s))
+    print('size          : {:.1f} of {:.1f} MB'.format(s['size'] / mb, s['max_size'] / mb))
+    print('hits          : {hits} without request, {revalidated} revalidated'.format(**s))
+    print('misses        : {misses} downloaded'.format(**s))
+    print('evicted       : {evicted}'.format(**s))
+    print('saved         : {:.1f} MB not downloaded'.format(s['saved_bytes'] / mb))
 
 def unregister(args):
-    c = TolinoCloud(args.partner)
-    c.login(args.user, args.password)
+    c = connect(args)
     c.unregister(args.device_id)
-    c.logout()
-    print('unregistered device {} from tolino cloud.'.format(args.device_id))
+    disconnect(c, args)
+    for id in args.device_id:
+        print('unregistered device {} from tolino cloud.'.format(id))
+
+def upload_progress():
+    started = time.time()
+    def progress(sent, total):
+        rate = sent / max(time.time() - started, 0.001) / 1048576
+        if total:
+            sys.stderr.write('\r{:5.1f}% {:.1f} MB/s '.format(100.0 * sent / total, rate))
+        else:
+            sys.stderr.write('\r{:.1f} MB {:.1f} MB/s '.format(sent / 1048576, rate))
+        if sent == total:
+            sys.stderr.write('\n')
+    return progress
+
+def upload_tree(args):
+    c = connect(args, register=True)
+    manifest = args.manifest or os.path.join(args.filename, '.tolinomanifest.json')
+    counts = { 'present' : 0, 'uploaded' : 0, 'failed' : 0 }
+    try:
+        for res in c.upload_tree(args.filename, expanduser(manifest), args.workers):
+            counts[res['status']] += 1
+            if res['status'] == 'uploaded':
+                print('uploaded {} to tolino cloud as {}.'.format(res['path'], res['id']))
+            elif res['status'] == 'failed':
+                print('upload {} failed: {}'.format(res['path'], res['error']))
+            sys.stdout.flush()
+    finally:
+        disconnect(c, args)
+    print('{} uploaded, {} already in tolino cloud, {} failed.'.format(
+        counts['uploaded'], counts['present'], counts['failed']))
+    if counts['failed']:
+        sys.exit(1)
 
 def upload(args):
-    c = TolinoCloud(args.partner)
-    c.login(args.user, args.password)
-    c.register()
-    document_id = c.upload(args.filename, args.name)
-    c.unregister()
-    c.logout()
+    if os.path.isdir(args.filename):
+        upload_tree(args)
+        return
+    if args.filename == '-' and not args.name:
+        print('uploading from stdin needs --name.')
+        sys.exit(1)
+    c = connect(args, register=True, daemon=args.filename != '-' and not args.progress)
+    document_id = c.upload(sys.stdin.buffer if args.filename == '-' else args.filename, args.name,
+        progress=upload_progress() if args.progress else None)
+    disconnect(c, args)
     print('uploaded {} to tolino cloud as {}.'.format(args.filename, document_id))
 
 def download(args):
-    c = TolinoCloud(args.partner)
-    c.login(args.user, args.password)
-    c.register()
-    fn = c.download(None, args.document_id)
-    c.unregister()
-    c.logout()
-    print('downloaded {} from tolino cloud to {}.'.format(args.document_id, fn))
+    if len(args.document_id) == 1 and not args.all:
+        c = connect(args, register=True, daemon=True)
+        fn = c.download(args.dir, args.document_id[0], args.segments)
+        disconnect(c, args)
+        print('downloaded {} from tolino cloud to {}.'.format(args.document_id[0], fn))
+        return
+
+    if not args.document_id and not args.all:
+        print('document id or --all required.')
+        sys.exit(1)
+    c = connect(args, register=True, daemon=True)
+    total = failed = 0
+    try:
+        for res in c.download_many(args.dir, None if args.all else args.document_id, args.workers, args.segments):
+            total = res['total']
+            if res['error']:
+                failed += 1
+                print('[{}/{}] download {} failed: {}'.format(res['done'], res['total'], res['id'], res['error']))
+            else:
+                print('[{}/{}] downloaded {} to {}.'.format(res['done'], res['total'], res['id'], res['filename']))
+            sys.stdout.flush()
+    finally:
+        disconnect(c, args)
+    if hasattr(c, 'download_info_stats'):
+        import logging
+        logging.debug('download info cache: {hits} hits, {misses} misses, {stale} stale'.format(**c.download_info_stats))
+    print('{} of {} document{} downloaded from tolino cloud.'.format(total - failed, total, 's' if total != 1 else ''))
+    if failed:
+        sys.exit(1)
+
+def sync(args):
+    c = connect(args, register=True)
+    manifest = args.manifest or os.path.join(args.dir, '.tolinosync.json')
+    counts = {}
+    failed = 0
+    try:
+        for res in c.sync(args.dir, expanduser(manifest), args.mode, args.delete, args.dry_run, args.workers):
+            what = res['path'] or res['id']
+            if res['op'] in ('download', 'delete') or not res['path']:
+                what = '{} ({})'.format(res['id'], res['path']) if res['path'] else res['id']
+            if res['status'] == 'failed':
+                failed += 1
+                print('{} {} failed: {}'.format(res['op'], what, res['error']))
+            else:
+                counts[res['op']] = counts.get(res['op'], 0) + 1
+                print('{}{} {}'.format('would ' if args.dry_run else '', res['op'], what))
+            sys.stdout.flush()
+    finally:
+        disconnect(c, args)
+    summary = ', '.join('{} {}'.format(n, op + ('s' if n != 1 else '')) for op, n in sorted(counts.items()))
+    print('{}{}{}.'.format('dry run: ' if args.dry_run else '', summary or 'already in sync',
+        ', {} failed'.format(failed) if failed else ''))
+    if failed:
+        sys.exit(1)
+
+def date_ms(value):
+    # YYYY-MM-DD as the epoch ms of its start (UTC)
+    try:
+        d = datetime.datetime.strptime(value, '%Y-%m-%d')
+    except ValueError:
+        raise argparse.ArgumentTypeError('bad date {}, use YYYY-MM-DD.'.format(value))
+    return int(d.replace(tzinfo=datetime.timezone.utc).timestamp() * 1000)
 
 def delete(args):
-    c = TolinoCloud(args.partner)
-    c.login(args.user, args.password)
-    c.register()
-    c.delete(args.document_id)
-    c.unregister()
-    c.logout()
-    print('deleted {} from tolino cloud.'.format(args.document_id))
+    conditions = {
+        'type'             : args.type,
+        'mime'             : args.mime,
+        'purchased_before' : args.before,
+        'purchased_after'  : args.after
+    }
+    filtered = any(v is not None for v in conditions.values())
+    if len(args.document_id) == 1 and not filtered and not args.dry_run:
+        c = connect(args, register=True, daemon=True)
+        c.delete(args.document_id[0])
+        disconnect(c, args)
+        print('deleted {} from tolino cloud.'.format(args.document_id[0]))
+        return
+
+    if not args.document_id and not filtered:
+        print('document id or --type, --mime, --before or --after required.')
+        sys.exit(1)
+    c = connect(args, register=True, daemon=not filtered)
+    total = failed = 0
+    try:
+        if filtered:
+            items = list(c.select_inventory(args.document_id or None, **conditions))
+            ids = [i['id'] for i in items]
+        else:
+            items = None
+            ids = args.document_id
+        if args.dry_run:
+            print('would delete {} document{} from tolino cloud account {}'.format(len(ids), 's' if len(ids) != 1 else '', args.user))
+            for i in items or []:
+                print('{}  {}  {}  {}: {}'.format(i['id'], i['type'],
+                    datetime.datetime.fromtimestamp(i['purchased']/1000.0).strftime('%Y-%m-%d'),
+                    ', '.join(a for a in i['author'] if a), i['title']))
+            if items is None:
+                for id in ids:
+                    print(id)
+            return
+        for res in c.delete_many(ids, args.workers):
+            total = res['total']
+            if res['error']:
+                failed += 1
+                print('[{}/{}] {}'.format(res['done'], res['total'], res['error']))
+            else:
+                print('[{}/{}] deleted {}.'.format(res['done'], res['total'], res['id']))
+            sys.stdout.flush()
+    finally:
+        disconnect(c, args)
+    print('{} of {} document{} deleted from tolino cloud.'.format(total - failed, total, 's' if total != 1 else ''))
+    if failed:
+        sys.exit(1)
+
+def batch(args):
+    c = connect(args, register=True)
+    failed = 0
+    try:
+        for res in c.batch(args.file):
+            if res['error']:
+                failed += 1
+                print('{}: {} {} failed: {}'.format(res['line'], res['op'], ' '.join(res['args']), res['error']))
+            else:
+                print('{}: {} {} ok{}'.format(res['line'], res['op'], ' '.join(res['args']),
+                    ': {}'.format(res['result']) if res['result'] else ''))
+            sys.stdout.flush()
+    finally:
+        disconnect(c, args)
+    if failed:
+        sys.exit(1)
+
+
+class TaggedOutput:
+
+    # stdout replacement while running a command for several accounts
+    # at once: every complete line goes out tagged with the account name
+    # of the thread that wrote it
+
+    def __init__(self, out):
+        self.out = out
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def start(self, tag):
+        self.local.tag = tag
+        self.local.buf = ''
+
+    def write(self, text):
+        lines = (getattr(self.local, 'buf', '') + text).split('\n')
+        self.local.buf = lines.pop()
+        if lines:
+            with self.lock:
+                for line in lines:
+                    self.out.write('[{}] {}\n'.format(getattr(self.local, 'tag', '-'), line))
+        return len(text)
+
+    def flush(self):
+        with self.lock:
+            self.out.flush()
+
+    def finish(self):
+        if self.local.buf:
+            self.write('\n')
+
+# commands that can run for several accounts at once
+fan_out_commands = ('inventory', 'search', 'devices', 'download')
+
+def option_type(key, command):
+    # the type= of the option of the command (or of all commands) that
+    # stores key, None if it has none
+    parsers = [parser]
+    if command in subparsers.choices:
+        parsers.append(subparsers.choices[command])
+    for p in parsers:
+        for action in p._actions:
+            if action.dest == key and callable(action.type):
+                return action.type
+    return None
+
+def account_args(args, name):
+    # args with the settings of an account section, converted like the
+    # options they stand for
+    a = argparse.Namespace(**vars(args))
+    a.account_name = name
+    for key, value in accounts[name].items():
+        key = key.replace('-', '_')
+        convert = option_type(key, args.command)
+        if convert is not None and isinstance(value, str):
+            try:
+                value = convert(value)
+            except (TypeError, ValueError, argparse.ArgumentTypeError):
+                print('{} = {} in [{}] of {} is not valid.'.format(key, value, name, args.config))
+                sys.exit(1)
+        setattr(a, key, value)
+    return a
+
+# options given as yes / no, true / false, on / off or 1 / 0 in the config file
+config_flags = ('keep_registration', 'no_daemon', 'debug', 'content_link')
+
+def config_section(c, section):
+    values = dict(c.items(section))
+    for key in config_flags:
+        if key in values:
+            try:
+                values[key] = c.getboolean(section, key)
+            except ValueError:
+                print('{} in [{}] of {} must be yes or no.'.format(key, section, args.config))
+                sys.exit(1)
+    return values
+
+def run_accounts(args, names):
+    # Records of a machine readable --format go into one stream, with
+    # an account field, while messages go to stderr tagged by account.
+    record_type = { 'inventory' : InventoryItem, 'devices' : Device }.get(args.command)
+    merged = record_type is not None and args.format != 'text'
+    if merged:
+        args.record_writer = RecordWriter(sys.stdout, args.format, record_fields(args, record_type, True),
+            args.iso_dates, not args.no_header)
+    out = TaggedOutput(sys.stderr if merged else sys.stdout)
+
+    def run(name):
+        a = account_args(args, name)
+        # one completion cache can't hold several accounts
+        a.completion_cache = None
+        if args.command == 'download':
+            # keep the accounts' files apart
+            a.dir = os.path.join(args.dir or '.', name)
+            os.makedirs(a.dir, exist_ok=True)
+        out.start(name)
+        try:
+            if not a.user or not a.password:
+                print('Login credentials user/password required.')
+                return 1
+            args.func(a)
+            return 0
+        except SystemExit as e:
+            return e.code if isinstance(e.code, int) else 1
+        except Exception as e:
+            print('failed: {}'.format(e))
+            return 1
+        finally:
+            out.finish()
 
+    from concurrent.futures import ThreadPoolExecutor
+    stdout = sys.stdout
+    sys.stdout = out
+    try:
+        with ThreadPoolExecutor(max_workers=args.parallel_accounts) as pool:
+            codes = list(pool.map(run, names))
+    finally:
+        sys.stdout = stdout
+        if merged:
+            args.record_writer.close()
+    sys.exit(1 if any(codes) else 0)
 
+
+# -h is added once the config file is read, so the first pass doesn't
+# answer it with a help message that lacks all other options
 parser = argparse.ArgumentParser(
-    description='cmd line client to access personal tolino cloud storage space.'
+    description='cmd line client to access personal tolino cloud storage space.',
+    add_help=False
 )
 parser.add_argument('--config', metavar='FILE', default='~/.tolinoclientrc', help='config file (default: .tolinoclientrc)')
 args, remaining_argv = parser.parse_known_args()
 
+# every section besides [Defaults] is a named account, its settings
+# override the defaults
+accounts = {}
 if args.config:
     c = configparser.ConfigParser()
     c.read([expanduser(args.config)])
     if c.has_section('Defaults'):
-        defaults = dict(c.items('Defaults'))
-        parser.set_defaults(**defaults)
+        parser.set_defaults(**config_section(c, 'Defaults'))
+    for section in c.sections():
+        if section != 'Defaults':
+            accounts[section] = config_section(c, section)
 
+parser.add_argument('-h', '--help', action='help', help='show this help message and exit')
 parser.add_argument('--user', type=str, help='username (usually an email address)')
 parser.add_argument('--password', type=str, help='password')
 parser.add_argument('--partner', type=int, help='shop / partner id (use 0 for list)')
+parser.add_argument('--session-cache', metavar='DIR', nargs='?', const='~/.cache/tolinoclient', help='reuse login sessions cached in DIR (default: ~/.cache/tolinoclient)')
+parser.add_argument('--keep-registration', action="store_true", help='keep this client registered as a device between calls (best with --session-cache)')
+parser.add_argument('--account', metavar='NAME', action='append', help='use the named account section of the config file, repeat for several accounts')
+parser.add_argument('--all-accounts', action='store_true', help='use all named accounts of the config file')
+parser.add_argument('--parallel-accounts', metavar='N', type=int, default=4, help='number of accounts processed at once (default: 4)')
 parser.add_argument('--debug', action="store_true", help='log additional debugging info')
+parser.add_argument('--completion-cache', metavar='FILE', default=tolinocomplete.default_cache, help='keep document and device ids for shell completion in FILE, empty to disable (default: {})'.format(tolinocomplete.default_cache))
+parser.add_argument('--content-cache', metavar='DIR', nargs='?', const=default_content, help='keep downloaded files in DIR and reuse them instead of downloading again (default: {})'.format(default_content))
+parser.add_argument('--content-cache-size', metavar='MB', type=int, default=2048, help='evict the least recently used files beyond this size (default: 2048)')
+parser.add_argument('--content-max-age', metavar='HOURS', type=float, default=24, help='ask the server whether cached files older than this have changed (default: 24)')
+parser.add_argument('--content-link', action="store_true", help='hard link cached files into place instead of copying them (read-only, shared between accounts)')
+parser.add_argument('--daemon-socket', metavar='FILE', default=default_socket, help='socket of the tolinoclient.py daemon, used when it is running (default: {})'.format(default_socket))
+parser.add_argument('--no-daemon', action='store_true', help='never go through a running daemon')
+parser.add_argument('--trace', metavar='FILE', help='write request timings, status codes and bytes per phase to FILE (Prometheus text format for *.prom, JSON otherwise)')
+
+subparsers = parser.add_subparsers(dest='command')
 
-subparsers = parser.add_subparsers()
+def add_format_arguments(s, record_type):
+    s.add_argument('--format', choices=('text',) + RecordWriter.formats, default='text',
+        help='print as text, a JSON array, one JSON object per line, CSV or TSV (default: text)')
+    s.add_argument('--fields', metavar='A,B,...', help='comma separated fields to print with --format, of account, {} (default: all)'.format(
+        ', '.join(record_type.__slots__)))
+    s.add_argument('--iso-dates', action='store_true', help='print dates as ISO 8601 in UTC instead of epoch milliseconds')
+    s.add_argument('--no-header', action='store_true', help='leave out the CSV / TSV header line')
 
 s = subparsers.add_parser('inventory', help='fetch and print inventory')
+s.add_argument('--store', metavar='FILE', nargs='?', const=default_store, help='keep the inventory in a local database and only fetch changes (default: {})'.format(default_store))
+s.add_argument('--offline', action='store_true', help='print the inventory from --store without syncing it')
+add_format_arguments(s, InventoryItem)
 s.set_defaults(func=inventory)
 
+s = subparsers.add_parser('search', help='search the locally stored inventory, e.g. "author:Pratchett type:ebook purchased>2020"')
+s.add_argument('query', nargs='+', help='words or field:value terms (title, subtitle, author, id, type, mime, partner), purchased / issued with <, <=, >, >= or = YYYY[-MM[-DD]]')
+s.add_argument('--store', metavar='FILE', default=default_store, help='inventory database (default: {})'.format(default_store))
+s.add_argument('--refresh', action='store_true', help='sync the inventory before searching')
+s.add_argument('--max-age', metavar='HOURS', type=float, default=24, help='sync the inventory if it is older than this (default: 24)')
+s.set_defaults(func=search)
+
 s = subparsers.add_parser('upload', help='upload a file (must be either .pdf or .epub)')
-s.add_argument('filename', metavar='FILE')
+s.add_argument('filename', metavar='FILE', help='file to upload, - for stdin, or a directory to upload all new files in it')
 s.add_argument('--name', help='specify an alternative name')
+s.add_argument('--progress', action='store_true', help='show upload progress and throughput')
+s.add_argument('--manifest', metavar='FILE', help='manifest of uploaded files for directories (default: DIR/.tolinomanifest.json)')
+s.add_argument('--workers', type=int, default=4, help='number of parallel uploads for directories (default: 4)')
 s.set_defaults(func=upload)
 
-s = subparsers.add_parser('download', help='download a document')
-s.add_argument('document_id')
+s = subparsers.add_parser('download', help='download one or more documents')
+s.add_argument('document_id', nargs='*')
+s.add_argument('--all', action='store_true', help='download every document in the inventory')
+s.add_argument('--dir', help='target directory (default: current directory)')
+s.add_argument('--workers', type=int, default=4, help='number of parallel downloads (default: 4)')
+s.add_argument('--segments', type=int, default=1, help='split large files into this many parallel range requests (default: 1)')
 s.set_defaults(func=download)
 
-s = subparsers.add_parser('delete', help='delete a document (be careful!)')
-s.add_argument('document_id')
+s = subparsers.add_parser('sync', help='keep a local directory of .pdf / .epub files and the cloud in step')
+s.add_argument('dir', metavar='DIR', help='local library directory')
+s.add_argument('--mode', choices=('both', 'upload', 'download'), default='both', help='both ways, or only change the cloud (upload) or only DIR (download) (default: both)')
+s.add_argument('--delete', action='store_true', help='also delete what was deleted on the other side (be careful!)')
+s.add_argument('--dry-run', action='store_true', help='only show what would be done')
+s.add_argument('--manifest', metavar='FILE', help='state of the last sync (default: DIR/.tolinosync.json)')
+s.add_argument('--workers', type=int, default=4, help='number of parallel transfers (default: 4)')
+s.set_defaults(func=sync)
+
+s = subparsers.add_parser('delete', help='delete documents by id or by inventory filter (be careful!)')
+s.add_argument('document_id', nargs='*', help='documents to delete; with filters, only those of them that match')
+s.add_argument('--type', choices=('edata', 'ebook'), help='delete documents of this type, edata for own uploads')
+s.add_argument('--mime', help='delete documents of this mimetype, e.g. application/pdf')
+s.add_argument('--before', metavar='YYYY-MM-DD', type=date_ms, help='delete documents uploaded / purchased before this day (UTC)')
+s.add_argument('--after', metavar='YYYY-MM-DD', type=date_ms, help='delete documents uploaded / purchased on or after this day (UTC)')
+s.add_argument('--workers', type=int, default=4, help='number of parallel deletions (default: 4)')
+s.add_argument('--dry-run', action='store_true', help='only show what would be deleted')
 s.set_defaults(func=delete)
 
-s = subparsers.add_parser('devices', help='list devices registered to cloud account')
+s = subparsers.add_parser('batch', help='run upload / download / delete operations listed one per line in FILE (default: stdin)')
+s.add_argument('file', metavar='FILE', nargs='?', type=argparse.FileType('r'), default=sys.stdin)
+s.set_defaults(func=batch)
+
+s = subparsers.add_parser('devices', help='list devices registered to cloud account, or prune them')
+s.add_argument('action', nargs='?', choices=('list', 'prune'), default='list', help='prune unregisters the devices matching all of the options below (be careful!)')
+s.add_argument('--unused-days', metavar='DAYS', type=float, help='prune devices not used for DAYS days')
+s.add_argument('--type', action='append', help='prune devices of this type, e.g. HTML5_1 (repeatable)')
+s.add_argument('--reseller', metavar='ID', type=int, action='append', help='prune devices registered with this partner id (repeatable)')
+s.add_argument('--dry-run', action='store_true', help='only show what would be pruned')
+add_format_arguments(s, Device)
 s.set_defaults(func=devices)
 
-s = subparsers.add_parser('unregister', help='unregister device from cloud account (be careful!)')
-s.add_argument('device_id')
+s = subparsers.add_parser('daemon', help='keep logged in sessions and serve inventory, devices, download, upload and delete to other calls over --daemon-socket')
+s.set_defaults(func=daemon)
+
+s = subparsers.add_parser('cache', help='show statistics of the --content-cache or clear it')
+s.add_argument('action', nargs='?', choices=('stats', 'clear'), default='stats')
+s.set_defaults(func=cache)
+
+s = subparsers.add_parser('refresh-completion', help='update the shell completion cache of document and device ids')
+s.set_defaults(func=refresh_completion)
+
+s = subparsers.add_parser('unregister', help='unregister devices from cloud account (be careful!)')
+s.add_argument('device_id', nargs='+')
 s.set_defaults(func=unregister)
 
 args = parser.parse_args(remaining_argv)
 
 if args.debug:
+    import logging
     logging.basicConfig(level=logging.DEBUG)
-    
+
+# one tracer for all accounts, written when the command is done
+args.tracer = None
+if args.trace:
+    import atexit
+    from tolinotrace import Tracer
+    args.tracer = Tracer()
+    atexit.register(args.tracer.write, args.trace)
+
 if args.partner == 0:
     print('List of partner ids available:')
-    for partner_id in sorted(TolinoCloud.partner_settings.keys()):
-        print('{} : {}'.format(partner_id, TolinoCloud.partner_name[partner_id]))
+    for partner_id in sorted(partner_settings.keys()):
+        print('{} : {}'.format(partner_id, partner_name[partner_id]))
     sys.exit(1)
 
-if (not args.user) or (not args.password):
-    print('Login credentials user/password required.')
+if not hasattr(args, 'func'):
     parser.print_help()
     sys.exit(1)
 
-if not hasattr(args, 'func'):
+# commands that need no login: the daemon gets the accounts and
+# passwords with its requests, the content cache is local
+if args.command in ('daemon', 'cache'):
+    args.func(args)
+    sys.exit(0)
+
+names = sorted(accounts) if args.all_accounts else args.account or []
+for name in names:
+    if not name in accounts:
+        print('no account section [{}] in {}.'.format(name, args.config))
+        sys.exit(1)
+if len(names) > 1:
+    if not args.command in fan_out_commands:
+        print('only {} can run for several accounts.'.format(', '.join(fan_out_commands)))
+        sys.exit(1)
+    run_accounts(args, names)
+if names:
+    args = account_args(args, names[0])
+
+if (not args.user) or (not args.password):
+    print('Login credentials user/password required.')
     parser.print_help()
     sys.exit(1)
 
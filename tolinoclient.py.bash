@@ -0,0 +1,88 @@
+#!/usr/bin/env bash
+#
+# Commandline completion in bash for tolinoclient.py
+#
+# Source this file, e.g. from ~/.bashrc. Document and device ids come
+# from the completion cache that tolinoclient.py keeps, through
+# tolinocomplete.py, without network access.
+
+_tolinoclient()
+{
+    local cur prev cmd word
+    cur="${COMP_WORDS[COMP_CWORD]}"
+    prev="${COMP_WORDS[COMP_CWORD-1]}"
+
+    for word in "${COMP_WORDS[@]:1:COMP_CWORD-1}"; do
+        case "$word" in
+            inventory|search|upload|download|sync|delete|batch|devices|unregister|refresh-completion|daemon|cache)
+                cmd="$word"
+                break
+                ;;
+        esac
+    done
+
+    case "$prev" in
+        --config|--completion-cache|--content-cache|--daemon-socket|--trace|--store|--manifest)
+            COMPREPLY=( $(compgen -f -- "$cur") )
+            return
+            ;;
+        --dir)
+            COMPREPLY=( $(compgen -d -- "$cur") )
+            return
+            ;;
+        --format)
+            COMPREPLY=( $(compgen -W "text json ndjson csv tsv" -- "$cur") )
+            return
+            ;;
+        --user|--password|--partner|--name|--workers|--segments|--account|--parallel-accounts|--mime|--before|--after|--unused-days|--reseller|--max-age|--content-cache-size|--content-max-age|--fields)
+            return
+            ;;
+    esac
+
+    if [[ "$cur" == -* ]]; then
+        case "$cmd" in
+            "")
+                COMPREPLY=( $(compgen -W "--help --config --user --password --partner --session-cache --keep-registration --account --all-accounts --parallel-accounts --debug --content-cache --content-cache-size --content-max-age --content-link --completion-cache --daemon-socket --no-daemon --trace" -- "$cur") )
+                ;;
+            download)
+                COMPREPLY=( $(compgen -W "--all --dir --workers --segments" -- "$cur") )
+                ;;
+            delete)
+                COMPREPLY=( $(compgen -W "--type --mime --before --after --workers --dry-run" -- "$cur") )
+                ;;
+            inventory)
+                COMPREPLY=( $(compgen -W "--store --offline --format --fields --iso-dates --no-header" -- "$cur") )
+                ;;
+            devices)
+                COMPREPLY=( $(compgen -W "--unused-days --type --reseller --dry-run --format --fields --iso-dates --no-header" -- "$cur") )
+                ;;
+        esac
+        return
+    fi
+
+    case "$cmd" in
+        "")
+            COMPREPLY=( $(compgen -W "inventory search upload download sync delete batch devices unregister refresh-completion daemon cache" -- "$cur") )
+            ;;
+        download|delete)
+            COMPREPLY=( $(tolinocomplete.py documents "$cur" --format bash 2>/dev/null) )
+            ;;
+        unregister)
+            COMPREPLY=( $(tolinocomplete.py devices "$cur" --format bash 2>/dev/null) )
+            ;;
+        devices)
+            COMPREPLY=( $(compgen -W "list prune" -- "$cur") )
+            ;;
+        cache)
+            COMPREPLY=( $(compgen -W "stats clear" -- "$cur") )
+            ;;
+        upload|batch)
+            COMPREPLY=( $(compgen -f -- "$cur") )
+            ;;
+        sync)
+            COMPREPLY=( $(compgen -d -- "$cur") )
+            ;;
+    esac
+}
+
+complete -F _tolinoclient tolinoclient.py
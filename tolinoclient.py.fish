@@ -30,6 +30,12 @@ function __fish_tolino_uses_command
   return 1 # no success
 end
 
+# Document or device ids with descriptions from the completion cache,
+# kept up to date by tolinoclient.py itself.
+function __fish_tolino_ids
+  tolinocomplete.py $argv[1] (commandline -ct) --format fish 2>/dev/null
+end
+
 # List possible partners IDs.
 # A tab separates the arguments from the description.
 function __fish_tolino_partners
@@ -45,11 +51,17 @@ complete -c $PROG --no-files
 
 # Subcommands
 complete -c $PROG -n '__fish_tolino_needs_command' -a 'inventory'  -d 'Fetch and print inventory'
+complete -c $PROG -n '__fish_tolino_needs_command' -a 'search'     -d 'Search the locally stored inventory'
 complete -c $PROG -n '__fish_tolino_needs_command' -a 'upload'     -d 'Upload a file (must be either .pdf or .epub)'
 complete -c $PROG -n '__fish_tolino_needs_command' -a 'download'   -d 'Download a document'
-complete -c $PROG -n '__fish_tolino_needs_command' -a 'delete'     -d 'Delete a document (be careful!)'
+complete -c $PROG -n '__fish_tolino_needs_command' -a 'sync'       -d 'Keep a local directory and the cloud in step'
+complete -c $PROG -n '__fish_tolino_needs_command' -a 'delete'     -d 'Delete documents (be careful!)'
+complete -c $PROG -n '__fish_tolino_needs_command' -a 'batch'      -d 'Run operations listed one per line in a file'
 complete -c $PROG -n '__fish_tolino_needs_command' -a 'devices'    -d 'List devices registered to cloud account'
-complete -c $PROG -n '__fish_tolino_needs_command' -a 'unregister' -d 'Unregister device from cloud account (be careful!)'
+complete -c $PROG -n '__fish_tolino_needs_command' -a 'unregister' -d 'Unregister devices from cloud account (be careful!)'
+complete -c $PROG -n '__fish_tolino_needs_command' -a 'daemon'     -d 'Keep sessions and serve other calls over a socket'
+complete -c $PROG -n '__fish_tolino_needs_command' -a 'cache'      -d 'Show content cache statistics or clear it'
+complete -c $PROG -n '__fish_tolino_needs_command' -a 'refresh-completion' -d 'Update the completion cache of document and device ids'
 
 # Options and flags
 complete -c $PROG -s h -l help -d 'Show help message and exit'
@@ -58,6 +70,35 @@ complete -c $PROG -l config    -d 'config file (default: .tolinoclientrc)' -r
 complete -c $PROG -l password  -d 'password' -x
 complete -c $PROG -l partner   -d 'shop/partner ID' -x -a "(__fish_tolino_partners)"
 complete -c $PROG -l debug     -d 'Log additional debugging info'
+complete -c $PROG -l content-cache -d 'Keep downloaded files and reuse them' -r
+complete -c $PROG -l content-cache-size -d 'Content cache size in MB' -x
+complete -c $PROG -l content-max-age -d 'Revalidate cached files older than HOURS' -x
+complete -c $PROG -l content-link -d 'Hard link cached files instead of copying them'
+complete -c $PROG -l daemon-socket -d 'Socket of the tolinoclient.py daemon' -r
+complete -c $PROG -l no-daemon -d 'Never go through a running daemon'
+complete -c $PROG -l completion-cache -d 'Completion cache of document and device ids' -r
 
 # Completion for parameters and subcommands
-complete -c $PROG -n '__fish_tolino_uses_command upload' -a "(__fish_complete_path)" -x
+complete -c $PROG -n '__fish_tolino_uses_command upload batch' -a "(__fish_complete_path)" -x
+complete -c $PROG -n '__fish_tolino_uses_command sync' -a "(__fish_complete_directories)" -x
+complete -c $PROG -n '__fish_tolino_uses_command download delete' -a "(__fish_tolino_ids documents)" -x
+complete -c $PROG -n '__fish_tolino_uses_command unregister' -a "(__fish_tolino_ids devices)" -x
+complete -c $PROG -n '__fish_tolino_uses_command cache' -a 'stats clear' -x
+complete -c $PROG -n '__fish_tolino_uses_command devices' -a 'list prune' -x
+complete -c $PROG -n '__fish_tolino_uses_command devices' -l unused-days -d 'Prune devices unused for DAYS days' -x
+complete -c $PROG -n '__fish_tolino_uses_command devices' -l type        -d 'Prune devices of this type' -x -a 'HTML5_1 tolino_vison unknown_imx50_rdp_1'
+complete -c $PROG -n '__fish_tolino_uses_command devices' -l reseller    -d 'Prune devices of this partner id' -x -a "(__fish_tolino_partners)"
+complete -c $PROG -n '__fish_tolino_uses_command devices' -l dry-run     -d 'Only show what would be pruned'
+complete -c $PROG -n '__fish_tolino_uses_command inventory devices' -l format    -d 'Output format' -x -a 'text json ndjson csv tsv'
+complete -c $PROG -n '__fish_tolino_uses_command inventory devices' -l fields    -d 'Comma separated fields to print' -x
+complete -c $PROG -n '__fish_tolino_uses_command inventory devices' -l iso-dates -d 'Print dates as ISO 8601 in UTC'
+complete -c $PROG -n '__fish_tolino_uses_command inventory devices' -l no-header -d 'Leave out the CSV / TSV header line'
+complete -c $PROG -n '__fish_tolino_uses_command sync' -l mode    -d 'Sync direction' -x -a 'both upload download'
+complete -c $PROG -n '__fish_tolino_uses_command sync' -l delete  -d 'Also delete what was deleted on the other side'
+complete -c $PROG -n '__fish_tolino_uses_command sync' -l dry-run -d 'Only show what would be done'
+complete -c $PROG -n '__fish_tolino_uses_command delete' -l type    -d 'Delete documents of this type' -x -a 'edata ebook'
+complete -c $PROG -n '__fish_tolino_uses_command delete' -l mime    -d 'Delete documents of this mimetype' -x -a 'application/pdf application/epub+zip'
+complete -c $PROG -n '__fish_tolino_uses_command delete' -l before  -d 'Delete documents uploaded before YYYY-MM-DD' -x
+complete -c $PROG -n '__fish_tolino_uses_command delete' -l after   -d 'Delete documents uploaded on or after YYYY-MM-DD' -x
+complete -c $PROG -n '__fish_tolino_uses_command delete' -l workers -d 'Number of parallel deletions' -x
+complete -c $PROG -n '__fish_tolino_uses_command delete' -l dry-run -d 'Only show what would be deleted'
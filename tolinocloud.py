@@ -28,15 +28,282 @@ import platform
 import json
 import base64
 import requests
+import urllib3
 import re
+import os
+import time
+import hashlib
+import shlex
+import threading
+import uuid
+import codecs
+import random
+import email.utils
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from urllib.parse import urlparse, parse_qs
 import logging
 from pprint import pformat
+from tolinorecords import InventoryItem, Device, Inventory
+import tolinopartners
 
 class TolinoException(Exception):
     pass
 
 
+def _iter_text(r, chunk_size):
+    # decoded text chunks of a streamed response body
+    decoder = codecs.getincrementaldecoder(r.encoding or 'utf-8')()
+    for chunk in r.iter_content(chunk_size=chunk_size):
+        yield decoder.decode(chunk)
+    yield decoder.decode(b'', True)
+
+
+def _iter_json(chunks, streamed, whole = (), opened = None):
+    # Scan a JSON document incrementally from an iterable of text chunks.
+    # Yields (path, element) for each element of the arrays found at a
+    # path in streamed and (path, value) for values at a path in whole,
+    # as soon as each one is complete. Paths are tuples of object keys.
+    # Only the current element is ever held in memory, everything else
+    # is skipped over. The paths of streamed arrays that were found get
+    # added to opened. Raises ValueError on malformed or truncated input.
+    decoder = json.JSONDecoder()
+    chunks = iter(chunks)
+    buf = ''
+    pos = 0
+    stack = []
+
+    def more():
+        nonlocal buf, pos
+        for chunk in chunks:
+            if chunk:
+                buf = buf[pos:] + chunk
+                pos = 0
+                return True
+        return False
+
+    while True:
+        # skip whitespace and separators, a ',' in an object means a key follows
+        while pos < len(buf) and buf[pos] in ' \t\r\n,:':
+            if buf[pos] == ',' and stack and stack[-1]['kind'] == '{':
+                stack[-1]['expect_key'] = True
+            pos += 1
+        if pos == len(buf):
+            if more():
+                continue
+            if stack:
+                raise ValueError('truncated JSON')
+            return
+
+        ch = buf[pos]
+        top = stack[-1] if stack else None
+        if ch in '}]':
+            stack.pop()
+            pos += 1
+            continue
+        if top and top['kind'] == '{' and top['expect_key']:
+            if ch != '"':
+                raise ValueError('object key expected')
+            try:
+                key, end = json.decoder.scanstring(buf, pos + 1)
+            except ValueError:
+                if more():
+                    continue
+                raise
+            top['key'] = key
+            top['expect_key'] = False
+            pos = end
+            continue
+
+        # a value starts here
+        if top is None:
+            path = ()
+        else:
+            path = top['path'] + ((top['key'],) if top['kind'] == '{' else (None,))
+        if ch == '{' and not (top and top['streamed']) and not path in whole:
+            stack.append({ 'kind' : '{', 'path' : path, 'key' : None, 'expect_key' : True, 'streamed' : False })
+            pos += 1
+        elif ch == '[' and not (top and top['streamed']) and not path in whole:
+            stack.append({ 'kind' : '[', 'path' : path, 'streamed' : path in streamed })
+            if path in streamed and opened is not None:
+                opened.add(path)
+            pos += 1
+        else:
+            # decode elements and wanted values, step over other scalars
+            try:
+                value, end = decoder.raw_decode(buf, pos)
+            except ValueError:
+                value, end = None, None
+            # a value not followed by a delimiter may be a cut off number
+            if end is None or end == len(buf) or not buf[end] in ' \t\r\n,:]}':
+                if more():
+                    continue
+                if end is None or end < len(buf):
+                    raise ValueError('malformed JSON')
+            pos = end
+            if top and top['streamed']:
+                yield top['path'], value
+            elif path in whole:
+                yield path, value
+
+
+def _completed(pool, func, items, window):
+    # Run func(item) for each of items in pool and yield the futures as
+    # they finish. Only window calls are submitted at a time, so when
+    # the caller stops early (closes the generator, an interrupt) the
+    # items not started yet never are, and leaving the pool only waits
+    # for the ones in progress.
+    items = iter(items)
+    pending = set()
+    try:
+        while True:
+            for item in items:
+                pending.add(pool.submit(func, item))
+                if len(pending) >= window:
+                    break
+            if not pending:
+                return
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for f in done:
+                yield f
+    finally:
+        for f in pending:
+            f.cancel()
+
+
+class MultipartStream:
+
+    # A multipart/form-data body with a single file field that is read
+    # piecewise while the request is being sent, so memory use stays flat
+    # no matter how large the file is. source is a binary file-like object
+    # or an iterable of bytes. Without a known size, requests sends the
+    # body with chunked transfer encoding.
+
+    def __init__(self, field, name, source, mime, size = None, progress = None):
+        self.boundary = uuid.uuid4().hex
+        self.content_type = 'multipart/form-data; boundary={}'.format(self.boundary)
+        self.head = ('--{}\r\n'
+            'Content-Disposition: form-data; name="{}"; filename="{}"\r\n'
+            'Content-Type: {}\r\n\r\n').format(
+                self.boundary, field, name.replace('"', '%22'), mime).encode('utf-8')
+        self.tail = '\r\n--{}--\r\n'.format(self.boundary).encode('utf-8')
+        self.size = None if size is None else len(self.head) + size + len(self.tail)
+        # requests takes the content length from here
+        self.len = self.size
+        self.progress = progress
+        self.sent = 0
+        self.buffer = b''
+        self.pos = 0
+        self.parts = self._parts(source)
+
+    def _parts(self, source):
+        yield self.head
+        if hasattr(source, 'read'):
+            while True:
+                chunk = source.read(TolinoCloud.buffer_size)
+                if not chunk:
+                    break
+                yield chunk
+        else:
+            for chunk in source:
+                if chunk:
+                    yield chunk
+        yield self.tail
+
+    def __iter__(self):
+        while True:
+            chunk = self.read(TolinoCloud.buffer_size)
+            if not chunk:
+                return
+            yield chunk
+
+    def read(self, size = -1):
+        # hand out the current part piecewise, without copying its rest
+        if self.pos >= len(self.buffer):
+            self.buffer = next(self.parts, b'')
+            self.pos = 0
+        if size < 0 or size >= len(self.buffer) - self.pos:
+            chunk = self.buffer[self.pos:]
+        else:
+            chunk = self.buffer[self.pos:self.pos + size]
+        self.pos += len(chunk)
+        self.sent += len(chunk)
+        if chunk and self.progress:
+            self.progress(self.sent, self.size)
+        return chunk
+
+
+class AdaptiveLimiter:
+
+    # Limits the number of requests in flight, shared by all workers of
+    # one TolinoCloud. The limit grows by one per limit successful
+    # requests (additive increase) and is halved when the server reports
+    # overload or answers much slower than usual (multiplicative
+    # decrease), like TCP congestion control, and only slowly near the
+    # limit of the last overload. Only requests sent after the last
+    # decrease can cause another one, so one burst of errors halves the
+    # limit once. pause() holds back all new requests, e.g.
+    # for the time a Retry-After header asks for.
+
+    def __init__(self, limit = 8, minimum = 1, maximum = 64, latency_factor = 4.0, latency_floor = 0.1):
+        self.limit = float(limit)
+        self.minimum = minimum
+        self.maximum = maximum
+        # slower than latency_factor times the usual latency counts as
+        # overload, unless it is below latency_floor seconds anyway
+        self.latency_factor = latency_factor
+        self.latency_floor = latency_floor
+        self.baseline = None
+        # the limit at which the server was overloaded last
+        self.ceiling = maximum
+        self.inflight = 0
+        self.paused_until = 0
+        self.decreased = 0
+        self.cond = threading.Condition()
+
+    def acquire(self):
+        # wait for a free slot, returns the start time for release()
+        with self.cond:
+            while True:
+                wait = self.paused_until - time.monotonic()
+                if wait <= 0 and self.inflight < int(self.limit):
+                    break
+                self.cond.wait(wait if wait > 0 else None)
+            self.inflight += 1
+            return time.monotonic()
+
+    def release(self):
+        with self.cond:
+            self.inflight -= 1
+            self.cond.notify_all()
+
+    def observe(self, started, overload = False, latency = None):
+        # adjust the limit to the answer of a request started at started
+        with self.cond:
+            if latency is not None and not overload:
+                if self.baseline is None or latency < self.baseline:
+                    self.baseline = latency
+                else:
+                    # let the baseline follow slowly when latency goes up for good
+                    self.baseline += (latency - self.baseline) * 0.01
+                if latency > max(self.latency_floor, self.latency_factor * self.baseline):
+                    overload = True
+            if overload:
+                if started >= self.decreased:
+                    self.ceiling = self.limit
+                    self.limit = max(self.minimum, self.limit / 2)
+                    self.decreased = time.monotonic()
+                    logging.debug('request limit lowered to {}'.format(int(self.limit)))
+            elif self.limit < self.maximum:
+                # close to where it overloaded last time, probe more carefully
+                step = 1 / self.limit if self.limit + 1 < self.ceiling else 1 / self.limit ** 2
+                self.limit = min(self.maximum, self.limit + step)
+                self.cond.notify_all()
+
+    def pause(self, seconds):
+        with self.cond:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
 class TolinoCloud:
 
     def _hardware_id():
@@ -93,195 +360,307 @@ class TolinoCloud:
 
     hardware_id = _hardware_id()
 
-    partner_name = {
-         1 : 'Telekom',
-         3 : 'Thalia.de',
-         4 : 'Thalia.at',
-         5 : 'Thalia.ch',
-         6 : 'Buch.de',
-         7 : 'buch.ch',
-         8 : 'Books.ch',
-        10 : 'Weltbild.de',
-        11 : 'Weltbild.at',
-        12 : 'Weltbild.ch',
-        13 : 'Hugendubel.de',
-        20 : 'derclub.de',
-        21 : 'otto-media.de',
-        22 : 'donauland.at',
-        30 : 'bücher.de',
-        40 : 'Bild.de', # defunct?
-        60 : 'StandaardBoekhandel.be',
-        80 : 'Libri.de',
-        81 : 'eBook.de',
-        90 : 'ibs.it'
-    }
-
-    partner_settings = {
-        3: {
-            # Thalia.de
-            'client_id'        : 'webshop01',
-            'scope'            : 'SCOPE_BOSH',
-            'signup_url'       : 'https://www.thalia.de/shop/home/kunde/neu/',
-            'profile_url'      : 'https://www.thalia.de/shop/home/kunde/',
-            'token_url'        : 'https://www.thalia.de/auth/oauth2/token',
-            'login_form_url'   : 'https://www.thalia.de/de.thalia.ecp.authservice.application/oauth2/login',
-            'x_buchde.skin_id' : '17',
-            'x_buchde.mandant_id' :'2',
-            'auth_url'         : 'https://www.thalia.de/de.thalia.ecp.authservice.application/oauth2/authorize',
-            'login_url'        : 'https://www.thalia.de/de.thalia.ecp.authservice.application/login.do',
-            # 'revoke_url'       : 'https://www.thalia.de/de.buch.appservices/api/2004/oauth2/revoke',
-            'login_form'       : {
-                'username' : 'j_username',
-                'password' : 'j_password',
-                'extra'    : {
-                    'login' : ''
-                    }
-             },
-            'login_cookie'     : 'OAUTH-JSESSIONID',
-            'logout_url'       : 'https://www.thalia.de/shop/home/login/logout/',
-            'reader_url'       : 'https://webreader.mytolino.com/library/index.html#/mybooks/titles',
-            'register_url'     : 'https://bosh.pageplace.de/bosh/rest/v2/registerhw',
-            'devices_url'      : 'https://bosh.pageplace.de/bosh/rest/handshake/devices/list',
-            'unregister_url'   : 'https://bosh.pageplace.de/bosh/rest/handshake/devices/delete',
-            'upload_url'       : 'https://bosh.pageplace.de/bosh/rest/upload',
-            'delete_url'       : 'https://bosh.pageplace.de/bosh/rest/deletecontent',
-            'inventory_url'    : 'https://bosh.pageplace.de/bosh/rest/inventory/delta',
-            'downloadinfo_url' : 'https://bosh.pageplace.de/bosh/rest//cloud/downloadinfo/{}/{}/type/external-download'
-            },
-        4: {
-            # Thalia.at
-            'client_id'        : 'webshop01',
-            'scope'            : 'SCOPE_BOSH SCOPE_BUCHDE',
-            'signup_url'       : 'https://www.thalia.at/shop/home/kunde/neu/',
-            'profile_url'      : 'https://www.thalia.at/shop/home/kunde/',
-            'token_url'        : 'https://www.thalia.at/de.buch.appservices/api/4004/oauth2/token',
-            'login_form_url'   : 'https://www.thalia.at/de.thalia.ecp.authservice.application/oauth2/login',
-            'x_buchde.skin_id' : '17',
-            'x_buchde.mandant_id' : '4',
-            'auth_url'         : 'https://www.thalia.at/de.thalia.ecp.authservice.application/oauth2/authorize',
-            'login_url'        : 'https://www.thalia.at/de.thalia.ecp.authservice.application/login.do',
-            # 'revoke_url'       : 'https://www.thalia.de/de.buch.appservices/api/2004/oauth2/revoke',
-            'login_form'       : {
-                'username' : 'j_username',
-                'password' : 'j_password',
-                'extra'    : {
-                    'login' : ''
-                }
-             },
-            'login_cookie'     : 'OAUTH-JSESSIONID',
-            'logout_url'       : 'https://www.thalia.at/shop/home/show/',
-            'reader_url'       : 'https://webreader.mytolino.com/library/index.html#/mybooks/titles',
-            'register_url'     : 'https://bosh.pageplace.de/bosh/rest/v2/registerhw',
-            'devices_url'      : 'https://bosh.pageplace.de/bosh/rest/handshake/devices/list',
-            'unregister_url'   : 'https://bosh.pageplace.de/bosh/rest/handshake/devices/delete',
-            'upload_url'       : 'https://bosh.pageplace.de/bosh/rest/upload',
-            'delete_url'       : 'https://bosh.pageplace.de/bosh/rest/deletecontent',
-            'inventory_url'    : 'https://bosh.pageplace.de/bosh/rest/inventory/delta',
-            'downloadinfo_url' : 'https://bosh.pageplace.de/bosh/rest//cloud/downloadinfo/{}/{}/type/external-download'
-            },
-         6: {
-            # Buch.de'
-            'client_id'        : 'webshop01',
-            'scope'            : 'SCOPE_BOSH SCOPE_BUCHDE',
-            'signup_url'       : 'https://ssl.buch.de/shop/home/kunde/neu/',
-            'profile_url'      : 'https://ssl.buch.de/shop/home/kunde/',
-            'login_url'        : 'https://ssl.buch.de/shop/home/login/dologin/',
-            'login_form'       : {
-                'username' : 'username',
-                'password' : 'password',
-                'extra'    : {}
-             },
-            'login_cookie'     : 'KUNDE',
-            'tat_url'          : 'https://ssl.buch.de/shop/home/ebook/anzeigen/',
-            'logout_url'       : 'https://ssl.buch.de/shop/home/login/logout/',
-            'reader_url'       : 'https://html5reader.buch.de/library/library.html#!/library',
-            'register_url'     : 'https://bosh.pageplace.de/bosh/rest/registerhw',
-            'devices_url'      : 'https://bosh.pageplace.de/bosh/rest/handshake/devices/list',
-            'unregister_url'   : 'https://bosh.pageplace.de/bosh/rest/handshake/devices/delete',
-            'upload_url'       : 'https://bosh.pageplace.de/bosh/rest/upload',
-            'delete_url'       : 'https://bosh.pageplace.de/bosh/rest/deletecontent',
-            'inventory_url'    : 'https://bosh.pageplace.de/bosh/rest/inventory/delta',
-            'downloadinfo_url' : 'https://bosh.pageplace.de/bosh/rest//cloud/downloadinfo/{}/{}/type/external-download'
-            },
-        13: {
-            # Hugendubel.de
-            'client_id'        : '4c20de744aa8b83b79b692524c7ec6ae',
-            'scope'            : 'ebook_library',
-            'signup_url'       : 'https://www.hugendubel.de/go/my_my/my_newRegistration/',
-            'profile_url'      : 'https://www.hugendubel.de/go/my_my/my_data/',
-            'token_url'        : 'https://api.hugendubel.de/rest/oauth2/token',
-            # 'revoke_url'       : 'https://api.hugendubel.de/rest/oauth2/revoke',
-            'auth_url'         : 'https://www.hugendubel.de/oauth/authorize',
-            'login_url'        : 'https://www.hugendubel.de/de/account/login',
-            'login_form'       : {
-                'username' : 'username',
-                'password' : 'password',
-                'extra'    : {
-                    'evaluate'           : 'true',
-                    'isOrdering'         : '',
-                    'isOneClickOrdering' : ''
-                }
-            },
-            'login_cookie'     : 'JSESSIONID',
-            'logout_url'       : 'https://www.hugendubel.de/de/account/logout',
-            'reader_url'       : 'https://webreader.hugendubel.de/library/index.html',
-            'register_url'     : 'https://bosh.pageplace.de/bosh/rest/registerhw',
-            'devices_url'      : 'https://bosh.pageplace.de/bosh/rest/handshake/devices/list',
-            'unregister_url'   : 'https://bosh.pageplace.de/bosh/rest/handshake/devices/delete',
-            'upload_url'       : 'https://bosh.pageplace.de/bosh/rest/upload',
-            'delete_url'       : 'https://bosh.pageplace.de/bosh/rest/deletecontent',
-            'inventory_url'    : 'https://bosh.pageplace.de/bosh/rest/inventory/delta',
-            'downloadinfo_url' : 'https://bosh.pageplace.de/bosh/rest//cloud/downloadinfo/{}/{}/type/external-download'
-        },
-        30: {
-            # buecher.de
-            'client_id'        : 'dte_ereader_app_01',
-            'scope'            : 'ebook_library',
-            'signup_url'       : 'https://www.buecher.de/go/my_dry/my_register_aos/',
-            'profile_url'      : 'https://www.buecher.de/go/my_dry/my_login/receiver_object/my_login/',
-            'token_url'        : 'https://www.buecher.de/oauth2/token',
-            'revoke_url'       : 'https://www.buecher.de/oauth2/revoke',
-            'auth_url'         : 'https://www.buecher.de/oauth2/authorize',
-            'login_url'        : 'https://www.buecher.de/go/my_dry/my_login/',
-            'login_form'       : {
-                'username' : 'form[login]',
-                'password' : 'form[password]',
-                'extra'    : {
-                    'form_send' : '1'
-                }
-            },
-            'x_buecherde.skin_id' : 'de_dte_tolino',
-            'login_cookie'     : 'session',
-            'logout_url'       : 'https://www.buecher.de/go/my_dry/my_logout/',
-            'reader_url'       : 'https://webreader.mytolino.com/library/',
-            'register_url'     : 'https://bosh.pageplace.de/bosh/rest/v2/registerhw',
-            'devices_url'      : 'https://bosh.pageplace.de/bosh/rest/handshake/devices/list',
-            'unregister_url'   : 'https://bosh.pageplace.de/bosh/rest/handshake/devices/delete',
-            'upload_url'       : 'https://bosh.pageplace.de/bosh/rest/upload',
-            'delete_url'       : 'https://bosh.pageplace.de/bosh/rest/deletecontent',
-            'inventory_url'    : 'https://bosh.pageplace.de/bosh/rest/inventory/delta',
-            'downloadinfo_url' : 'https://bosh.pageplace.de/bosh/rest//cloud/downloadinfo/{}/{}/type/external-download'
-        }
-    }
+    partner_name = tolinopartners.partner_name
+
+    partner_settings = tolinopartners.partner_settings
+
+    # refresh the oauth access token if it expires within this many seconds
+    token_margin = 300
+
+    # downloads are copied through a buffer of this size
+    buffer_size = 1024 * 1024
 
-    def __init__(self, partner_id):
+    # only files at least this large are split into parallel range requests
+    segment_min_size = 8 * 1024 * 1024
+
+    # answers that mean the server is overloaded and the request may be
+    # tried again, how often to retry and the backoff delays in seconds
+    retry_statuses = (429, 500, 502, 503, 504)
+    retries = 4
+    retry_base_delay = 0.5
+    retry_max_delay = 60
+
+    # answers a device call gets when its hardware id isn't registered
+    # (any more); with keep_registration they register it again
+    device_rejections = (400, 403)
+
+    def __init__(self, partner_id, session_cache = None, keep_registration = False, tracer = None,
+            content_store = None):
         self.partner_id = partner_id
+        # a tolinotrace.Tracer to collect per-phase metrics, None disables it
+        self.tracer = tracer
+        # a tolinocontent.ContentStore that keeps downloaded files, so they
+        # aren't transferred again; None disables it
+        self.content_store = content_store
         self.session = requests.session()
+        # connections the session's adapters pool per host, see _size_pool()
+        self.pool_size = requests.adapters.DEFAULT_POOLSIZE
+        # directory for the optional on-disk session cache, None disables it
+        self.session_cache = session_cache
+        # register our hardware_id once and keep it registered, instead of
+        # registering and unregistering around every command
+        self.keep_registration = keep_registration
+        self.registered = False
+        # counts register() calls, so concurrent workers that all saw
+        # their request rejected only register once
+        self.registrations = 0
+        # guards token renewal and registration against concurrent workers
+        self.lock = threading.RLock()
+        # paces all requests of this session to what the server can take
+        self.limiter = AdaptiveLimiter()
+        # id -> (expiry, download info), see download_info_ttl
+        self.download_infos = {}
+        self.download_info_stats = { 'hits' : 0, 'misses' : 0, 'stale' : 0 }
+        self.download_info_lock = threading.Lock()
+        self.username = None
+        self.password = None
+        self.access_token = None
+        self.refresh_token = None
+        self.token_expires = None
 
-    def _debug(self, r):
-        if logging.getLogger().getEffectiveLevel() >= logging.DEBUG:
+    def _response(self, r, phase, body = True):
+        # every response passes here: trace it if enabled, dump it to the
+        # debug log if that is enabled, and do nothing else otherwise
+        if self.tracer is not None:
+            self.tracer.response(phase, r, body)
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
             logging.debug('-------------------- HTTP response --------------------')
             logging.debug('status code: {}'.format(r.status_code))
             logging.debug('cookies: {}'.format(pformat(r.cookies)))
             logging.debug('headers: {}'.format(pformat(r.headers)))
-            try:
-                j = r.json()
-                logging.debug('json: {}'.format(pformat(j)))
-            except:
+            # never touch binary or streamed bodies
+            ctype = r.headers.get('content-type', '') if body else ''
+            if 'json' in ctype:
+                try:
+                    logging.debug('json: {}'.format(pformat(r.json())))
+                except ValueError:
+                    logging.debug('text: {}'.format(r.text))
+            elif ctype.startswith('text/'):
                 logging.debug('text: {}'.format(r.text))
             logging.debug('-------------------------------------------------------')
 
+    def _session_file(self):
+        if not self.session_cache or not self.username:
+            return None
+        user = hashlib.sha1(self.username.encode('utf-8')).hexdigest()
+        return os.path.join(os.path.expanduser(self.session_cache),
+            'session-{}-{}.json'.format(self.partner_id, user))
+
+    def _load_session(self):
+        fn = self._session_file()
+        if not fn:
+            return False
+        try:
+            with open(fn) as f:
+                j = json.load(f)
+            self.access_token = j['access_token']
+            self.refresh_token = j['refresh_token']
+            self.token_expires = j['token_expires']
+            self.registered = j.get('registered') == TolinoCloud.hardware_id
+            for cookie in j['cookies']:
+                self.session.cookies.set(cookie['name'], cookie['value'],
+                    domain=cookie['domain'], path=cookie['path'])
+        except (OSError, ValueError, KeyError, TypeError):
+            return False
+        logging.debug('loaded session from {}'.format(fn))
+        return True
+
+    def _save_session(self):
+        fn = self._session_file()
+        if not fn:
+            return
+        os.makedirs(os.path.dirname(fn), mode=0o700, exist_ok=True)
+        # the cache holds credentials: write it privately, then swap it in
+        tmp = fn + '.tmp'
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            json.dump({
+                'access_token'  : self.access_token,
+                'refresh_token' : self.refresh_token,
+                'token_expires' : self.token_expires,
+                'registered'    : TolinoCloud.hardware_id if self.registered else None,
+                'cookies'       : [ {
+                    'name'   : cookie.name,
+                    'value'  : cookie.value,
+                    'domain' : cookie.domain,
+                    'path'   : cookie.path
+                } for cookie in self.session.cookies ]
+            }, f)
+        os.replace(tmp, fn)
+
+    def _drop_session(self):
+        fn = self._session_file()
+        if fn and os.path.exists(fn):
+            os.remove(fn)
+
+    def _token_valid(self):
+        if not self.access_token:
+            return False
+        if self.token_expires is None:
+            # tat_url partners don't tell us, rely on the 401 retry
+            return True
+        return self.token_expires - time.time() > self.token_margin
+
     def login(self, username, password):
+        self.username = username
+        self.password = password
+
+        # Reuse a cached session, refreshing it if it is about to expire
+        if self._load_session():
+            if self._token_valid():
+                return
+            try:
+                self.refresh()
+                return
+            except TolinoException:
+                logging.debug('token refresh failed, logging in again')
+
+        self._login(username, password)
+        self._save_session()
+
+    def refresh(self):
+        s = self.session;
+        c = self.partner_settings[self.partner_id]
+
+        if not self.refresh_token or not 'token_url' in c:
+            raise TolinoException('oauth token refresh not supported.')
+
+        r = s.post(c['token_url'], data = {
+            'client_id'     : c['client_id'],
+            'grant_type'    : 'refresh_token',
+            'refresh_token' : self.refresh_token,
+            'scope'         : c['scope']
+        }, verify=True, allow_redirects=False)
+        self._response(r, 'refresh')
+        if r.status_code != 200:
+            raise TolinoException('oauth token refresh failed.')
+        try:
+            j = r.json()
+            self.access_token = j['access_token']
+            self.refresh_token = j.get('refresh_token', self.refresh_token)
+            self.token_expires = int(time.time()) + int(j['expires_in'])
+        except:
+            raise TolinoException('oauth token refresh failed.')
+        self._save_session()
+
+    def _reauthenticate(self, rejected_token):
+        with self.lock:
+            if self.access_token != rejected_token:
+                # another worker already renewed it
+                return
+            try:
+                self.refresh()
+            except TolinoException:
+                if self.password is None:
+                    raise
+                self._login(self.username, self.password)
+                self._save_session()
+
+    def _reregister(self, rejected_registration):
+        with self.lock:
+            if self.registrations != rejected_registration:
+                return
+            self.registered = False
+            self.register()
+
+    def _send(self, send, phase, stream):
+        # One request through the limiter. A streamed response keeps its
+        # slot until it is closed, as the server is busy sending it.
+        started = self.limiter.acquire()
+        try:
+            r = send()
+        except BaseException as e:
+            self.limiter.release()
+            if isinstance(e, (requests.ConnectionError, requests.Timeout)):
+                self.limiter.observe(started, overload=True)
+            raise
+        # an upload's time to answer is mostly the time to send its body
+        self.limiter.observe(started, r.status_code in self.retry_statuses,
+            None if phase == 'upload' else r.elapsed.total_seconds())
+        if stream:
+            close = r.close
+            released = []
+            def release_on_close():
+                if not released:
+                    released.append(True)
+                    self.limiter.release()
+                close()
+            r.close = release_on_close
+        else:
+            self.limiter.release()
+        self._response(r, phase, not stream)
+        return r
+
+    def _discard(self, r):
+        # read the short error body, so the connection can be reused
+        r.content
+        r.close()
+
+    def _retry_delay(self, attempt, r = None):
+        # the server's Retry-After if given, jittered exponential backoff otherwise
+        after = r.headers.get('retry-after') if r is not None else None
+        if after:
+            try:
+                delay = float(after)
+            except ValueError:
+                try:
+                    delay = email.utils.parsedate_to_datetime(after).timestamp() - time.time()
+                except (TypeError, ValueError):
+                    delay = None
+            if delay is not None:
+                delay = min(max(delay, 0), self.retry_max_delay)
+                self.limiter.pause(delay)
+                return delay + random.uniform(0, self.retry_base_delay)
+        return random.uniform(0, min(self.retry_max_delay, self.retry_base_delay * 2 ** attempt))
+
+    def _call(self, send, phase, device = False, stream = False, idempotent = False, expected = ()):
+        # send() builds the request from the current access token, so
+        # it can simply be repeated after an expired token got renewed.
+        # expected are the statuses the caller handles itself, they are
+        # never taken for a rejected device.
+        #
+        # Overload answers (retry_statuses) and connection failures are
+        # retried up to retries times, after a backoff delay, if the
+        # request is idempotent. A 429 means the request was turned away
+        # before it did anything, so it is retried in any case.
+        attempt = 0
+        while True:
+            token = self.access_token
+            registration = self.registrations
+            try:
+                r = self._send(send, phase, stream)
+                if r.status_code == 401 and self.username:
+                    logging.debug('access token rejected, renewing it')
+                    self._discard(r)
+                    self._reauthenticate(token)
+                    r = self._send(send, phase, stream)
+                # A kept registration may have been removed on the server side,
+                # e.g. through the web reader. The bosh api has no distinct error
+                # for this, so a device rejection re-registers once and retries.
+                if (device and self.keep_registration and self.registered and
+                        r.status_code in self.device_rejections and not r.status_code in expected):
+                    logging.debug('request rejected, registering {} again'.format(TolinoCloud.hardware_id))
+                    self._discard(r)
+                    self._reregister(registration)
+                    r = self._send(send, phase, stream)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if not idempotent or attempt >= self.retries:
+                    raise
+                delay = self._retry_delay(attempt)
+                logging.debug('{} failed ({}), retrying in {:.1f}s'.format(phase, e, delay))
+            else:
+                if (not r.status_code in self.retry_statuses or attempt >= self.retries or
+                        not (idempotent or r.status_code == 429)):
+                    return r
+                delay = self._retry_delay(attempt, r)
+                logging.debug('{} answered {}, retrying in {:.1f}s'.format(phase, r.status_code, delay))
+                self._discard(r)
+            if self.tracer is not None:
+                self.tracer.record(phase + '.retry', delay)
+            attempt += 1
+            time.sleep(delay)
+
+    def _login(self, username, password):
         s = self.session;
         c = self.partner_settings[self.partner_id]
 
@@ -296,13 +675,14 @@ class TolinoCloud:
                 'x_buchde.skin_id': c['x_buchde.skin_id'],
                 'x_buchde.mandant_id' : c['x_buchde.mandant_id']
             }, verify=True, allow_redirects=False)
-        data = c['login_form']['extra']
+            self._response(r, 'login.form')
+        data = dict(c['login_form']['extra'])
         data[c['login_form']['username']] = username
         data[c['login_form']['password']] = password
         r = s.post(c['login_url'], data=data, verify=True)
         logging.debug(data)
         logging.debug(c['login_cookie'])
-        self._debug(r)
+        self._response(r, 'login.post')
         if not c['login_cookie'] in s.cookies:
             raise TolinoException('login to {} failed.'.
                 format(self.partner_name[self.partner_id]))
@@ -310,7 +690,7 @@ class TolinoCloud:
         if 'tat_url' in c:
             try:
                 r = s.get(c['tat_url'], verify=True)
-                self._debug(r)
+                self._response(r, 'login.tat')
                 b64 = re.search(r'\&tat=(.*?)%3D', r.text).group(1)
                 self.access_token = base64.b64decode(b64+'==').decode('utf-8')
             except:
@@ -327,7 +707,7 @@ class TolinoCloud:
                 params['x_buchde.skin_id'] = c['x_buchde.skin_id']
                 params['x_buchde.mandant_id'] = c['x_buchde.mandant_id']
             r = s.get(c['auth_url'], params=params, verify=True, allow_redirects=False)
-            self._debug(r)
+            self._response(r, 'login.auth')
             try:
                 params = parse_qs(urlparse(r.headers['Location']).query)
                 auth_code = params['code'][0]
@@ -342,12 +722,12 @@ class TolinoCloud:
                 'scope'        : c['scope'],
                 'redirect_uri' : c['reader_url']
             }, verify=True, allow_redirects=False)
-            self._debug(r)
+            self._response(r, 'login.token')
             try:
                 j = r.json()
                 self.access_token = j['access_token']
                 self.refresh_token = j['refresh_token']
-                self.token_expires = int(j['expires_in'])
+                self.token_expires = int(time.time()) + int(j['expires_in'])
             except:
                 raise TolinoException('oauth access token request failed.')
 
@@ -355,6 +735,8 @@ class TolinoCloud:
         s = self.session;
         c = self.partner_settings[self.partner_id]
 
+        self._drop_session()
+
         if 'revoke_url' in c:
             r = s.post(c['revoke_url'],
                 data = {
@@ -363,12 +745,12 @@ class TolinoCloud:
                     'token'      : self.refresh_token
                 }
             )
-            self._debug(r)
+            self._response(r, 'logout')
             if r.status_code != 200:
                 raise TolinoException('logout failed.')
         else:
             r = s.post(c['logout_url'])
-            self._debug(r)
+            self._response(r, 'logout')
             if r.status_code != 200:
                 raise TolinoException('logout failed.')
 
@@ -377,8 +759,11 @@ class TolinoCloud:
         s = self.session;
         c = self.partner_settings[self.partner_id]
 
+        if self.keep_registration and self.registered:
+            return
+
         # Register our hardware
-        r = s.post(c['register_url'],
+        r = self._call(lambda: s.post(c['register_url'],
               data = json.dumps({'hardware_name':'other'}),
               headers = {
                 'content-type': 'application/json',
@@ -389,47 +774,77 @@ class TolinoCloud:
                 'client_version': '4.4.1',
                 'hardware_type': 'HTML5'
               }
-        )
-        self._debug(r)
+        ), 'register')
         if r.status_code != 200:
             raise TolinoException('register {} failed.'.format(TolinoCloud.hardware_id))
+        self.registered = True
+        self.registrations += 1
+        self._save_session()
+
+    # at most this many devices are unregistered per request
+    unregister_chunk_size = 50
 
     def unregister(self, device_id = hardware_id):
+        # device_id is one id or a list of ids or device records (as from
+        # devices()); they are unregistered with as few requests as
+        # possible, unregister_chunk_size at a time
         s = self.session;
         c = self.partner_settings[self.partner_id]
 
-        r = s.post(c['unregister_url'],
-            data = json.dumps({
-                'deleteDevicesRequest':{
-                    'accounts' : [ {
-                        'auth_token'  : self.access_token,
-                        'reseller_id' : self.partner_id
-                    } ],
-                    'devices'  : [ {
-                        'device_id'   : device_id,
-                        'reseller_id' : self.partner_id
-                    } ]
+        if isinstance(device_id, (str, Device)):
+            device_id = [device_id]
+        devs = [ {
+            'device_id'   : d['id'] if isinstance(d, Device) else d,
+            'reseller_id' : d['partner'] if isinstance(d, Device) else self.partner_id
+        } for d in device_id ]
+
+        for first in range(0, len(devs), self.unregister_chunk_size):
+            chunk = devs[first:first + self.unregister_chunk_size]
+            ids = ', '.join(d['device_id'] for d in chunk)
+            r = self._call(lambda: s.post(c['unregister_url'],
+                data = json.dumps({
+                    'deleteDevicesRequest':{
+                        'accounts' : [ {
+                            'auth_token'  : self.access_token,
+                            'reseller_id' : self.partner_id
+                        } ],
+                        'devices'  : chunk
+                    }
+                }),
+                headers = {
+                    'content-type': 'application/json',
+                    't_auth_token': self.access_token,
+                    'reseller_id' : str(self.partner_id)
                 }
-            }),
-            headers = {
-                'content-type': 'application/json',
-                't_auth_token': self.access_token,
-                'reseller_id' : str(self.partner_id)
-            }
-        )
-        self._debug(r)
-        if r.status_code != 200:
-            try:
-                j = r.json()
-                raise TolinoException('unregister {} failed: {}'.format(device_id, j['ResponseInfo']['message']))
-            except KeyError:
-                raise TolinoException('unregister {} failed: reason unknown.'.format(device_id))
+            ), 'unregister')
+            if r.status_code != 200:
+                try:
+                    j = r.json()
+                    raise TolinoException('unregister {} failed: {}'.format(ids, j['ResponseInfo']['message']))
+                except (KeyError, ValueError):
+                    raise TolinoException('unregister {} failed: reason unknown.'.format(ids))
+            if any(d['device_id'] == TolinoCloud.hardware_id for d in chunk):
+                self.registered = False
+                self._save_session()
+
+    def select_devices(self, devs, unused_days = None, types = None, partners = None):
+        # The devices matching all given conditions: not used for at
+        # least unused_days, of one of the types (raw like HTML5_1 or
+        # readable like 'web browser') and registered with one of the
+        # partners. This client's own registration is never selected.
+        now = time.time() * 1000
+        types = None if types is None else set(Device.types.get(t, t) for t in types)
+        return [d for d in devs
+            if d['id'] != TolinoCloud.hardware_id
+            and (unused_days is None or now - d['lastusage'] >= unused_days * 86400000)
+            and (types is None or d['type'] in types)
+            and (partners is None or d['partner'] in partners)]
 
     def devices(self):
         s = self.session;
         c = self.partner_settings[self.partner_id]
 
-        r = s.post(c['devices_url'],
+        r = self._call(lambda: s.post(c['devices_url'],
             data = json.dumps({
                 'deviceListRequest':{
                     'accounts' : [ {
@@ -443,8 +858,7 @@ class TolinoCloud:
                 't_auth_token': self.access_token,
                 'reseller_id'        : str(self.partner_id)
             }
-        )
-        self._debug(r)
+        ), 'devices', idempotent=True)
         if r.status_code != 200:
             raise TolinoException('device list request failed.')
 
@@ -452,92 +866,168 @@ class TolinoCloud:
             devs = []
             j = r.json()
             for item in j['deviceListResponse']['devices']:
-                devs.append({
-                    'id'         : item['deviceId'],
-                    'name'       : item['deviceName'],
-                    'type'       : {
-                        'unknown_imx50_rdp_1' : 'tolino shine',
-                        'tolino_vison'        : 'tolino vision',
-                        'HTML5_1'             : 'web browser'
-                        }.get(item['deviceType'], item['deviceType']),
-                    'partner'    : int(item['resellerId']),
-                    'registered' : int(item['deviceRegistered']),
-                    'lastusage'  : int(item['deviceLastUsage'])
-                })
+                devs.append(self._parse_device(item))
             return devs
         except:
             raise TolinoException('device list request failed.')
 
+    def _parse_device(self, item):
+        return Device(
+            id         = item['deviceId'],
+            name       = item['deviceName'],
+            type       = item['deviceType'],
+            partner    = int(item['resellerId']),
+            registered = int(item['deviceRegistered']),
+            lastusage  = int(item['deviceLastUsage'])
+        )
+
     def _parse_metadata(self, j):
         try:
-            md = {
-                'partner'     : int(j['resellerId']),
-                'id'          : j['epubMetaData']['identifier'],
-                'title'       : j['epubMetaData']['title'],
-                'subtitle'    : j['epubMetaData']['subtitle'],
-                'author'      : [a['name'] for a in j['epubMetaData']['author']],
-                'mime'        : j['epubMetaData']['deliverable'][0]['contentFormat'],
-                'type'        : j['epubMetaData']['type'].lower(),
-                'purchased'   : int(j['epubMetaData']['deliverable'][0]['purchased'])
-            }
-            if j['epubMetaData']['issued']:
-                md['issued'] = int(j['epubMetaData']['issued'])
-            return md
+            return InventoryItem(
+                partner   = int(j['resellerId']),
+                id        = j['epubMetaData']['identifier'],
+                title     = j['epubMetaData']['title'],
+                subtitle  = j['epubMetaData']['subtitle'],
+                author    = [a['name'] for a in j['epubMetaData']['author']],
+                mime      = j['epubMetaData']['deliverable'][0]['contentFormat'],
+                type      = j['epubMetaData']['type'].lower(),
+                purchased = int(j['epubMetaData']['deliverable'][0]['purchased']),
+                issued    = int(j['epubMetaData']['issued']) if j['epubMetaData']['issued'] else None
+            )
         except:
             raise TolinoException('could not parse metadata')
 
-    def inventory(self):
+    # the delta endpoint takes the sync position of an earlier answer in
+    # this parameter and reports the current one in the same field
+    inventory_sync_key = 'lastSync'
+
+    # the inventory is parsed from the response in pieces of this size
+    inventory_chunk_size = 64 * 1024
+
+    def iter_inventory(self, since = None, info = None):
+        # Yield the inventory items one by one, parsed from the response
+        # while it is still being received. since asks for a delta as in
+        # inventory_delta(); if info is a dict, the sync position and the
+        # ids reported as removed are stored in it when the response
+        # carries them.
         s = self.session;
         c = self.partner_settings[self.partner_id]
 
-        r = s.get(c['inventory_url'],
-            params = {'strip': 'true'},
+        params = {'strip': 'true'}
+        if since is not None:
+            params[self.inventory_sync_key] = since
+        r = self._call(lambda: s.get(c['inventory_url'],
+            params = params,
+            stream = True,
             headers = {
                 't_auth_token' : self.access_token,
                 'hardware_id'  : TolinoCloud.hardware_id,
                 'reseller_id'  : str(self.partner_id)
             }
-        )
-        self._debug(r)
-        if r.status_code != 200:
-            raise TolinoException('inventory list request failed.')
-
+        ), 'inventory', device=True, stream=True, idempotent=True)
+        start = time.perf_counter() if self.tracer is not None else None
         try:
-            inv = []
-            j = r.json()
+            if r.status_code != 200:
+                raise TolinoException('inventory list request failed.')
+
             # edata = own documents uploaded to Tolino Cloud
-            for item in j['PublicationInventory']['edata']:
-                inv.append(self._parse_metadata(item))
             # ebook = purchased ebooks in Tolino Cloud
-            for item in j['PublicationInventory']['ebook']:
-                inv.append(self._parse_metadata(item))
-            return inv
-        except:
+            streamed = set(('PublicationInventory', t) for t in ('edata', 'ebook'))
+            whole = set(('PublicationInventory', k) for k in (self.inventory_sync_key, 'deleted'))
+            opened = set()
+            for path, value in _iter_json(_iter_text(r, self.inventory_chunk_size), streamed, whole, opened):
+                if path in streamed:
+                    yield self._parse_metadata(value)
+                elif info is not None:
+                    info[path[-1]] = value
+            if opened != streamed:
+                raise TolinoException('inventory list request failed.')
+        except ValueError:
             raise TolinoException('inventory list request failed.')
+        finally:
+            if start is not None:
+                self.tracer.record('inventory.parse', time.perf_counter() - start, bytes_in=r.raw.tell())
+            r.close()
+
+    def inventory_delta(self, since = None):
+        # Fetch the inventory, or only what changed since the sync
+        # position of an earlier call. Returns the parsed items, the ids
+        # the server reports as removed, the new sync position and whether
+        # the answer was a delta at all; an answer without sync position
+        # is a full snapshot.
+        info = {}
+        inv = list(self.iter_inventory(since, info))
+        position = info.get(self.inventory_sync_key)
+        return {
+            'items'    : inv,
+            'removed'  : [str(id) for id in info.get('deleted') or []],
+            'position' : position,
+            'delta'    : since is not None and position is not None
+        }
+
+    def inventory(self):
+        return list(self.iter_inventory())
 
-    def upload(self, filename, name = None, ext = None):
+    def upload(self, filename, name = None, ext = None, progress = None):
+        # filename is a path, a binary file-like object or an iterable of
+        # bytes; the latter two need a name. progress(sent, total) is
+        # called while the body streams out, total is None if unknown.
         s = self.session;
         c = self.partner_settings[self.partner_id]
 
-        if name is None:
-            name = filename.split('/')[-1]
-        if ext is None:
-            ext = filename.split('.')[-1]
+        if isinstance(filename, str):
+            if name is None:
+                name = filename.split('/')[-1]
+            if ext is None:
+                ext = filename.split('.')[-1]
+            source = open(filename, 'rb')
+        else:
+            if name is None:
+                raise TolinoException('file upload needs a name.')
+            if ext is None:
+                ext = name.split('.')[-1]
+            source = filename
 
         mime = {
             'pdf'  : 'application/pdf',
             'epub' : 'application/epub+zip'
         }.get(ext.lower(), 'application/pdf')
 
-        r = s.post(c['upload_url'],
-            files = [('file', (name, open(filename, 'rb'), mime))],
-            headers = {
-                't_auth_token' : self.access_token,
-                'hardware_id'  : TolinoCloud.hardware_id,
-                'reseller_id'         : str(self.partner_id)
-            }
-        )
-        self._debug(r)
+        size = None
+        start = None
+        try:
+            size = os.fstat(source.fileno()).st_size - source.tell()
+        except (AttributeError, OSError, ValueError):
+            pass
+        try:
+            start = source.tell()
+        except (AttributeError, OSError, ValueError):
+            pass
+
+        sent = []
+        def send():
+            if sent:
+                # sending again after a renewed token, rewind the source
+                if start is None:
+                    raise TolinoException('file upload failed: stream cannot be sent again.')
+                source.seek(start)
+            body = MultipartStream('file', name, source, mime, size, progress)
+            sent.append(body)
+            return s.post(c['upload_url'],
+                data = body,
+                headers = {
+                    'content-type' : body.content_type,
+                    't_auth_token' : self.access_token,
+                    'hardware_id'  : TolinoCloud.hardware_id,
+                    'reseller_id'  : str(self.partner_id)
+                }
+            )
+
+        try:
+            r = self._call(send, 'upload', device=True)
+        finally:
+            if source is not filename:
+                source.close()
         if r.status_code != 200:
             raise TolinoException('file upload failed.')
 
@@ -551,7 +1041,7 @@ class TolinoCloud:
         s = self.session;
         c = self.partner_settings[self.partner_id]
 
-        r = s.get(c['delete_url'],
+        r = self._call(lambda: s.get(c['delete_url'],
             params = {
                 'deliverableId': id
             },
@@ -560,8 +1050,7 @@ class TolinoCloud:
                 'hardware_id'  : TolinoCloud.hardware_id,
                 'reseller_id'   : str(self.partner_id)
             }
-        )
-        self._debug(r)
+        ), 'delete', device=True, expected=(404,))
         if r.status_code != 200:
             try:
                 j = r.json()
@@ -569,58 +1058,723 @@ class TolinoCloud:
             except KeyError:
                 raise TolinoException('delete {} failed: reason unknown.'.format(id))
 
+    def select_inventory(self, ids = None, **conditions):
+        # The inventory items matching the conditions of Inventory.filter()
+        # (type, mime, partner, purchased_after / _before, issued_after /
+        # _before), limited to the given ids if any.
+        inv = Inventory(self.iter_inventory()).filter(**conditions)
+        if ids is not None:
+            ids = set(ids)
+            inv = inv.select([n for n, id in enumerate(inv.columns['id']) if id in ids])
+        return inv
+
+    def delete_many(self, ids, workers = 4):
+        # Delete many documents with a pool of parallel workers on this
+        # one session. Yields a result per document as soon as it is
+        # finished, failures are reported without stopping the others.
+        ids = list(ids)
+        self._size_pool(workers)
+
+        def remove(id):
+            try:
+                self.delete(id)
+                return { 'id' : id, 'error' : None }
+            except (TolinoException, OSError, ValueError) as e:
+                return { 'id' : id, 'error' : str(e) or type(e).__name__ }
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for n, f in enumerate(_completed(pool, remove, ids, 2 * workers), 1):
+                res = f.result()
+                res['done'] = n
+                res['total'] = len(ids)
+                yield res
+
+    # resolved download infos are reused for this many seconds
+    download_info_ttl = 300
+
+    # at most this many download infos are cached
+    download_info_cache_size = 10000
+
+    # parallel download info requests of download_many()
+    resolve_workers = 4
+
+    # download_many() resolves at most this many times its workers ahead
+    # of the transfers, so the download infos are still fresh when used
+    resolve_lookahead = 4
+
+    def _cached_download_info(self, id, count = True):
+        # count = False for the lookup of an info just resolved for it,
+        # which download_many() already counted, unless it is gone again
+        with self.download_info_lock:
+            entry = self.download_infos.get(id)
+            if entry is not None and entry[0] > time.monotonic():
+                if count:
+                    self.download_info_stats['hits'] += 1
+                return entry[1]
+            self.download_info_stats['misses'] += 1
+            return None
+
+    def forget_download_info(self, id):
+        # drop a cached download info, returns whether there was one
+        with self.download_info_lock:
+            return self.download_infos.pop(id, None) is not None
+
     def download_info(self, id):
+        # the cached download info if it is fresh, asks the server otherwise
+        di = self._cached_download_info(id)
+        if di is None:
+            di = self._resolve_download_info(id)
+        return di
+
+    def resolve_download_infos(self, ids, workers = None):
+        # Resolve the download infos of many ids in parallel, ahead of
+        # their downloads, and keep them in the cache. Yields (id, info,
+        # error) as soon as each one is known; only a window of requests
+        # is in flight, so stopping early leaves the rest unresolved.
+        workers = workers or self.resolve_workers
+
+        def resolve(id):
+            try:
+                return id, self.download_info(id), None
+            except (TolinoException, OSError, ValueError, KeyError) as e:
+                return id, None, e
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for future in _completed(pool, resolve, ids, 2 * workers):
+                yield future.result()
+
+    def _resolve_download_info(self, id):
         s = self.session;
         c = self.partner_settings[self.partner_id]
 
         b64 = base64.b64encode(bytes(id, 'utf-8')).decode('utf-8')
-        r = s.get(c['downloadinfo_url'].format(b64, b64),
+        r = self._call(lambda: s.get(c['downloadinfo_url'].format(b64, b64),
             headers = {
                 't_auth_token' : self.access_token,
                 'hardware_id'  : TolinoCloud.hardware_id,
                 'reseller_id'  : str(self.partner_id)
             }
-        )
-        self._debug(r)
+        ), 'download_info', device=True, idempotent=True, expected=(404,))
         if r.status_code != 200:
             raise TolinoException('download info request failed.')
 
         j = r.json()
         url = j['DownloadInfo']['contentUrl']
-        return {
+        di = {
             'url'      : url,
             'filename' : url.split('/')[-1],
             'filetype' : j['DownloadInfo']['format'],
         }
+        with self.download_info_lock:
+            if len(self.download_infos) >= self.download_info_cache_size:
+                now = time.monotonic()
+                for key in [k for k, e in self.download_infos.items() if e[0] <= now]:
+                    del self.download_infos[key]
+                while len(self.download_infos) >= self.download_info_cache_size:
+                    # dicts keep insertion order, drop the oldest
+                    del self.download_infos[next(iter(self.download_infos))]
+            self.download_infos[id] = (time.monotonic() + self.download_info_ttl, di)
+        return di
 
-    def download(self, path, id):
+    def _content_request(self, url, first = None, last = None, validators = None):
+        # validators are conditional request headers, which make the
+        # server answer 304 if the content hasn't changed
         s = self.session;
-        c = self.partner_settings[self.partner_id]
-
-        di = self.download_info(id)
 
-        r = s.get(di['url'],
-            stream=True,
+        def send():
             headers = {
                 't_auth_token' : self.access_token,
                 'hardware_id'  : TolinoCloud.hardware_id,
                 'reseller_id'  : str(self.partner_id)
             }
-        )
-        self._debug(r)
-        if r.status_code != 200:
+            if first is not None:
+                headers['Range'] = 'bytes={}-{}'.format(first, '' if last is None else last)
+            if validators:
+                headers.update(validators)
+            return s.get(url, stream=True, headers=headers)
+
+        r = self._call(send, 'download', device=True, stream=True, idempotent=True,
+            expected=(206, 304, 416))
+        if not r.status_code in (200, 206, 304, 416):
+            # the limiter slot of a streamed response is only freed by close()
             try:
                 j = r.json()
                 raise TolinoException('download request failed: {}'.format(j['ResponseInfo']['message']))
-            except KeyError:
+            except (KeyError, ValueError):
                 raise TolinoException('download request : reason unknown.')
+            finally:
+                r.close()
+        return r
+
+    def _transfer(self, r, f, limit = None, progress = None):
+        # copy the response body into f through one preallocated buffer,
+        # stopping after limit bytes if given
+        buf = memoryview(bytearray(self.buffer_size))
+        r.raw.decode_content = True
+        start = time.perf_counter() if self.tracer is not None else None
+        n = 0
+        try:
+            while limit is None or n < limit:
+                size = len(buf) if limit is None else min(len(buf), limit - n)
+                got = r.raw.readinto(buf[:size])
+                if not got:
+                    break
+                f.write(buf[:got])
+                n += got
+                if progress:
+                    progress(got)
+        except BaseException:
+            if start is not None:
+                self.tracer.record('transfer', time.perf_counter() - start, bytes_in=n, error=True)
+            raise
+        if start is not None:
+            self.tracer.record('transfer', time.perf_counter() - start, bytes_in=n)
+        return n
+
+    def _download_segments(self, r, url, part, total, segments):
+        # r already streams the whole file from offset 0, it is used for
+        # the first segment and the others are fetched in parallel
+        size = -(-total // segments)
+        bounds = [(first, min(first + size, total) - 1) for first in range(0, total, size)]
+        done = [0] * len(bounds)
+
+        def fetch(n):
+            first, last = bounds[n]
+            rr = r if n == 0 else self._content_request(url, first, last)
+            try:
+                if n and rr.status_code != 206:
+                    raise TolinoException('range request failed.')
+                with open(part, 'r+b') as f:
+                    f.seek(first)
+                    self._transfer(rr, f, last - first + 1,
+                        lambda got: done.__setitem__(n, done[n] + got))
+            finally:
+                rr.close()
+            if done[n] != last - first + 1:
+                raise TolinoException('download incomplete.')
+
+        with open(part, 'wb') as f:
+            f.truncate(total)
+        try:
+            with ThreadPoolExecutor(max_workers=len(bounds)) as pool:
+                for future in [pool.submit(fetch, n) for n in range(len(bounds))]:
+                    future.result()
+        except BaseException:
+            # keep what was downloaded without gaps, to resume from there
+            keep = 0
+            for (first, last), n in zip(bounds, done):
+                keep += n
+                if n != last - first + 1:
+                    break
+            with open(part, 'r+b') as f:
+                f.truncate(keep)
+            raise
+
+    def _part_validator(self, part):
+        # the ETag or Last-Modified of the content in a .part file
+        try:
+            with open(part + '.validator') as f:
+                return f.read().strip() or None
+        except OSError:
+            return None
+
+    def _keep_part_validator(self, part, r):
+        # Remember the validator of response r for the .part file, or
+        # forget it with r = None. A weak ETag can't be used for If-Range.
+        validator = None
+        if r is not None:
+            etag = r.headers.get('ETag')
+            validator = etag if etag and not etag.startswith('W/') else r.headers.get('Last-Modified')
+        if validator:
+            with open(part + '.validator', 'w') as f:
+                f.write(validator)
+        else:
+            try:
+                os.remove(part + '.validator')
+            except FileNotFoundError:
+                pass
+
+    def download(self, path, id, segments = 1, resolved = False):
+        # A transfer that breaks off is resumed from its .part file,
+        # after the same backoff as a failed request. resolved tells that
+        # the download info was just resolved for this download.
+        attempt = 0
+        while True:
+            try:
+                return self._download(path, id, segments, resolved=resolved)
+            except (requests.ConnectionError, requests.Timeout, urllib3.exceptions.HTTPError) as e:
+                if attempt >= self.retries:
+                    raise
+                delay = self._retry_delay(attempt)
+                logging.debug('download of {} broke off ({}), resuming in {:.1f}s'.format(id, e, delay))
+                if self.tracer is not None:
+                    self.tracer.record('transfer.retry', delay)
+                attempt += 1
+                time.sleep(delay)
+
+    def _download(self, path, id, segments, fresh = False, resolved = False):
+        # a recently validated copy in the content store needs no request
+        stored = None
+        if self.content_store is not None:
+            stored = self.content_store.lookup(self.partner_id, self.username, id)
+            if stored is not None and self.content_store.fresh(stored):
+                filename = path + '/' + stored['filename'] if path else stored['filename']
+                return self.content_store.serve(stored, filename)
 
+        cached = None if fresh else self._cached_download_info(id, count=not resolved)
+        di = cached or self._resolve_download_info(id)
 
+        # Download into a .part file first, so an interrupted transfer
+        # never leaves a truncated book behind and can be resumed. The
+        # validator of the content it holds is kept next to it, and
+        # sent as If-Range on resuming: if the document changed in the
+        # meantime, the server sends all of the new version instead of
+        # the rest of it.
         filename = path + '/' + di['filename'] if path else di['filename']
-        with open(filename, 'wb') as f:
-            for chunk in r.iter_content(chunk_size=1024):
-                if chunk:
-                    f.write(chunk)
-            f.flush()
+        part = filename + '.part'
+        try:
+            offset = os.path.getsize(part)
+        except OSError:
+            offset = 0
+        if_range = self._part_validator(part) if offset else None
+        if offset and if_range is None:
+            # no telling which version it is part of
+            offset = 0
 
+        # An open ended range for a fresh file tells the total size,
+        # needed to split it into segments. An older stored copy is
+        # revalidated on the way.
+        if offset:
+            validators = { 'If-Range' : if_range }
+        elif stored is not None:
+            validators = self.content_store.validators(stored)
+        else:
+            validators = None
+        try:
+            r = self._content_request(di['url'], offset if offset or segments > 1 else None, validators=validators)
+        except TolinoException:
+            if cached is None:
+                raise
+            # the cached content url may have expired on the server
+            logging.debug('cached download info of {} failed, resolving it again'.format(id))
+            self.forget_download_info(id)
+            with self.download_info_lock:
+                self.download_info_stats['stale'] += 1
+            return self._download(path, id, segments, True)
+        if r.status_code == 304:
+            r.close()
+            return self.content_store.serve(stored, filename, revalidated=True)
+        if r.status_code == 416:
+            # .part doesn't fit the file on the server anymore, start over
+            r.close()
+            offset = 0
+            r = self._content_request(di['url'])
+
+        total = None
+        if r.status_code == 206:
+            m = re.match(r'bytes (\d+)-\d+/(\d+)', r.headers.get('content-range', ''))
+            if not m or int(m.group(1)) != offset:
+                r.close()
+                raise TolinoException('download request failed: bad content range.')
+            total = int(m.group(2))
+        else:
+            # ranges not supported or the document changed, the whole
+            # file follows
+            offset = 0
+            if 'content-length' in r.headers:
+                total = int(r.headers['content-length'])
+        if not offset:
+            self._keep_part_validator(part, r)
+
+        if (segments > 1 and offset == 0 and r.status_code == 206 and
+                total >= self.segment_min_size):
+            self._download_segments(r, di['url'], part, total, segments)
+        else:
+            try:
+                with open(part, 'ab' if offset else 'wb') as f:
+                    offset += self._transfer(r, f)
+            finally:
+                r.close()
+            if total is not None and offset != total:
+                raise TolinoException('download of {} incomplete.'.format(id))
+
+        os.replace(part, filename)
+        self._keep_part_validator(part, None)
+        if self.content_store is not None:
+            self.content_store.store(self.partner_id, self.username, id, filename,
+                r.headers.get('ETag'), r.headers.get('Last-Modified'))
         return filename
+
+    def _size_pool(self, size):
+        # one pooled connection per worker, so parallel transfers don't
+        # wait for or throw away each other's connections. The pool only
+        # grows; the adapters it replaces are closed with their connections.
+        with self.lock:
+            if size <= self.pool_size:
+                return
+            for prefix in ('https://', 'http://'):
+                old = self.session.adapters.get(prefix)
+                self.session.mount(prefix, requests.adapters.HTTPAdapter(
+                    pool_connections=size, pool_maxsize=size))
+                if old is not None:
+                    old.close()
+            self.pool_size = size
+
+    def download_many(self, path, ids = None, workers = 4, segments = 1):
+        # Download many documents with a pool of parallel workers. A
+        # separate pool resolves the download infos in order, ahead of
+        # the transfers, so a worker usually finds its content url in the
+        # cache instead of waiting a round trip for it. The resolver stays
+        # within resolve_lookahead times workers of the transfers, so it
+        # neither sends a burst of requests for a large library nor
+        # resolves infos that expire before their turn. ids = None
+        # downloads everything in inventory(). Yields a result per
+        # document as soon as it is finished, failures are reported
+        # without stopping the others.
+        if ids is None:
+            ids = [i['id'] for i in self.inventory()]
+        ids = list(ids)
+        self._size_pool(workers + self.resolve_workers)
+
+        def resolve(id):
+            # a recently validated stored copy needs no download info
+            if self.content_store is not None:
+                stored = self.content_store.lookup(self.partner_id, self.username, id)
+                if stored is not None and self.content_store.fresh(stored):
+                    return None
+            return self.download_info(id)
+
+        resolver = ThreadPoolExecutor(max_workers=self.resolve_workers)
+        resolved = {}
+        lookahead = self.resolve_lookahead * workers
+        position = [0]
+        lock = threading.Lock()
+
+        def resolve_until(n):
+            # submit the resolves of ids up to position n
+            with lock:
+                while position[0] < min(n, len(ids)):
+                    id = ids[position[0]]
+                    if not id in resolved:
+                        resolved[id] = resolver.submit(resolve, id)
+                    position[0] += 1
+
+        def fetch(item):
+            n, id = item
+            try:
+                resolve_until(n + 1 + lookahead)
+                resolved[id].result()
+                return { 'id' : id, 'filename' : self.download(path, id, segments, resolved=True), 'error' : None }
+            except (TolinoException, OSError, ValueError, KeyError, urllib3.exceptions.HTTPError) as e:
+                return { 'id' : id, 'filename' : None, 'error' : str(e) or type(e).__name__ }
+
+        resolve_until(lookahead)
+        with resolver, ThreadPoolExecutor(max_workers=workers) as pool:
+            for n, f in enumerate(_completed(pool, fetch, enumerate(ids), 2 * workers), 1):
+                res = f.result()
+                res['done'] = n
+                res['total'] = len(ids)
+                yield res
+
+    # file types accepted by upload()
+    upload_types = ('.pdf', '.epub')
+
+    def _file_hash(self, filename):
+        h = hashlib.sha256()
+        with open(filename, 'rb') as f:
+            while True:
+                chunk = f.read(self.buffer_size)
+                if not chunk:
+                    break
+                h.update(chunk)
+        return h.hexdigest()
+
+    def upload_tree(self, root, manifest, workers = 4):
+        # Upload every .pdf / .epub below root that isn't in the cloud yet.
+        #
+        # The manifest file remembers the content hash of each file (by
+        # size and mtime, so unchanged files aren't hashed again) and the
+        # deliverableId each hash was uploaded as. Uploads that vanished
+        # from inventory() are uploaded again. Yields a result per file,
+        # with status 'present', 'uploaded' or 'failed'.
+        try:
+            with open(manifest) as f:
+                m = json.load(f)
+        except FileNotFoundError:
+            m = {}
+        known = m.get('files', {})
+        uploads = m.get('uploads', {})
+
+        paths = []
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames.sort()
+            for fn in sorted(filenames):
+                if fn.lower().endswith(self.upload_types):
+                    paths.append(os.path.join(dirpath, fn))
+
+        def stat_and_hash(path):
+            st = os.stat(path)
+            rel = os.path.relpath(path, root)
+            entry = known.get(rel)
+            if not entry or entry['size'] != st.st_size or entry['mtime'] != st.st_mtime:
+                entry = { 'size' : st.st_size, 'mtime' : st.st_mtime, 'hash' : self._file_hash(path) }
+            return rel, entry
+
+        files = {}
+        results = []
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for path, future in [(p, pool.submit(stat_and_hash, p)) for p in paths]:
+                try:
+                    rel, entry = future.result()
+                    files[rel] = entry
+                except OSError as e:
+                    results.append({ 'path' : path, 'id' : None, 'status' : 'failed', 'error' : str(e) })
+
+        # forget uploads that were deleted from the cloud meanwhile
+        present = set(i['id'] for i in self.inventory())
+        uploads = { h : id for h, id in uploads.items() if id in present }
+
+        # upload each new content hash once, even if it occurs in several
+        # files; the other files of a hash wait for the result of its upload
+        pending = {}
+        copies = {}
+        for rel in sorted(files):
+            h = files[rel]['hash']
+            if h in uploads:
+                results.append({ 'path' : os.path.join(root, rel), 'id' : uploads[h],
+                    'status' : 'present', 'error' : None })
+            elif h in pending:
+                copies.setdefault(h, []).append(rel)
+            else:
+                pending[h] = rel
+        for res in results:
+            yield res
+
+        def save():
+            tmp = manifest + '.tmp'
+            with open(tmp, 'w') as f:
+                json.dump({ 'files' : files, 'uploads' : uploads }, f)
+            os.replace(tmp, manifest)
+
+        def send(h, rel):
+            path = os.path.join(root, rel)
+            try:
+                return { 'path' : path, 'hash' : h, 'id' : self.upload(path), 'status' : 'uploaded', 'error' : None }
+            except (TolinoException, OSError) as e:
+                return { 'path' : path, 'hash' : h, 'id' : None, 'status' : 'failed', 'error' : str(e) }
+
+        if pending:
+            self._size_pool(workers)
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                for future in _completed(pool, lambda item: send(*item), list(pending.items()), 2 * workers):
+                    res = future.result()
+                    h = res.pop('hash')
+                    if res['id']:
+                        uploads[h] = res['id']
+                    yield res
+                    for rel in copies.get(h, []):
+                        yield { 'path' : os.path.join(root, rel), 'id' : res['id'],
+                            'status' : 'present' if res['id'] else 'failed', 'error' : res['error'] }
+        finally:
+            save()
+
+    def sync(self, root, manifest, mode = 'both', delete = False, dry_run = False, workers = 4):
+        # Keep the .pdf / .epub files below root and the cloud in step.
+        #
+        # The manifest file remembers for each local file its size, mtime
+        # and content hash, the id it has in the cloud and the purchased
+        # time of that id. Against one inventory() request and a stat()
+        # of each file (only new or changed files are hashed) this tells
+        # what changed on which side since the last sync:
+        #
+        #   new / changed local file        upload (replacing the old id)
+        #   new / changed cloud document    download
+        #   file deleted locally            delete in cloud if delete,
+        #                                   download again otherwise
+        #   document deleted in cloud       delete the file if delete,
+        #                                   upload again otherwise
+        #
+        # mode 'upload' only changes the cloud, 'download' only the local
+        # directory, 'both' both. With dry_run nothing is transferred and
+        # the planned actions are yielded with status 'planned'; otherwise
+        # a result per action is yielded as soon as it is done, with
+        # status 'done' or 'failed'. Actions are 'upload', 'download',
+        # 'delete' (in the cloud) and 'remove' (the local file).
+        #
+        # Downloads land in root under the name the server gives them; an
+        # existing file of that name that isn't in the manifest yet is
+        # overwritten, so check the first sync of a filled directory with
+        # dry_run.
+        if not mode in ('both', 'upload', 'download'):
+            raise TolinoException('unknown sync mode {}.'.format(mode))
+        up = mode in ('both', 'upload')
+        down = mode in ('both', 'download')
+
+        try:
+            with open(manifest) as f:
+                known = json.load(f).get('files', {})
+        except FileNotFoundError:
+            known = {}
+
+        local = {}
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames.sort()
+            for fn in sorted(filenames):
+                if fn.lower().endswith(self.upload_types):
+                    path = os.path.join(dirpath, fn)
+                    st = os.stat(path)
+                    local[os.path.relpath(path, root)] = { 'size' : st.st_size, 'mtime' : st.st_mtime }
+
+        cloud = { i['id'] : i for i in self.inventory() }
+
+        files = {}
+        actions = []
+        tracked = set()
+        for rel, entry in sorted(known.items()):
+            id = entry.get('id')
+            if id in cloud:
+                tracked.add(id)
+            if rel in local:
+                if local[rel]['size'] != entry['size'] or local[rel]['mtime'] != entry['mtime']:
+                    # changed locally, hashed below to be sure
+                    continue
+                files[rel] = entry
+                if entry.get('pending'):
+                    # an upload that didn't make it last time
+                    if up:
+                        actions.append({ 'op' : 'upload', 'path' : rel, 'id' : id if id in cloud else None })
+                elif id in cloud:
+                    if entry.get('purchased') is None:
+                        # uploaded by the last sync
+                        files[rel] = dict(entry, purchased=cloud[id]['purchased'])
+                    elif cloud[id]['purchased'] != entry['purchased'] and down:
+                        actions.append({ 'op' : 'download', 'path' : rel, 'id' : id })
+                elif id is not None and delete and down:
+                    actions.append({ 'op' : 'remove', 'path' : rel, 'id' : id })
+                elif up:
+                    files[rel] = dict(entry, id=None, pending=True)
+                    actions.append({ 'op' : 'upload', 'path' : rel, 'id' : None })
+                else:
+                    files[rel] = dict(entry, id=None)
+            elif id in cloud:
+                # the entry stays until the action is done
+                if delete and up:
+                    files[rel] = entry
+                    actions.append({ 'op' : 'delete', 'path' : rel, 'id' : id })
+                elif down:
+                    files[rel] = entry
+                    actions.append({ 'op' : 'download', 'path' : rel, 'id' : id })
+
+        def stat_and_hash(rel):
+            return rel, dict(local[rel], hash=self._file_hash(os.path.join(root, rel)))
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for rel, entry in pool.map(stat_and_hash, [rel for rel in local if not rel in files]):
+                old = known.get(rel, {})
+                if old.get('hash') == entry['hash']:
+                    # only touched
+                    files[rel] = dict(old, size=entry['size'], mtime=entry['mtime'])
+                else:
+                    # until it is uploaded, the entry keeps the id of the
+                    # cloud's version, so that isn't downloaded over it
+                    files[rel] = dict(entry, id=old.get('id'), purchased=old.get('purchased'), pending=up)
+                    if up:
+                        actions.append({ 'op' : 'upload', 'path' : rel,
+                            'id' : old.get('id') if old.get('id') in cloud else None })
+
+        if down:
+            for id in cloud:
+                if not id in tracked:
+                    actions.append({ 'op' : 'download', 'path' : None, 'id' : id })
+
+        if dry_run:
+            for a in actions:
+                yield dict(a, status='planned', error=None)
+            return
+
+        def save():
+            tmp = manifest + '.tmp'
+            with open(tmp, 'w') as f:
+                json.dump({ 'files' : files }, f)
+            os.replace(tmp, manifest)
+
+        def run(a):
+            path = os.path.join(root, a['path']) if a['path'] else None
+            res = dict(a, status='done', error=None, updates=[])
+            try:
+                if a['op'] == 'upload':
+                    res['id'] = self.upload(path)
+                    res['updates'].append((a['path'], dict(files[a['path']], id=res['id'], purchased=None, pending=False)))
+                    if a['id']:
+                        # the new version replaces the old one
+                        self.delete(a['id'])
+                elif a['op'] == 'download':
+                    fn = self.download(root, a['id'])
+                    rel = os.path.relpath(fn, root)
+                    if a['path'] and rel != a['path']:
+                        if os.path.exists(path):
+                            os.remove(path)
+                        res['updates'].append((a['path'], None))
+                    st = os.stat(fn)
+                    res['path'] = rel
+                    res['updates'].append((rel, { 'size' : st.st_size, 'mtime' : st.st_mtime,
+                        'hash' : self._file_hash(fn), 'id' : a['id'], 'purchased' : cloud[a['id']]['purchased'] }))
+                elif a['op'] == 'delete':
+                    self.delete(a['id'])
+                    res['updates'].append((a['path'], None))
+                elif a['op'] == 'remove':
+                    os.remove(path)
+                    res['updates'].append((a['path'], None))
+            except (TolinoException, OSError, ValueError, KeyError, urllib3.exceptions.HTTPError) as e:
+                res['status'] = 'failed'
+                res['error'] = str(e) or type(e).__name__
+            return res
+
+        if actions:
+            self._size_pool(workers + self.resolve_workers)
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                for future in _completed(pool, run, actions, 2 * workers):
+                    res = future.result()
+                    for rel, entry in res.pop('updates'):
+                        if entry is None:
+                            files.pop(rel, None)
+                        else:
+                            files[rel] = entry
+                    yield res
+        finally:
+            save()
+
+    def batch(self, lines):
+        # Run many operations on this one logged in session, one per line:
+        #
+        #   upload FILE [NAME]
+        #   download ID [DIR]
+        #   delete ID
+        #
+        # Words are split shell-style, '#' starts a comment. A result is
+        # yielded as soon as each line has finished, failures don't stop
+        # the remaining lines.
+        ops = {
+            'upload'   : (self.upload, 1, 2),
+            'download' : (lambda id, path = None: self.download(path, id), 1, 2),
+            'delete'   : (self.delete, 1, 1)
+        }
+        for n, line in enumerate(lines, 1):
+            res = { 'line' : n, 'op' : None, 'args' : [], 'result' : None, 'error' : None }
+            try:
+                words = shlex.split(line, comments=True)
+                if not words:
+                    continue
+                res['op'] = words[0]
+                res['args'] = words[1:]
+                if not words[0] in ops:
+                    raise TolinoException('unknown operation {}.'.format(words[0]))
+                func, min_args, max_args = ops[words[0]]
+                if not min_args <= len(words) - 1 <= max_args:
+                    raise TolinoException('wrong number of arguments for {}.'.format(words[0]))
+                res['result'] = func(*words[1:])
+            except (TolinoException, OSError, ValueError, KeyError, urllib3.exceptions.HTTPError) as e:
+                res['error'] = str(e) or type(e).__name__
+            yield res
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+
+#tolino cloud shell completion cache
+
+# Document and device ids for shell completion, answered from the
+# results of the last inventory / devices calls that tolinoclient.py
+# keeps in a small JSON file. Looking them up needs neither the network
+# nor the HTTP stack, so it stays quick enough to run on every key
+# press. A stale cache is refreshed by a background tolinoclient.py
+# refresh-completion run while the old entries are answered.
+#
+#   tolinocomplete.py documents [PREFIX] [--format fish|bash|zsh] [--cache FILE]
+#   tolinocomplete.py devices [PREFIX]
+#
+# It is a script of its own, as Python compiles the script it runs
+# afresh every time and tolinoclient.py is a lot to compile.
+
+
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+
+
+import os
+import sys
+import json
+import time
+
+default_cache = '~/.cache/tolinoclient/completion.json'
+
+# the cache is refreshed in the background when older than this many seconds
+max_age = 3600
+
+# a refresh that hasn't finished after this many seconds is started again
+refresh_timeout = 120
+
+def load(filename):
+    try:
+        with open(os.path.expanduser(filename)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save(filename, documents = None, devices = None, argv = None):
+    # Store the ids and descriptions of documents and / or devices, as
+    # lists of (id, description), and the tolinoclient.py options that
+    # refresh them. What isn't given is kept from the former cache.
+    filename = os.path.expanduser(filename)
+    cache = load(filename)
+    now = time.time()
+    for key, entries in (('documents', documents), ('devices', devices)):
+        if entries is not None:
+            cache[key] = [[str(id), desc] for id, desc in entries]
+            cache[key + '_updated'] = now
+    if argv is not None:
+        cache['argv'] = argv
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    tmp = '{}.{}.tmp'.format(filename, os.getpid())
+    with open(tmp, 'w') as f:
+        json.dump(cache, f)
+    os.replace(tmp, filename)
+    try:
+        os.remove(filename + '.refresh')
+    except FileNotFoundError:
+        pass
+
+def document_entries(items):
+    return [(i['id'], '{} ({})'.format(i['title'], i['type'])) for i in items]
+
+def device_entries(devs):
+    return [(d['id'], '{} ({})'.format(d['name'], d['type'])) for d in devs]
+
+def refresh(filename, cache):
+    # start tolinoclient.py refresh-completion detached, unless another
+    # run is still busy with it
+    marker = os.path.expanduser(filename) + '.refresh'
+    try:
+        if time.time() - os.path.getmtime(marker) < refresh_timeout:
+            return
+    except OSError:
+        pass
+    try:
+        open(marker, 'w').close()
+    except OSError:
+        return
+    import subprocess
+    client = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tolinoclient.py')
+    subprocess.Popen([sys.executable, client] + cache['argv'] +
+            ['--completion-cache', filename, 'refresh-completion'],
+        stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        start_new_session=True)
+
+def complete(kind, prefix = '', filename = default_cache, format = 'fish', out = sys.stdout):
+    cache = load(filename)
+    lines = []
+    for id, desc in cache.get(kind, ()):
+        if id.startswith(prefix):
+            if format == 'bash':
+                lines.append(id)
+            elif format == 'zsh':
+                lines.append('{}:{}'.format(id.replace(':', r'\:'), desc))
+            else:
+                lines.append('{}\t{}'.format(id, desc))
+    if lines:
+        out.write('\n'.join(lines) + '\n')
+    out.flush()
+    if 'argv' in cache and time.time() - cache.get(kind + '_updated', 0) > max_age:
+        refresh(filename, cache)
+
+def main(argv):
+    # argparse is left out on purpose, it would double the start up time
+    usage = 'usage: tolinocomplete.py documents|devices [PREFIX] [--format fish|bash|zsh] [--cache FILE]\n'
+    options = { '--format' : 'fish', '--cache' : default_cache }
+    words = []
+    argv = list(argv)
+    while argv:
+        word = argv.pop(0)
+        if word in options and argv:
+            options[word] = argv.pop(0)
+        elif word.startswith('--') and '=' in word and word.split('=', 1)[0] in options:
+            key, value = word.split('=', 1)
+            options[key] = value
+        else:
+            words.append(word)
+    if not 1 <= len(words) <= 2 or not words[0] in ('documents', 'devices') or \
+            not options['--format'] in ('fish', 'bash', 'zsh'):
+        sys.stderr.write(usage)
+        return 2
+    complete(words[0], words[1] if len(words) > 1 else '', options['--cache'], options['--format'])
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,252 @@
+#tolino cloud local content store
+
+# Keeps downloaded documents in a local directory, so downloading one
+# again doesn't transfer it again. Entries are kept per account and
+# document id, with the size, SHA-256 hash, file name and the ETag /
+# Last-Modified validators of the download. The files themselves are
+# stored once per hash under objects/. A fresh download is copied into
+# the store, so the downloaded file stays the user's own, and serving it
+# again copies the stored file to the destination. With link = True it
+# is hard linked there instead (copied across file systems), which takes
+# no space but gives a read-only file shared by every account that has
+# the same document; an existing file is still replaced by a copy only.
+#
+# An entry validated less than max_age seconds ago is used as it is;
+# an older one is revalidated with If-None-Match / If-Modified-Since
+# and only downloaded again if the server sends new content. The store
+# is kept below max_size bytes by evicting the least recently used
+# entries.
+#
+# Stored files are read-only, and so are the hard links to them. An
+# edited linked file is not carried into the store, because most
+# editors replace the file rather than write to it in place.
+
+
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+
+
+import os
+import time
+import shutil
+import hashlib
+import sqlite3
+import threading
+
+class ContentStore:
+
+    schema = '''
+        create table if not exists entries (
+            partner       integer not null,
+            user          text not null,
+            id            text not null,
+            hash          text not null,
+            size          integer not null,
+            filename      text not null,
+            etag          text,
+            last_modified text,
+            validated     real not null,
+            used          real not null,
+            primary key (partner, user, id)
+        );
+        create index if not exists entries_used on entries (used);
+        create index if not exists entries_hash on entries (hash);
+        create table if not exists stats (
+            name  text primary key,
+            value integer not null
+        );
+    '''
+
+    fields = ('partner', 'user', 'id', 'hash', 'size', 'filename', 'etag', 'last_modified', 'validated', 'used')
+
+    # counters kept in the stats table
+    counters = ('hits', 'revalidated', 'misses', 'evicted', 'saved_bytes')
+
+    buffer_size = 1024 * 1024
+
+    def __init__(self, directory, max_size = 2 * 1024 ** 3, max_age = 86400, link = False):
+        self.directory = os.path.expanduser(directory)
+        self.max_size = max_size
+        self.max_age = max_age
+        # hard link files into place instead of copying them
+        self.link = link
+        os.makedirs(os.path.join(self.directory, 'objects'), exist_ok=True)
+        # one connection for all download workers, other processes (a
+        # daemon, another client) wait for each other's writes
+        self.db = sqlite3.connect(os.path.join(self.directory, 'index.db'),
+            timeout=30, check_same_thread=False)
+        self.db.executescript(self.schema)
+        self.lock = threading.Lock()
+
+    def close(self):
+        self.db.close()
+
+    def _object(self, hash):
+        return os.path.join(self.directory, 'objects', hash[:2], hash)
+
+    def _count(self, name, n = 1):
+        self.db.execute('insert into stats (name, value) values (?, ?) '
+            'on conflict (name) do update set value = value + excluded.value', (name, n))
+
+    def lookup(self, partner, user, id):
+        # the entry of a document as a dict, None if there is none or its
+        # file has gone missing
+        with self.lock:
+            row = self.db.execute('select {} from entries where partner = ? and user = ? and id = ?'.format(
+                ', '.join(self.fields)), (partner, user, id)).fetchone()
+            if row is None:
+                return None
+            entry = dict(zip(self.fields, row))
+            if not os.path.exists(self._object(entry['hash'])):
+                with self.db:
+                    self.db.execute('delete from entries where partner = ? and user = ? and id = ?',
+                        (partner, user, id))
+                return None
+            return entry
+
+    def fresh(self, entry):
+        return time.time() - entry['validated'] < self.max_age
+
+    def validators(self, entry):
+        # request headers that ask the server whether entry is still current
+        headers = {}
+        if entry['etag']:
+            headers['If-None-Match'] = entry['etag']
+        if entry['last_modified']:
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def _place(self, source, filename):
+        # put a file at filename, through a temporary name so that no
+        # half copied file is ever seen there. A file already at filename
+        # is only ever replaced by a copy, never by a read-only link.
+        exists = os.path.exists(filename)
+        if exists and os.path.samefile(source, filename):
+            return
+        tmp = '{}.{}.tmp'.format(filename, threading.get_ident())
+        try:
+            if not self.link or exists:
+                raise OSError('copying')
+            os.link(source, tmp)
+        except OSError:
+            shutil.copyfile(source, tmp)
+        os.replace(tmp, filename)
+
+    def serve(self, entry, filename, revalidated = False):
+        # Place the stored file of entry at filename, revalidated tells
+        # that the server just confirmed it. Returns filename.
+        self._place(self._object(entry['hash']), filename)
+        now = time.time()
+        with self.lock, self.db:
+            self.db.execute('update entries set used = ?{} where partner = ? and user = ? and id = ?'.format(
+                ', validated = ?' if revalidated else ''),
+                (now, now, entry['partner'], entry['user'], entry['id']) if revalidated else
+                (now, entry['partner'], entry['user'], entry['id']))
+            self._count('revalidated' if revalidated else 'hits')
+            self._count('saved_bytes', entry['size'])
+        return filename
+
+    def _hash(self, filename):
+        h = hashlib.sha256()
+        with open(filename, 'rb') as f:
+            while True:
+                chunk = f.read(self.buffer_size)
+                if not chunk:
+                    break
+                h.update(chunk)
+        return h.hexdigest()
+
+    def store(self, partner, user, id, filename, etag = None, last_modified = None):
+        # keep a freshly downloaded file, then make room for it
+        hash = self._hash(filename)
+        obj = self._object(hash)
+        if not os.path.exists(obj):
+            # a copy, a link would make the download read-only as well
+            os.makedirs(os.path.dirname(obj), exist_ok=True)
+            tmp = '{}.{}.tmp'.format(obj, threading.get_ident())
+            shutil.copyfile(filename, tmp)
+            os.chmod(tmp, 0o444)
+            os.replace(tmp, obj)
+        now = time.time()
+        with self.lock, self.db:
+            self.db.execute('insert or replace into entries ({}) values ({})'.format(
+                ', '.join(self.fields), ', '.join('?' * len(self.fields))),
+                (partner, user, id, hash, os.path.getsize(obj), os.path.basename(filename),
+                    etag, last_modified, now, now))
+            self._count('misses')
+        self.evict()
+
+    def forget(self, partner, user, id):
+        with self.lock, self.db:
+            row = self.db.execute('select hash from entries where partner = ? and user = ? and id = ?',
+                (partner, user, id)).fetchone()
+            self.db.execute('delete from entries where partner = ? and user = ? and id = ?', (partner, user, id))
+        if row:
+            self._drop_unused(row[0])
+
+    def _drop_unused(self, hash):
+        # remove the file of hash once no entry refers to it anymore
+        with self.lock:
+            used = self.db.execute('select 1 from entries where hash = ? limit 1', (hash,)).fetchone()
+        if not used:
+            try:
+                os.remove(self._object(hash))
+            except FileNotFoundError:
+                pass
+
+    def size(self):
+        # bytes taken by the stored files, each counted once
+        with self.lock:
+            return self.db.execute('select coalesce(sum(size), 0) from '
+                '(select distinct hash, size from entries)').fetchone()[0]
+
+    def evict(self):
+        # drop the least recently used entries until the store fits max_size
+        total = self.size()
+        while total > self.max_size:
+            with self.lock, self.db:
+                row = self.db.execute('select partner, user, id, hash, size from entries '
+                    'order by used limit 1').fetchone()
+                if row is None:
+                    break
+                partner, user, id, hash, size = row
+                self.db.execute('delete from entries where partner = ? and user = ? and id = ?',
+                    (partner, user, id))
+                self._count('evicted')
+                shared = self.db.execute('select 1 from entries where hash = ? limit 1', (hash,)).fetchone()
+            if not shared:
+                try:
+                    os.remove(self._object(hash))
+                except FileNotFoundError:
+                    pass
+                total -= size
+
+    def clear(self):
+        with self.lock, self.db:
+            hashes = [row[0] for row in self.db.execute('select distinct hash from entries')]
+            self.db.execute('delete from entries')
+        for hash in hashes:
+            try:
+                os.remove(self._object(hash))
+            except FileNotFoundError:
+                pass
+
+    def stats(self):
+        with self.lock:
+            counts = dict(self.db.execute('select name, value from stats'))
+            entries, objects = self.db.execute('select count(*), count(distinct hash) from entries').fetchone()
+        s = { name : counts.get(name, 0) for name in self.counters }
+        s.update({
+            'entries'  : entries,
+            'objects'  : objects,
+            'size'     : self.size(),
+            'max_size' : self.max_size
+        })
+        return s
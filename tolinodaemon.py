@@ -0,0 +1,380 @@
+#tolino cloud session daemon
+
+# Keeps logged in and registered TolinoCloud sessions for any number of
+# accounts and serves inventory, devices, download, upload and delete to
+# local clients over a Unix socket, so scripts and cron jobs don't each
+# pay for a login, a registration and fresh connections.
+#
+# The protocol is one JSON object per line in both directions. A
+# request names the operation, the account and its arguments:
+#
+#   {"op": "inventory", "partner": 3, "user": "...", "password": "...", "args": {}}
+#
+# and is answered with {"ok": true, "result": ...} or {"ok": false,
+# "error": "..."}. Paths in the arguments must be absolute, the daemon
+# has a working directory of its own. "ping" and "stats" need no
+# account. A connection may send several requests one after the other.
+#
+# Identical requests that arrive while the first of them is still
+# running wait for its result instead of going upstream themselves,
+# e.g. ten clients asking for the inventory at once make one inventory
+# request. Uploads are never coalesced. Tokens are refreshed before they
+# expire, and accounts in recent use get a cheap request now and then
+# so their connections don't go idle.
+#
+# The socket is only accessible to the user running the daemon. The
+# client half (DaemonClient) doesn't import tolinocloud, so probing for
+# a running daemon doesn't load the HTTP stack.
+
+
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+
+
+import os
+import hmac
+import json
+import time
+import socket
+import logging
+import threading
+import socketserver
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from tolinorecords import InventoryItem, Device
+
+default_socket = '~/.cache/tolinoclient/daemon.sock'
+
+class DaemonError(Exception):
+    pass
+
+
+class Coalescer:
+
+    # runs a call once for all callers that ask for the same key while
+    # it is in progress, they all get its result or its exception
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.stats = { 'calls' : 0, 'coalesced' : 0 }
+
+    def run(self, key, func):
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = { 'done' : threading.Event(), 'result' : None, 'error' : None }
+                self.stats['calls'] += 1
+            else:
+                self.stats['coalesced'] += 1
+        if leader:
+            try:
+                call['result'] = func()
+            except Exception as e:
+                call['error'] = e
+            finally:
+                with self.lock:
+                    del self.calls[key]
+                call['done'].set()
+        else:
+            call['done'].wait()
+        if call['error'] is not None:
+            raise call['error']
+        return call['result']
+
+
+class DaemonHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                req = json.loads(line.decode('utf-8'))
+                res = { 'ok' : True, 'result' : self.server.daemon.handle(req) }
+            except Exception as e:
+                logging.debug('daemon request failed: {!r}'.format(e))
+                res = { 'ok' : False, 'error' : str(e) or type(e).__name__ }
+            self.wfile.write(json.dumps(res).encode('utf-8') + b'\n')
+            self.wfile.flush()
+
+
+class DaemonServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+
+    daemon_threads = True
+
+
+class TolinoDaemon:
+
+    # seconds between the checks for expiring tokens and idle connections
+    maintenance_interval = 30
+
+    # an account used within this many seconds gets a request after
+    # keepalive seconds without one, 0 disables that
+    keepalive = 55
+    warm_period = 900
+
+    # operations with their required arguments
+    ops = {
+        'inventory' : (),
+        'devices'   : (),
+        'download'  : ('path', 'id'),
+        'upload'    : ('filename',),
+        'delete'    : ('id',)
+    }
+
+    def __init__(self, socket_path = default_socket, session_cache = None, keep_registration = False,
+            content_store = None):
+        self.socket_path = os.path.expanduser(socket_path)
+        self.session_cache = session_cache
+        # a tolinocontent.ContentStore shared by all accounts
+        self.content_store = content_store
+        self.keep_registration = keep_registration
+        # (partner, user) -> { 'cloud', 'password', 'used', 'requested' }
+        self.accounts = {}
+        self.lock = threading.Lock()
+        self.coalescer = Coalescer()
+        self.stats = { 'requests' : 0 }
+        self.stopping = threading.Event()
+        self.server = None
+
+    def _account(self, partner, user, password):
+        from tolinocloud import TolinoCloud
+        key = (partner, user)
+        with self.lock:
+            a = self.accounts.get(key)
+        if a is not None and hmac.compare_digest(a['password'].encode('utf-8'), password.encode('utf-8')):
+            a['used'] = time.time()
+            return a
+
+        def login():
+            c = TolinoCloud(partner, session_cache=self.session_cache, keep_registration=True,
+                content_store=self.content_store)
+            c.login(user, password)
+            c.register()
+            return c
+
+        # a login with another password replaces the session only if
+        # it succeeds, concurrent first requests share one login
+        c = self.coalescer.run(('login', partner, user, password), login)
+        with self.lock:
+            a = self.accounts.get(key)
+            if a is None or a['cloud'] is not c:
+                a = self.accounts[key] = { 'cloud' : c, 'password' : password,
+                    'used' : time.time(), 'requested' : time.time() }
+        return a
+
+    def handle(self, req):
+        op = req.get('op')
+        if op == 'ping':
+            return 'pong'
+        if op == 'stats':
+            with self.lock:
+                accounts = len(self.accounts)
+            return dict(self.stats, accounts=accounts, **self.coalescer.stats)
+        if not op in self.ops:
+            raise DaemonError('unknown operation {}.'.format(op))
+        args = req.get('args') or {}
+        for name in self.ops[op]:
+            if not name in args:
+                raise DaemonError('{} needs {}.'.format(op, name))
+        for name in ('path', 'filename'):
+            if name in args and not os.path.isabs(args[name]):
+                raise DaemonError('{} must be an absolute path.'.format(name))
+        try:
+            partner, user, password = int(req['partner']), req['user'], req['password']
+        except (KeyError, TypeError, ValueError):
+            raise DaemonError('request needs partner, user and password.')
+        with self.lock:
+            self.stats['requests'] += 1
+
+        a = self._account(partner, user, password)
+        c = a['cloud']
+        run = {
+            'inventory' : lambda: [dict(i) for i in c.inventory()],
+            'devices'   : lambda: [dict(d) for d in c.devices()],
+            'download'  : lambda: c.download(args['path'], args['id'], args.get('segments', 1)),
+            'upload'    : lambda: c.upload(args['filename'], args.get('name')),
+            'delete'    : lambda: c.delete(args['id'])
+        }[op]
+        a['requested'] = time.time()
+        if op == 'upload':
+            return run()
+        return self.coalescer.run((partner, user, op, json.dumps(args, sort_keys=True)), run)
+
+    def maintain(self):
+        # renew tokens ahead of their expiry and keep recently used
+        # accounts' connections from going idle
+        from tolinocloud import TolinoException
+        while not self.stopping.wait(self.maintenance_interval):
+            with self.lock:
+                accounts = list(self.accounts.items())
+            now = time.time()
+            for (partner, user), a in accounts:
+                c = a['cloud']
+                try:
+                    if not c._token_valid():
+                        c._reauthenticate(c.access_token)
+                    if self.keepalive and now - a['used'] < self.warm_period and \
+                            now - a['requested'] > self.keepalive:
+                        a['requested'] = now
+                        c.devices()
+                except (TolinoException, OSError) as e:
+                    logging.warning('daemon upkeep of {} failed: {}'.format(user, e))
+
+    def serve(self):
+        # Serve until stop() or an interrupt, then unregister and log out
+        # the sessions unless they are to be kept.
+        if DaemonClient.running(self.socket_path):
+            raise DaemonError('a daemon is already listening on {}.'.format(self.socket_path))
+        os.makedirs(os.path.dirname(self.socket_path), mode=0o700, exist_ok=True)
+        if os.path.exists(self.socket_path):
+            # left behind by a daemon that didn't shut down
+            os.remove(self.socket_path)
+        umask = os.umask(0o177)
+        try:
+            self.server = DaemonServer(self.socket_path, DaemonHandler)
+        finally:
+            os.umask(umask)
+        self.server.daemon = self
+        upkeep = threading.Thread(target=self.maintain, daemon=True)
+        upkeep.start()
+        try:
+            self.server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stopping.set()
+            self.server.server_close()
+            os.remove(self.socket_path)
+            self.close()
+
+    def stop(self):
+        self.stopping.set()
+        if self.server is not None:
+            self.server.shutdown()
+
+    def close(self):
+        from tolinocloud import TolinoException
+        with self.lock:
+            accounts = list(self.accounts.values())
+            self.accounts = {}
+        for a in accounts:
+            c = a['cloud']
+            try:
+                if not self.keep_registration:
+                    c.unregister()
+                if not self.session_cache:
+                    c.logout()
+            except TolinoException as e:
+                logging.warning('daemon logout of {} failed: {}'.format(c.username, e))
+
+
+class DaemonClient:
+
+    # Talks to a running TolinoDaemon on behalf of one account, with the
+    # methods of TolinoCloud that the command line client uses.
+
+    def __init__(self, socket_path, partner_id, username, password):
+        self.socket_path = os.path.expanduser(socket_path)
+        self.partner_id = partner_id
+        self.username = username
+        self.password = password
+
+    @staticmethod
+    def running(socket_path = default_socket):
+        try:
+            return DaemonClient(socket_path, None, None, None).request('ping') == 'pong'
+        except (OSError, ValueError, DaemonError):
+            return False
+
+    def request(self, op, **args):
+        s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            s.connect(self.socket_path)
+            s.sendall(json.dumps({
+                'op'       : op,
+                'partner'  : self.partner_id,
+                'user'     : self.username,
+                'password' : self.password,
+                'args'     : args
+            }).encode('utf-8') + b'\n')
+            with s.makefile('rb') as f:
+                line = f.readline()
+        finally:
+            s.close()
+        if not line:
+            raise DaemonError('daemon closed the connection.')
+        res = json.loads(line.decode('utf-8'))
+        if not res['ok']:
+            raise DaemonError(res['error'])
+        return res['result']
+
+    def inventory(self):
+        return [InventoryItem(**i) for i in self.request('inventory')]
+
+    def devices(self):
+        return [Device(**d) for d in self.request('devices')]
+
+    def download(self, path, id, segments = 1):
+        return self.request('download', path=os.path.abspath(path or '.'), id=id, segments=segments)
+
+    def upload(self, filename, name = None, progress = None):
+        # progress can't be reported across the socket and is ignored
+        return self.request('upload', filename=os.path.abspath(filename), name=name)
+
+    def delete(self, id):
+        self.request('delete', id=id)
+
+    def _many(self, func, ids, workers):
+        # run func(id) for many ids at once, one connection each
+        def run(id):
+            try:
+                return { 'id' : id, 'result' : func(id), 'error' : None }
+            except (DaemonError, OSError, ValueError) as e:
+                return { 'id' : id, 'result' : None, 'error' : str(e) or type(e).__name__ }
+
+        # at most twice the workers are submitted at a time, so a caller
+        # that stops iterating doesn't leave the rest running
+        todo = iter(ids)
+        pending = set()
+        n = 0
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            try:
+                while True:
+                    for id in todo:
+                        pending.add(pool.submit(run, id))
+                        if len(pending) >= 2 * workers:
+                            break
+                    if not pending:
+                        return
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for f in done:
+                        n += 1
+                        res = f.result()
+                        res['done'] = n
+                        res['total'] = len(ids)
+                        yield res
+            finally:
+                for f in pending:
+                    f.cancel()
+
+    def download_many(self, path, ids = None, workers = 4, segments = 1):
+        if ids is None:
+            ids = [i['id'] for i in self.inventory()]
+        ids = list(ids)
+        for res in self._many(lambda id: self.download(path, id, segments), ids, workers):
+            res['filename'] = res.pop('result')
+            yield res
+
+    def delete_many(self, ids, workers = 4):
+        ids = list(ids)
+        for res in self._many(self.delete, ids, workers):
+            del res['result']
+            yield res
@@ -0,0 +1,742 @@
+#!/usr/bin/env python3
+
+#tolino cloud mock server
+
+# A local stand-in for a partner shop and the bosh REST api, so that
+# TolinoCloud can be exercised and measured without live servers.
+#
+# It emulates the partner login (login_form_url, login_url, auth_url,
+# token_url, tat_url, revoke_url, logout_url) and the bosh endpoints
+# (registerhw, devices list / delete, inventory/delta, upload,
+# deletecontent, downloadinfo and the content downloads), with
+# configurable latency, library size and file size. To stand in for
+# an overloaded server, it can fail a share of the bosh requests with
+# 503 and turn away those beyond a concurrency limit with 429 and a
+# Retry-After header. Every user gets a library of its own, any
+# password is accepted unless one is set.
+#
+# Use it from Python:
+#
+#   m = MockTolino(items=1000).start()
+#   m.install(99)
+#   c = TolinoCloud(99)
+#
+# or run it as a separate process, it prints its partner settings as
+# one line of JSON and serves until it is killed:
+#
+#   ./tolinomock.py --items 1000 --latency 0.05
+#
+# POST /mock/config with a JSON object of new settings (items,
+# file_size, latency, flavor, password, expires_in, error_rate,
+# max_inflight) resets the server, GET /mock/stats returns the number
+# of requests per endpoint.
+
+
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+
+
+import os
+import re
+import sys
+import json
+import time
+import base64
+import random
+import email.utils
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs, urlencode
+
+class MockLibrary:
+
+    # the inventory and devices of one user
+
+    def __init__(self, user, items):
+        self.user = user
+        self.revision = 0
+        self.docs = {}
+        self.deleted = {}
+        self.devices = {}
+        rnd = random.Random(user)
+        for n in range(items):
+            ebook = n % 4 != 3
+            self.add({
+                'id'        : '{:013d}'.format(9780000000000 + n) if ebook else 'edata{}'.format(n),
+                'title'     : 'Title {} {}'.format(n, rnd.choice(('Moon', 'River', 'Glass', 'Storm', 'Garden'))),
+                'subtitle'  : 'Subtitle {}'.format(n) if n % 3 else '',
+                'author'    : ['Author {}'.format(rnd.randrange(max(items // 10, 1)))],
+                'type'      : 'EBOOK' if ebook else 'EDATA',
+                'mime'      : 'application/epub+zip' if ebook else 'application/pdf',
+                'purchased' : 1400000000000 + n * 86400000,
+                'issued'    : 1300000000000 + n * 86400000 if ebook else None,
+                'data'      : None
+            })
+
+    def add(self, doc):
+        self.revision += 1
+        doc['revision'] = self.revision
+        self.docs[doc['id']] = doc
+        self.deleted.pop(doc['id'], None)
+
+    def remove(self, id):
+        if self.docs.pop(id, None) is None:
+            return False
+        self.revision += 1
+        self.deleted[id] = self.revision
+        return True
+
+    def publication(self, doc, reseller):
+        return {
+            'resellerId'   : str(reseller),
+            'epubMetaData' : {
+                'identifier'  : doc['id'],
+                'title'       : doc['title'],
+                'subtitle'    : doc['subtitle'],
+                'author'      : [{ 'name' : a } for a in doc['author']],
+                'type'        : doc['type'],
+                'issued'      : doc['issued'],
+                'deliverable' : [{
+                    'contentFormat' : doc['mime'],
+                    'purchased'     : str(doc['purchased'])
+                }]
+            }
+        }
+
+    def inventory(self, reseller, since = None):
+        # the whole library, or what changed after revision since
+        docs = [d for d in self.docs.values() if since is None or d['revision'] > since]
+        inv = {
+            'edata'    : [self.publication(d, reseller) for d in docs if d['type'] == 'EDATA'],
+            'ebook'    : [self.publication(d, reseller) for d in docs if d['type'] != 'EDATA'],
+            'lastSync' : self.revision
+        }
+        if since is not None:
+            inv['deleted'] = [id for id, rev in self.deleted.items() if rev > since]
+        return { 'PublicationInventory' : inv }
+
+
+class MockServer(ThreadingHTTPServer):
+
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # clients hanging up in the middle of an answer are expected
+        if not isinstance(sys.exc_info()[1], (ConnectionError, TimeoutError)):
+            ThreadingHTTPServer.handle_error(self, request, client_address)
+
+
+class MockHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    # headers and body go out in separate writes, don't let them wait
+    # for delayed acks
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def send(self, status, body = b'', headers = {}):
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body).encode('utf-8')
+            headers = dict(headers, **{ 'Content-Type' : 'application/json' })
+        elif isinstance(body, str):
+            body = body.encode('utf-8')
+            headers = dict({ 'Content-Type' : 'text/html' }, **headers)
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def error(self, status, message):
+        self.send(status, { 'ResponseInfo' : { 'message' : message } })
+
+    def chunks(self):
+        # the request body in pieces, plain or chunked transfer encoding
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            while True:
+                size = int(self.rfile.readline().split(b';')[0], 16)
+                if not size:
+                    while self.rfile.readline() not in (b'\r\n', b'\n', b''):
+                        pass
+                    return
+                left = size
+                while left:
+                    chunk = self.rfile.read(min(left, 1024 * 1024))
+                    if not chunk:
+                        return
+                    left -= len(chunk)
+                    yield chunk
+                self.rfile.readline()
+        else:
+            left = int(self.headers.get('Content-Length') or 0)
+            while left:
+                chunk = self.rfile.read(min(left, 1024 * 1024))
+                if not chunk:
+                    return
+                left -= len(chunk)
+                yield chunk
+
+    def body(self):
+        return b''.join(self.chunks())
+
+    def handle_request(self, method):
+        mock = self.server.mock
+        url = urlparse(self.path)
+        query = { k : v[0] for k, v in parse_qs(url.query).items() }
+        route = mock.route(method, url.path)
+        mock.count(route or 'unknown')
+        if route is None:
+            self.body()
+            return self.send(404, 'not found')
+        if route.startswith('mock'):
+            return getattr(self, 'route_' + route.replace('/', '_'))(url, query)
+        with mock.lock:
+            mock.inflight += 1
+            over = mock.max_inflight and mock.inflight > mock.max_inflight
+        shop = route in mock.shop_routes
+        try:
+            if mock.latency:
+                time.sleep(mock.latency)
+            if over and not shop:
+                # turned away before doing anything
+                self.body()
+                mock.count('rejected')
+                return self.send(429, { 'ResponseInfo' : { 'message' : 'too many requests' } },
+                    { 'Retry-After' : '1' })
+            if mock.error_rate and not shop and random.random() < mock.error_rate:
+                self.body()
+                mock.count('failed')
+                return self.error(503, 'service unavailable')
+            getattr(self, 'route_' + route.replace('/', '_'))(url, query)
+        finally:
+            with mock.lock:
+                mock.inflight -= 1
+
+    def do_GET(self):
+        self.handle_request('GET')
+
+    def do_POST(self):
+        self.handle_request('POST')
+
+    def do_HEAD(self):
+        self.send(405)
+
+    def cookie(self, name):
+        for part in self.headers.get('Cookie', '').split(';'):
+            key, _, value = part.strip().partition('=')
+            if key == name:
+                return value
+        return None
+
+    def library(self):
+        # the library of the user the auth token belongs to, None if
+        # the token is unknown or expired (then a 401 has been sent)
+        mock = self.server.mock
+        lib = mock.authorize(self.headers.get('t_auth_token'))
+        if lib is None:
+            self.error(401, 'invalid or expired token')
+        return lib
+
+    # partner shop
+
+    def route_login_form(self, url, query):
+        self.send(200, '<form></form>', { 'Set-Cookie' : 'FORMSESSION=1; Path=/' })
+
+    def route_login(self, url, query):
+        mock = self.server.mock
+        form = { k : v[0] for k, v in parse_qs(self.body().decode('utf-8')).items() }
+        user = form.get('username')
+        if (not user or mock.flavor == 'form' and self.cookie('FORMSESSION') is None or
+                mock.password is not None and form.get('password') != mock.password):
+            return self.send(200, 'login failed')
+        session = mock.new_session(user)
+        self.send(200, 'welcome', { 'Set-Cookie' : 'MOCKSESSION={}; Path=/'.format(session) })
+
+    def route_auth(self, url, query):
+        mock = self.server.mock
+        user = mock.session_user(self.cookie('MOCKSESSION'))
+        if user is None or query.get('response_type') != 'code':
+            return self.send(302, '', { 'Location' : query.get('redirect_uri', '/') + '?error=access_denied' })
+        self.send(302, '', { 'Location' : '{}?{}'.format(query['redirect_uri'],
+            urlencode({ 'code' : mock.new_code(user) })) })
+
+    def route_token(self, url, query):
+        mock = self.server.mock
+        form = { k : v[0] for k, v in parse_qs(self.body().decode('utf-8')).items() }
+        if form.get('grant_type') == 'authorization_code':
+            user = mock.redeem_code(form.get('code'))
+        elif form.get('grant_type') == 'refresh_token':
+            user = mock.redeem_refresh(form.get('refresh_token'))
+        else:
+            user = None
+        if user is None:
+            return self.send(400, { 'error' : 'invalid_grant' })
+        access, refresh = mock.new_tokens(user)
+        self.send(200, {
+            'access_token'  : access,
+            'refresh_token' : refresh,
+            'token_type'    : 'Bearer',
+            'expires_in'    : mock.expires_in
+        })
+
+    def route_tat(self, url, query):
+        # the page embeds the token like the buch.de web reader link does
+        mock = self.server.mock
+        user = mock.session_user(self.cookie('MOCKSESSION'))
+        if user is None:
+            return self.send(200, 'not logged in')
+        access, refresh = mock.new_tokens(user)
+        b64 = base64.b64encode(access.encode('utf-8')).decode('utf-8').rstrip('=')
+        self.send(200, '<a href="/reader?x=1&tat={}%3D">read</a>'.format(b64))
+
+    def route_revoke(self, url, query):
+        form = { k : v[0] for k, v in parse_qs(self.body().decode('utf-8')).items() }
+        self.server.mock.revoke(form.get('token'))
+        self.send(200, {})
+
+    def route_logout(self, url, query):
+        self.body()
+        self.send(200, 'bye', { 'Set-Cookie' : 'MOCKSESSION=; Path=/; Max-Age=0' })
+
+    # bosh api
+
+    def route_registerhw(self, url, query):
+        self.body()
+        lib = self.library()
+        if lib is None:
+            return
+        hardware_id = self.headers.get('hardware_id')
+        if not hardware_id:
+            return self.error(400, 'hardware_id missing')
+        with self.server.mock.lock:
+            lib.devices.setdefault(hardware_id, {
+                'deviceId'         : hardware_id,
+                'deviceName'       : self.headers.get('hardware_type', 'HTML5'),
+                'deviceType'       : 'HTML5_1',
+                'resellerId'       : str(self.server.mock.partner_id),
+                'deviceRegistered' : str(int(time.time() * 1000)),
+                'deviceLastUsage'  : str(int(time.time() * 1000))
+            })
+        self.send(200, {})
+
+    def route_devices_list(self, url, query):
+        self.body()
+        lib = self.library()
+        if lib is None:
+            return
+        with self.server.mock.lock:
+            devices = list(lib.devices.values())
+        self.send(200, { 'deviceListResponse' : { 'devices' : devices } })
+
+    def route_devices_delete(self, url, query):
+        lib = self.library()
+        if lib is None:
+            return self.body()
+        try:
+            ids = [d['device_id'] for d in json.loads(self.body().decode('utf-8'))['deleteDevicesRequest']['devices']]
+        except (ValueError, KeyError, TypeError):
+            return self.error(400, 'malformed request')
+        with self.server.mock.lock:
+            unknown = [id for id in ids if not id in lib.devices]
+            if unknown:
+                return self.error(404, 'unknown device {}'.format(unknown[0]))
+            for id in ids:
+                del lib.devices[id]
+        self.send(200, {})
+
+    def device(self, lib):
+        # device calls need a registered hardware_id
+        if not self.headers.get('hardware_id') in lib.devices:
+            self.error(403, 'device not registered')
+            return False
+        return True
+
+    def route_inventory(self, url, query):
+        lib = self.library()
+        if lib is None or not self.device(lib):
+            return
+        since = query.get('lastSync')
+        with self.server.mock.lock:
+            inv = lib.inventory(self.server.mock.partner_id, int(since) if since else None)
+        self.send(200, inv)
+
+    def route_upload(self, url, query):
+        lib = self.library()
+        if lib is None:
+            return self.body()
+        if not self.device(lib):
+            return self.body()
+        data = self.body()
+        # only the part header is looked at, the rest is taken as is;
+        # clients write its lines in either order
+        head = data[:data.find(b'\r\n\r\n', 0, 4096)]
+        name = re.search(rb'filename="([^"]*)"', head)
+        mime = re.search(rb'Content-Type: ([^\r\n]*)', head)
+        if not name or not mime:
+            return self.error(400, 'no file')
+        name, mime = name.group(1).decode('utf-8'), mime.group(1).decode('utf-8')
+        start = len(head) + 4
+        end = data.rindex(b'\r\n--')
+        with self.server.mock.lock:
+            self.server.mock.uploads += 1
+            id = 'upload{}'.format(self.server.mock.uploads)
+            lib.add({
+                'id'        : id,
+                'title'     : name.rsplit('.', 1)[0],
+                'subtitle'  : '',
+                'author'    : [],
+                'type'      : 'EDATA',
+                'mime'      : mime,
+                'purchased' : int(time.time() * 1000),
+                'issued'    : None,
+                'data'      : data[start:end]
+            })
+        self.send(200, { 'metadata' : { 'deliverableId' : id } })
+
+    def route_deletecontent(self, url, query):
+        lib = self.library()
+        if lib is None or not self.device(lib):
+            return
+        with self.server.mock.lock:
+            found = lib.remove(query.get('deliverableId'))
+        if not found:
+            return self.error(404, 'unknown document')
+        self.send(200, {})
+
+    def route_downloadinfo(self, url, query):
+        lib = self.library()
+        if lib is None or not self.device(lib):
+            return
+        try:
+            id = base64.b64decode(url.path.split('/downloadinfo/')[1].split('/')[0]).decode('utf-8')
+        except (ValueError, IndexError):
+            return self.error(400, 'bad document id')
+        doc = lib.docs.get(id)
+        if doc is None:
+            return self.error(404, 'unknown document')
+        ext = 'epub' if doc['mime'] == 'application/epub+zip' else 'pdf'
+        self.send(200, { 'DownloadInfo' : {
+            'contentUrl' : '{}/content/{}/{}/{}.{}'.format(self.server.mock.base_url,
+                self.server.mock.sign(lib.user, id), base64.urlsafe_b64encode(id.encode('utf-8')).decode('utf-8'),
+                re.sub(r'\W+', '_', doc['title']), ext),
+            'format'     : ext
+        } })
+
+    def route_content(self, url, query):
+        # signed like the real content urls, no token needed
+        mock = self.server.mock
+        try:
+            signature, id = url.path.split('/')[2:4]
+            id = base64.urlsafe_b64decode(id).decode('utf-8')
+        except ValueError:
+            return self.send(404, 'not found')
+        lib = mock.verify(signature, id)
+        doc = lib.docs.get(id) if lib else None
+        if doc is None:
+            return self.send(404, 'not found')
+        data = doc['data'] if doc['data'] is not None else mock.content
+        total = len(data)
+        first, last = 0, total - 1
+        status = 200
+        # content changes with the revision of the document
+        headers = {
+            'Content-Type'  : doc['mime'],
+            'Accept-Ranges' : 'bytes',
+            'ETag'          : '"{}-{}-{}"'.format(mock.secret, doc['revision'], total),
+            'Last-Modified' : email.utils.formatdate(doc['purchased'] / 1000, usegmt=True)
+        }
+        if 'If-None-Match' in self.headers:
+            if headers['ETag'] in [t.strip() for t in self.headers['If-None-Match'].split(',')]:
+                return self.send(304, b'', { 'ETag' : headers['ETag'] })
+        elif 'If-Modified-Since' in self.headers:
+            try:
+                since = email.utils.parsedate_to_datetime(self.headers['If-Modified-Since']).timestamp()
+            except (TypeError, ValueError):
+                since = 0
+            if since >= doc['purchased'] // 1000:
+                return self.send(304, b'', { 'Last-Modified' : headers['Last-Modified'] })
+        m = re.match(r'^bytes=(\d+)-(\d*)$', self.headers.get('Range', ''))
+        if m and 'If-Range' in self.headers and \
+                not self.headers['If-Range'] in (headers['ETag'], headers['Last-Modified']):
+            # the range was of another revision, send all of this one
+            m = None
+        if m:
+            first = int(m.group(1))
+            last = min(int(m.group(2)), total - 1) if m.group(2) else total - 1
+            if first >= total:
+                return self.send(416, '', { 'Content-Range' : 'bytes */{}'.format(total) })
+            status = 206
+            headers['Content-Range'] = 'bytes {}-{}/{}'.format(first, last, total)
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header('Content-Length', str(last - first + 1))
+        self.end_headers()
+        view = memoryview(data)
+        for pos in range(first, last + 1, 1024 * 1024):
+            self.wfile.write(view[pos:min(pos + 1024 * 1024, last + 1)])
+
+    # control
+
+    def route_mock_config(self, url, query):
+        try:
+            options = json.loads(self.body().decode('utf-8') or '{}')
+            self.server.mock.configure(**options)
+        except (ValueError, TypeError) as e:
+            return self.send(400, { 'error' : str(e) })
+        self.send(200, self.server.mock.settings)
+
+    def route_mock_stats(self, url, query):
+        with self.server.mock.lock:
+            self.send(200, dict(self.server.mock.requests))
+
+
+class MockTolino:
+
+    # (method, path pattern, route) of the emulated endpoints
+    routes = (
+        ('GET',  r'/shop/login-form$',                    'login_form'),
+        ('POST', r'/shop/login$',                         'login'),
+        ('GET',  r'/shop/authorize$',                     'auth'),
+        ('POST', r'/shop/token$',                         'token'),
+        ('GET',  r'/shop/tat$',                           'tat'),
+        ('POST', r'/shop/revoke$',                        'revoke'),
+        ('POST', r'/shop/logout$',                        'logout'),
+        ('POST', r'/bosh/rest/registerhw$',               'registerhw'),
+        ('POST', r'/bosh/rest/handshake/devices/list$',   'devices/list'),
+        ('POST', r'/bosh/rest/handshake/devices/delete$', 'devices/delete'),
+        ('GET',  r'/bosh/rest/inventory/delta$',          'inventory'),
+        ('POST', r'/bosh/rest/upload$',                   'upload'),
+        ('GET',  r'/bosh/rest/deletecontent$',            'deletecontent'),
+        ('GET',  r'/bosh/rest/+cloud/downloadinfo/',      'downloadinfo'),
+        ('GET',  r'/content/',                            'content'),
+        ('POST', r'/mock/config$',                        'mock/config'),
+        ('GET',  r'/mock/stats$',                         'mock/stats')
+    )
+
+    # the partner shop's part, never failed on purpose
+    shop_routes = ('login_form', 'login', 'auth', 'token', 'tat', 'revoke', 'logout')
+
+    # login flavors: 'oauth' is the plain oauth code flow (Hugendubel),
+    # 'form' fetches the login form first (Thalia), 'tat' reads the token
+    # from a web page (buch.de) and 'revoke' logs out by revoking the
+    # refresh token (buecher.de)
+    flavors = ('oauth', 'form', 'tat', 'revoke')
+
+    # reported as resellerId, install() sets it to the partner id used
+    partner_id = 99
+
+    def __init__(self, items = 100, file_size = 100 * 1024, latency = 0.0,
+            flavor = 'oauth', password = None, expires_in = 3600, error_rate = 0.0,
+            max_inflight = 0, host = '127.0.0.1', port = 0):
+        self.host = host
+        self.port = port
+        self.server = None
+        self.lock = threading.RLock()
+        self.requests = {}
+        self.inflight = 0
+        self.configure(items, file_size, latency, flavor, password, expires_in,
+            error_rate, max_inflight)
+
+    def configure(self, items = 100, file_size = 100 * 1024, latency = 0.0,
+            flavor = 'oauth', password = None, expires_in = 3600, error_rate = 0.0,
+            max_inflight = 0):
+        # (re)start with fresh libraries and no sessions
+        if not flavor in self.flavors:
+            raise ValueError('unknown flavor {}.'.format(flavor))
+        with self.lock:
+            self.items = int(items)
+            self.file_size = int(file_size)
+            self.latency = float(latency)
+            self.flavor = flavor
+            self.password = password
+            self.expires_in = int(expires_in)
+            # share of requests failed with 503, number of concurrent
+            # requests beyond which they are answered with 429 (0: none)
+            self.error_rate = float(error_rate)
+            self.max_inflight = int(max_inflight)
+            self.content = os.urandom(self.file_size)
+            self.libraries = {}
+            self.sessions = {}
+            self.codes = {}
+            self.tokens = {}
+            self.refresh_tokens = {}
+            self.uploads = 0
+            self.requests = {}
+            self.secret = os.urandom(8).hex()
+
+    def route(self, method, path):
+        for m, pattern, route in self.routes:
+            if m == method and re.match(pattern, path):
+                return route
+        return None
+
+    def count(self, route):
+        with self.lock:
+            self.requests[route] = self.requests.get(route, 0) + 1
+
+    def _new(self, table, user):
+        key = os.urandom(12).hex()
+        with self.lock:
+            table[key] = user
+        return key
+
+    def new_session(self, user):
+        return self._new(self.sessions, user)
+
+    def session_user(self, session):
+        with self.lock:
+            return self.sessions.get(session)
+
+    def new_code(self, user):
+        return self._new(self.codes, user)
+
+    def redeem_code(self, code):
+        with self.lock:
+            return self.codes.pop(code, None)
+
+    def new_tokens(self, user):
+        with self.lock:
+            access = self._new(self.tokens, (user, time.time() + self.expires_in))
+            return access, self._new(self.refresh_tokens, user)
+
+    def redeem_refresh(self, token):
+        with self.lock:
+            return self.refresh_tokens.pop(token, None)
+
+    def revoke(self, token):
+        with self.lock:
+            self.refresh_tokens.pop(token, None)
+
+    def authorize(self, token):
+        with self.lock:
+            user, expires = self.tokens.get(token, (None, 0))
+            if user is None or expires < time.time():
+                return None
+            if not user in self.libraries:
+                self.libraries[user] = MockLibrary(user, self.items)
+            return self.libraries[user]
+
+    def sign(self, user, id):
+        return '{}-{}'.format(base64.urlsafe_b64encode(user.encode('utf-8')).decode('utf-8'),
+            abs(hash((self.secret, user, id))))
+
+    def verify(self, signature, id):
+        try:
+            user = base64.urlsafe_b64decode(signature.split('-')[0]).decode('utf-8')
+        except ValueError:
+            return None
+        if signature != self.sign(user, id):
+            return None
+        with self.lock:
+            return self.libraries.get(user)
+
+    @property
+    def base_url(self):
+        return 'http://{}:{}'.format(self.host, self.port)
+
+    @property
+    def settings(self):
+        # partner settings for TolinoCloud.partner_settings
+        base = self.base_url
+        c = {
+            'client_id'        : 'mock',
+            'scope'            : 'SCOPE_BOSH',
+            'signup_url'       : base + '/shop/signup',
+            'profile_url'      : base + '/shop/profile',
+            'auth_url'         : base + '/shop/authorize',
+            'token_url'        : base + '/shop/token',
+            'login_url'        : base + '/shop/login',
+            'login_form'       : {
+                'username' : 'username',
+                'password' : 'password',
+                'extra'    : {}
+            },
+            'login_cookie'     : 'MOCKSESSION',
+            'logout_url'       : base + '/shop/logout',
+            'reader_url'       : base + '/reader/',
+            'register_url'     : base + '/bosh/rest/registerhw',
+            'devices_url'      : base + '/bosh/rest/handshake/devices/list',
+            'unregister_url'   : base + '/bosh/rest/handshake/devices/delete',
+            'upload_url'       : base + '/bosh/rest/upload',
+            'delete_url'       : base + '/bosh/rest/deletecontent',
+            'inventory_url'    : base + '/bosh/rest/inventory/delta',
+            'downloadinfo_url' : base + '/bosh/rest//cloud/downloadinfo/{}/{}/type/external-download'
+        }
+        if self.flavor == 'form':
+            c['login_form_url'] = base + '/shop/login-form'
+            c['x_buchde.skin_id'] = '17'
+            c['x_buchde.mandant_id'] = '2'
+        elif self.flavor == 'tat':
+            c['tat_url'] = base + '/shop/tat'
+        elif self.flavor == 'revoke':
+            c['revoke_url'] = base + '/shop/revoke'
+        return c
+
+    def install(self, partner_id = 99, name = 'Mock'):
+        # make the mock available to TolinoCloud as partner_id
+        from tolinocloud import TolinoCloud
+        self.partner_id = partner_id
+        TolinoCloud.partner_settings[partner_id] = self.settings
+        TolinoCloud.partner_name[partner_id] = name
+        return partner_id
+
+    def start(self):
+        # serve from background threads
+        self.server = MockServer((self.host, self.port), MockHandler)
+        self.server.mock = self
+        self.port = self.server.server_port
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description='Local mock of a tolino partner shop and the bosh REST api.')
+    parser.add_argument('--host', default='127.0.0.1', help='address to listen on (default: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=0, help='port to listen on (default: any free port)')
+    parser.add_argument('--items', type=int, default=100, help='library size per user (default: 100)')
+    parser.add_argument('--file-size', type=int, default=100 * 1024, help='size of each document in bytes (default: 102400)')
+    parser.add_argument('--latency', type=float, default=0.0, help='delay of every response in seconds (default: 0)')
+    parser.add_argument('--flavor', choices=MockTolino.flavors, default='oauth', help='partner login flow to emulate (default: oauth)')
+    parser.add_argument('--password', help='only accept this password (default: any)')
+    parser.add_argument('--expires-in', type=int, default=3600, help='access token lifetime in seconds (default: 3600)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of requests to fail with 503 (default: 0)')
+    parser.add_argument('--max-inflight', type=int, default=0, help='answer requests beyond this many at once with 429 (default: no limit)')
+    args = parser.parse_args(argv)
+
+    mock = MockTolino(args.items, args.file_size, args.latency, args.flavor,
+        args.password, args.expires_in, args.error_rate, args.max_inflight,
+        args.host, args.port).start()
+    print(json.dumps(mock.settings))
+    sys.stdout.flush()
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        mock.stop()
+
+if __name__ == '__main__':
+    main()
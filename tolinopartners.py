@@ -0,0 +1,191 @@
+#tolino cloud partner tables
+
+# The shops / partners of the tolino cloud, by partner id: their names
+# and the urls and settings of their login flow and of the cloud API.
+# Kept apart from tolinocloud.py and without any imports, so the
+# command line client can list the partners or complete them in a
+# shell without loading the HTTP stack. TolinoCloud.partner_name and
+# TolinoCloud.partner_settings are these very dicts.
+
+
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+
+
+partner_name = {
+     1 : 'Telekom',
+     3 : 'Thalia.de',
+     4 : 'Thalia.at',
+     5 : 'Thalia.ch',
+     6 : 'Buch.de',
+     7 : 'buch.ch',
+     8 : 'Books.ch',
+    10 : 'Weltbild.de',
+    11 : 'Weltbild.at',
+    12 : 'Weltbild.ch',
+    13 : 'Hugendubel.de',
+    20 : 'derclub.de',
+    21 : 'otto-media.de',
+    22 : 'donauland.at',
+    30 : 'bücher.de',
+    40 : 'Bild.de', # defunct?
+    60 : 'StandaardBoekhandel.be',
+    80 : 'Libri.de',
+    81 : 'eBook.de',
+    90 : 'ibs.it'
+}
+
+partner_settings = {
+    3: {
+        # Thalia.de
+        'client_id'        : 'webshop01',
+        'scope'            : 'SCOPE_BOSH',
+        'signup_url'       : 'https://www.thalia.de/shop/home/kunde/neu/',
+        'profile_url'      : 'https://www.thalia.de/shop/home/kunde/',
+        'token_url'        : 'https://www.thalia.de/auth/oauth2/token',
+        'login_form_url'   : 'https://www.thalia.de/de.thalia.ecp.authservice.application/oauth2/login',
+        'x_buchde.skin_id' : '17',
+        'x_buchde.mandant_id' :'2',
+        'auth_url'         : 'https://www.thalia.de/de.thalia.ecp.authservice.application/oauth2/authorize',
+        'login_url'        : 'https://www.thalia.de/de.thalia.ecp.authservice.application/login.do',
+        # 'revoke_url'       : 'https://www.thalia.de/de.buch.appservices/api/2004/oauth2/revoke',
+        'login_form'       : {
+            'username' : 'j_username',
+            'password' : 'j_password',
+            'extra'    : {
+                'login' : ''
+                }
+         },
+        'login_cookie'     : 'OAUTH-JSESSIONID',
+        'logout_url'       : 'https://www.thalia.de/shop/home/login/logout/',
+        'reader_url'       : 'https://webreader.mytolino.com/library/index.html#/mybooks/titles',
+        'register_url'     : 'https://bosh.pageplace.de/bosh/rest/v2/registerhw',
+        'devices_url'      : 'https://bosh.pageplace.de/bosh/rest/handshake/devices/list',
+        'unregister_url'   : 'https://bosh.pageplace.de/bosh/rest/handshake/devices/delete',
+        'upload_url'       : 'https://bosh.pageplace.de/bosh/rest/upload',
+        'delete_url'       : 'https://bosh.pageplace.de/bosh/rest/deletecontent',
+        'inventory_url'    : 'https://bosh.pageplace.de/bosh/rest/inventory/delta',
+        'downloadinfo_url' : 'https://bosh.pageplace.de/bosh/rest//cloud/downloadinfo/{}/{}/type/external-download'
+        },
+    4: {
+        # Thalia.at
+        'client_id'        : 'webshop01',
+        'scope'            : 'SCOPE_BOSH SCOPE_BUCHDE',
+        'signup_url'       : 'https://www.thalia.at/shop/home/kunde/neu/',
+        'profile_url'      : 'https://www.thalia.at/shop/home/kunde/',
+        'token_url'        : 'https://www.thalia.at/de.buch.appservices/api/4004/oauth2/token',
+        'login_form_url'   : 'https://www.thalia.at/de.thalia.ecp.authservice.application/oauth2/login',
+        'x_buchde.skin_id' : '17',
+        'x_buchde.mandant_id' : '4',
+        'auth_url'         : 'https://www.thalia.at/de.thalia.ecp.authservice.application/oauth2/authorize',
+        'login_url'        : 'https://www.thalia.at/de.thalia.ecp.authservice.application/login.do',
+        # 'revoke_url'       : 'https://www.thalia.de/de.buch.appservices/api/2004/oauth2/revoke',
+        'login_form'       : {
+            'username' : 'j_username',
+            'password' : 'j_password',
+            'extra'    : {
+                'login' : ''
+            }
+         },
+        'login_cookie'     : 'OAUTH-JSESSIONID',
+        'logout_url'       : 'https://www.thalia.at/shop/home/show/',
+        'reader_url'       : 'https://webreader.mytolino.com/library/index.html#/mybooks/titles',
+        'register_url'     : 'https://bosh.pageplace.de/bosh/rest/v2/registerhw',
+        'devices_url'      : 'https://bosh.pageplace.de/bosh/rest/handshake/devices/list',
+        'unregister_url'   : 'https://bosh.pageplace.de/bosh/rest/handshake/devices/delete',
+        'upload_url'       : 'https://bosh.pageplace.de/bosh/rest/upload',
+        'delete_url'       : 'https://bosh.pageplace.de/bosh/rest/deletecontent',
+        'inventory_url'    : 'https://bosh.pageplace.de/bosh/rest/inventory/delta',
+        'downloadinfo_url' : 'https://bosh.pageplace.de/bosh/rest//cloud/downloadinfo/{}/{}/type/external-download'
+        },
+     6: {
+        # Buch.de'
+        'client_id'        : 'webshop01',
+        'scope'            : 'SCOPE_BOSH SCOPE_BUCHDE',
+        'signup_url'       : 'https://ssl.buch.de/shop/home/kunde/neu/',
+        'profile_url'      : 'https://ssl.buch.de/shop/home/kunde/',
+        'login_url'        : 'https://ssl.buch.de/shop/home/login/dologin/',
+        'login_form'       : {
+            'username' : 'username',
+            'password' : 'password',
+            'extra'    : {}
+         },
+        'login_cookie'     : 'KUNDE',
+        'tat_url'          : 'https://ssl.buch.de/shop/home/ebook/anzeigen/',
+        'logout_url'       : 'https://ssl.buch.de/shop/home/login/logout/',
+        'reader_url'       : 'https://html5reader.buch.de/library/library.html#!/library',
+        'register_url'     : 'https://bosh.pageplace.de/bosh/rest/registerhw',
+        'devices_url'      : 'https://bosh.pageplace.de/bosh/rest/handshake/devices/list',
+        'unregister_url'   : 'https://bosh.pageplace.de/bosh/rest/handshake/devices/delete',
+        'upload_url'       : 'https://bosh.pageplace.de/bosh/rest/upload',
+        'delete_url'       : 'https://bosh.pageplace.de/bosh/rest/deletecontent',
+        'inventory_url'    : 'https://bosh.pageplace.de/bosh/rest/inventory/delta',
+        'downloadinfo_url' : 'https://bosh.pageplace.de/bosh/rest//cloud/downloadinfo/{}/{}/type/external-download'
+        },
+    13: {
+        # Hugendubel.de
+        'client_id'        : '4c20de744aa8b83b79b692524c7ec6ae',
+        'scope'            : 'ebook_library',
+        'signup_url'       : 'https://www.hugendubel.de/go/my_my/my_newRegistration/',
+        'profile_url'      : 'https://www.hugendubel.de/go/my_my/my_data/',
+        'token_url'        : 'https://api.hugendubel.de/rest/oauth2/token',
+        # 'revoke_url'       : 'https://api.hugendubel.de/rest/oauth2/revoke',
+        'auth_url'         : 'https://www.hugendubel.de/oauth/authorize',
+        'login_url'        : 'https://www.hugendubel.de/de/account/login',
+        'login_form'       : {
+            'username' : 'username',
+            'password' : 'password',
+            'extra'    : {
+                'evaluate'           : 'true',
+                'isOrdering'         : '',
+                'isOneClickOrdering' : ''
+            }
+        },
+        'login_cookie'     : 'JSESSIONID',
+        'logout_url'       : 'https://www.hugendubel.de/de/account/logout',
+        'reader_url'       : 'https://webreader.hugendubel.de/library/index.html',
+        'register_url'     : 'https://bosh.pageplace.de/bosh/rest/registerhw',
+        'devices_url'      : 'https://bosh.pageplace.de/bosh/rest/handshake/devices/list',
+        'unregister_url'   : 'https://bosh.pageplace.de/bosh/rest/handshake/devices/delete',
+        'upload_url'       : 'https://bosh.pageplace.de/bosh/rest/upload',
+        'delete_url'       : 'https://bosh.pageplace.de/bosh/rest/deletecontent',
+        'inventory_url'    : 'https://bosh.pageplace.de/bosh/rest/inventory/delta',
+        'downloadinfo_url' : 'https://bosh.pageplace.de/bosh/rest//cloud/downloadinfo/{}/{}/type/external-download'
+    },
+    30: {
+        # buecher.de
+        'client_id'        : 'dte_ereader_app_01',
+        'scope'            : 'ebook_library',
+        'signup_url'       : 'https://www.buecher.de/go/my_dry/my_register_aos/',
+        'profile_url'      : 'https://www.buecher.de/go/my_dry/my_login/receiver_object/my_login/',
+        'token_url'        : 'https://www.buecher.de/oauth2/token',
+        'revoke_url'       : 'https://www.buecher.de/oauth2/revoke',
+        'auth_url'         : 'https://www.buecher.de/oauth2/authorize',
+        'login_url'        : 'https://www.buecher.de/go/my_dry/my_login/',
+        'login_form'       : {
+            'username' : 'form[login]',
+            'password' : 'form[password]',
+            'extra'    : {
+                'form_send' : '1'
+            }
+        },
+        'x_buecherde.skin_id' : 'de_dte_tolino',
+        'login_cookie'     : 'session',
+        'logout_url'       : 'https://www.buecher.de/go/my_dry/my_logout/',
+        'reader_url'       : 'https://webreader.mytolino.com/library/',
+        'register_url'     : 'https://bosh.pageplace.de/bosh/rest/v2/registerhw',
+        'devices_url'      : 'https://bosh.pageplace.de/bosh/rest/handshake/devices/list',
+        'unregister_url'   : 'https://bosh.pageplace.de/bosh/rest/handshake/devices/delete',
+        'upload_url'       : 'https://bosh.pageplace.de/bosh/rest/upload',
+        'delete_url'       : 'https://bosh.pageplace.de/bosh/rest/deletecontent',
+        'inventory_url'    : 'https://bosh.pageplace.de/bosh/rest/inventory/delta',
+        'downloadinfo_url' : 'https://bosh.pageplace.de/bosh/rest//cloud/downloadinfo/{}/{}/type/external-download'
+    }
+}
@@ -0,0 +1,181 @@
+#tolino cloud record types
+
+# Compact records for inventory items and devices. They keep their
+# fields in __slots__ instead of a per-record dict, share repeated
+# strings through sys.intern() and still allow dict-style read access,
+# so code written for the former plain dicts keeps working.
+
+
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+
+
+import sys
+from array import array
+
+class Record:
+
+    __slots__ = ()
+
+    # fields that are missing from the record, rather than None, when unset
+    optional = ()
+
+    def __init__(self, **fields):
+        for key in self.__slots__:
+            setattr(self, key, fields.get(key))
+
+    def __getitem__(self, key):
+        if key in self.__slots__:
+            value = getattr(self, key)
+            if value is not None or not key in self.optional:
+                return value
+        raise KeyError(key)
+
+    def get(self, key, default = None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        try:
+            self[key]
+            return True
+        except KeyError:
+            return False
+
+    def keys(self):
+        return [key for key in self.__slots__
+            if not (key in self.optional and getattr(self, key) is None)]
+
+    def items(self):
+        return [(key, getattr(self, key)) for key in self.keys()]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __eq__(self, other):
+        if isinstance(other, (Record, dict)):
+            return dict(self) == dict(other)
+        return NotImplemented
+
+    def __repr__(self):
+        return '{}({})'.format(type(self).__name__,
+            ', '.join('{}={!r}'.format(k, v) for k, v in self.items()))
+
+
+class InventoryItem(Record):
+
+    __slots__ = ('partner', 'id', 'title', 'subtitle', 'author', 'mime', 'type', 'purchased', 'issued')
+
+    optional = ('issued',)
+
+    def __init__(self, **fields):
+        Record.__init__(self, **fields)
+        self.author = tuple(sys.intern(a) for a in self.author or ())
+        self.mime = sys.intern(self.mime) if self.mime else self.mime
+        self.type = sys.intern(self.type) if self.type else self.type
+
+
+class Device(Record):
+
+    __slots__ = ('id', 'name', 'type', 'partner', 'registered', 'lastusage')
+
+    # readable names for the device types reported by the server
+    types = {
+        'unknown_imx50_rdp_1' : 'tolino shine',
+        'tolino_vison'        : 'tolino vision',
+        'HTML5_1'             : 'web browser'
+    }
+
+    def __init__(self, **fields):
+        Record.__init__(self, **fields)
+        self.type = sys.intern(self.types.get(self.type, self.type))
+
+
+class Inventory:
+
+    # Column-wise storage for a whole inventory: one list or array per
+    # field instead of one object per item, with the dates in int64
+    # arrays for cheap filtering and sorting. Items are materialized as
+    # InventoryItem records on access.
+
+    # stands for a missing issue date in the issued column
+    missing = -2**63
+
+    def __init__(self, items = ()):
+        self.columns = { key : [] for key in InventoryItem.__slots__ }
+        self.columns['purchased'] = array('q')
+        self.columns['issued'] = array('q')
+        for item in items:
+            self.append(item)
+
+    def append(self, item):
+        for key, column in self.columns.items():
+            value = item.get(key)
+            if key == 'issued' and value is None:
+                value = self.missing
+            elif key == 'author':
+                value = tuple(sys.intern(a) for a in value or ())
+            elif key in ('mime', 'type') and value:
+                value = sys.intern(value)
+            column.append(value)
+
+    def __len__(self):
+        return len(self.columns['id'])
+
+    def __getitem__(self, n):
+        fields = { key : column[n] for key, column in self.columns.items() }
+        if fields['issued'] == self.missing:
+            fields['issued'] = None
+        return InventoryItem(**fields)
+
+    def __iter__(self):
+        for n in range(len(self)):
+            yield self[n]
+
+    def select(self, indices):
+        # a new inventory with the items at the given positions
+        inv = Inventory()
+        for key, column in self.columns.items():
+            if isinstance(column, array):
+                inv.columns[key] = array(column.typecode, (column[n] for n in indices))
+            else:
+                inv.columns[key] = [column[n] for n in indices]
+        return inv
+
+    def filter(self, type = None, mime = None, partner = None,
+            purchased_after = None, purchased_before = None,
+            issued_after = None, issued_before = None):
+        # Items matching all given conditions; dates are epoch ms, the
+        # after bounds inclusive and the before bounds exclusive.
+        conds = []
+        for key, value in (('type', type), ('mime', mime), ('partner', partner)):
+            if value is not None:
+                conds.append((self.columns[key], value))
+        indices = range(len(self))
+        for column, value in conds:
+            indices = [n for n in indices if column[n] == value]
+        for key, after, before in (('purchased', purchased_after, purchased_before),
+                ('issued', issued_after, issued_before)):
+            column = self.columns[key]
+            if after is not None:
+                indices = [n for n in indices if column[n] != self.missing and column[n] >= after]
+            if before is not None:
+                indices = [n for n in indices if column[n] != self.missing and column[n] < before]
+        return self.select(indices)
+
+    def sort(self, key = 'purchased', reverse = False):
+        # a new inventory ordered by one column
+        column = self.columns[key]
+        return self.select(sorted(range(len(self)), key=column.__getitem__, reverse=reverse))
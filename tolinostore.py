@@ -0,0 +1,283 @@
+#tolino cloud local inventory store
+
+# Keeps the inventory of one or more tolino cloud accounts in a local
+# SQLite database, so it can be updated incrementally from the
+# inventory/delta endpoint and queried without touching the network.
+
+
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+
+
+import os
+import re
+import json
+import time
+import calendar
+import sqlite3
+from tolinorecords import InventoryItem
+
+class InventoryStore:
+
+    fields = ('partner', 'id', 'title', 'subtitle', 'author', 'mime', 'type', 'purchased', 'issued')
+
+    schema = '''
+        create table if not exists accounts (
+            account  integer primary key,
+            partner  integer not null,
+            user     text not null,
+            position text,
+            synced   real,
+            unique (partner, user)
+        );
+        create table if not exists items (
+            account   integer not null,
+            id        text not null,
+            partner   integer,
+            title     text,
+            subtitle  text,
+            author    text,
+            mime      text,
+            type      text,
+            purchased integer,
+            issued    integer,
+            added     real not null,
+            changed   real not null,
+            primary key (account, id)
+        );
+        create table if not exists removed (
+            account integer not null,
+            id      text not null,
+            removed real not null,
+            primary key (account, id)
+        );
+        create index if not exists items_added on items (account, added);
+        create index if not exists items_changed on items (account, changed);
+        create index if not exists removed_removed on removed (account, removed);
+        create index if not exists items_purchased on items (account, purchased);
+        create index if not exists items_issued on items (account, issued);
+    '''
+
+    # full text index over the text fields, kept up to date by triggers
+    fts_schema = '''
+        create virtual table items_fts using fts5 (
+            title, subtitle, author, content='items', content_rowid='rowid'
+        );
+        create trigger items_fts_insert after insert on items begin
+            insert into items_fts (rowid, title, subtitle, author)
+                values (new.rowid, new.title, new.subtitle, new.author);
+        end;
+        create trigger items_fts_delete after delete on items begin
+            insert into items_fts (items_fts, rowid, title, subtitle, author)
+                values ('delete', old.rowid, old.title, old.subtitle, old.author);
+        end;
+        create trigger items_fts_update after update on items begin
+            insert into items_fts (items_fts, rowid, title, subtitle, author)
+                values ('delete', old.rowid, old.title, old.subtitle, old.author);
+            insert into items_fts (rowid, title, subtitle, author)
+                values (new.rowid, new.title, new.subtitle, new.author);
+        end;
+        insert into items_fts (items_fts) values ('rebuild');
+    '''
+
+    text_fields = ('title', 'subtitle', 'author')
+    exact_fields = ('id', 'type', 'mime', 'partner')
+    date_fields = ('purchased', 'issued')
+
+    def __init__(self, filename):
+        filename = os.path.expanduser(filename)
+        if os.path.dirname(filename):
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+        # several accounts may sync into one store at once, each
+        # waits for the others' (short) write transactions
+        self.db = sqlite3.connect(filename, timeout=30)
+        self.db.executescript(self.schema)
+        self.fts = True
+        if not self.db.execute("select 1 from sqlite_master where name = 'items_fts'").fetchone():
+            try:
+                with self.db:
+                    self.db.executescript('begin;' + self.fts_schema)
+            except sqlite3.OperationalError:
+                # sqlite built without fts5, search falls back to LIKE
+                self.fts = False
+
+    def close(self):
+        self.db.close()
+
+    def _account(self, partner, user, create = False):
+        row = self.db.execute('select account from accounts where partner = ? and user = ?',
+            (partner, user)).fetchone()
+        if row:
+            return row[0]
+        if not create:
+            return None
+        return self.db.execute('insert into accounts (partner, user) values (?, ?)',
+            (partner, user)).lastrowid
+
+    def _row(self, item):
+        row = [item.get(f) for f in self.fields]
+        row[self.fields.index('author')] = json.dumps(list(item['author']))
+        return row
+
+    def _item(self, row):
+        md = dict(zip(self.fields, row))
+        md['author'] = json.loads(md['author'])
+        return InventoryItem(**md)
+
+    def synced(self, partner, user):
+        # time of the last sync, None if the account was never synced
+        row = self.db.execute('select synced from accounts where partner = ? and user = ?',
+            (partner, user)).fetchone()
+        return row[0] if row else None
+
+    def sync(self, cloud):
+        # Bring the stored inventory of the logged in account up to date,
+        # asking the server only for changes since the last sync.
+        # Returns the number of added, changed and removed items.
+        with self.db:
+            account = self._account(cloud.partner_id, cloud.username, create=True)
+            position = self.db.execute('select position from accounts where account = ?',
+                (account,)).fetchone()[0]
+
+        # no transaction is kept open during the download, so other
+        # syncs into this store aren't locked out meanwhile
+        delta = cloud.inventory_delta(json.loads(position) if position else None)
+
+        now = time.time()
+        with self.db:
+            self.db.execute('begin immediate')
+            stored = {}
+            for row in self.db.execute('select {} from items where account = ?'.format(
+                    ', '.join(self.fields)), (account,)):
+                stored[row[1]] = list(row)
+
+            counts = { 'added' : 0, 'changed' : 0, 'removed' : 0 }
+            seen = set()
+            for item in delta['items']:
+                row = self._row(item)
+                seen.add(item['id'])
+                if not item['id'] in stored:
+                    counts['added'] += 1
+                    self.db.execute('insert into items (account, {}, added, changed) values (?, {}, ?, ?)'.format(
+                        ', '.join(self.fields), ', '.join('?' * len(self.fields))),
+                        [account] + row + [now, now])
+                    self.db.execute('delete from removed where account = ? and id = ?',
+                        (account, item['id']))
+                elif stored[item['id']] != row:
+                    counts['changed'] += 1
+                    self.db.execute('update items set {}, changed = ? where account = ? and id = ?'.format(
+                        ', '.join('{} = ?'.format(f) for f in self.fields)),
+                        row + [now, account, item['id']])
+
+            # a full snapshot removes whatever it doesn't contain
+            removed = delta['removed'] if delta['delta'] else [id for id in stored if not id in seen]
+            for id in removed:
+                if id in stored:
+                    counts['removed'] += 1
+                    self.db.execute('delete from items where account = ? and id = ?', (account, id))
+                    self.db.execute('insert or replace into removed (account, id, removed) values (?, ?, ?)',
+                        (account, id, now))
+
+            self.db.execute('update accounts set position = ?, synced = ? where account = ?',
+                (json.dumps(delta['position']) if delta['position'] is not None else None, now, account))
+        return counts
+
+    def inventory(self, partner, user):
+        account = self._account(partner, user)
+        return [self._item(row) for row in self.db.execute(
+            'select {} from items where account = ? order by rowid'.format(', '.join(self.fields)),
+            (account,))]
+
+    def changes(self, partner, user, since):
+        # items added, changed and removed after the given time
+        account = self._account(partner, user)
+        cols = ', '.join(self.fields)
+        return {
+            'added'   : [self._item(row) for row in self.db.execute(
+                'select {} from items where account = ? and added > ?'.format(cols), (account, since))],
+            'changed' : [self._item(row) for row in self.db.execute(
+                'select {} from items where account = ? and changed > ? and added <= ?'.format(cols),
+                (account, since, since))],
+            'removed' : [row[0] for row in self.db.execute(
+                'select id from removed where account = ? and removed > ?', (account, since))]
+        }
+
+    def _period(self, value):
+        # 'YYYY', 'YYYY-MM' or 'YYYY-MM-DD' as [start, end) in epoch ms
+        m = re.match(r'^(\d{4})(?:-(\d{1,2}))?(?:-(\d{1,2}))?$', value)
+        if not m:
+            raise ValueError('bad date {}, use YYYY[-MM[-DD]].'.format(value))
+        y, mo, d = int(m.group(1)), int(m.group(2) or 1), int(m.group(3) or 1)
+        start = calendar.timegm((y, mo, d, 0, 0, 0))
+        if m.group(3):
+            end = start + 86400
+        elif m.group(2):
+            end = calendar.timegm((y + mo // 12, mo % 12 + 1, 1, 0, 0, 0))
+        else:
+            end = calendar.timegm((y + 1, 1, 1, 0, 0, 0))
+        return start * 1000, end * 1000
+
+    def search(self, partner, user, query):
+        # Search the stored inventory. The query is a list of terms that
+        # all have to match:
+        #
+        #   word                  title, subtitle or author starts with word
+        #   title:word            the same for one field (also subtitle, author)
+        #   type:ebook            exact match (also id, mime, partner)
+        #   purchased>2020        date compare (also issued), with YYYY[-MM[-DD]]
+        #                         meaning that whole period: > after it, >= from
+        #                         its start, < before it, <= until its end
+        account = self._account(partner, user)
+        where = ['items.account = ?']
+        params = [account]
+        words = []
+        for term in re.findall(r'(?:[^\s"]|"[^"]*")+', query):
+            m = re.match(r'^(\w+)(:|>=|<=|>|<|=)(.+)$', term)
+            field, op, value = m.groups() if m else (None, None, term)
+            value = value.replace('"', '')
+            if field in self.date_fields:
+                start, end = self._period(value)
+                bounds = {
+                    '>'  : (end, None),
+                    '>=' : (start, None),
+                    '<'  : (None, start),
+                    '<=' : (None, end)
+                }.get(op, (start, end))
+                if bounds[0] is not None:
+                    where.append('items.{} >= ?'.format(field))
+                    params.append(bounds[0])
+                if bounds[1] is not None:
+                    where.append('items.{} < ?'.format(field))
+                    params.append(bounds[1])
+            elif field in self.exact_fields and op in (':', '='):
+                where.append('items.{} = ?'.format(field))
+                params.append(int(value) if field == 'partner' else value)
+            elif field in self.text_fields and op in (':', '='):
+                words.append((field, value))
+            elif field is None:
+                words.append((None, value))
+            else:
+                raise ValueError('unknown search term {}.'.format(term))
+
+        if words and self.fts:
+            match = ' AND '.join('{}"{}"*'.format(field + ' : ' if field else '', value)
+                for field, value in words)
+            where.append('items.rowid in (select rowid from items_fts where items_fts match ?)')
+            params.append(match)
+        else:
+            for field, value in words:
+                cols = [field] if field else self.text_fields
+                where.append('(' + ' or '.join('items.{} like ?'.format(c) for c in cols) + ')')
+                params += ['%' + value + '%'] * len(cols)
+
+        return [self._item(row) for row in self.db.execute(
+            'select {} from items where {} order by title'.format(
+                ', '.join('items.' + f for f in self.fields), ' and '.join(where)),
+            params)]
@@ -0,0 +1,139 @@
+#tolino cloud request tracing
+
+# Collects per-phase metrics of TolinoCloud calls: number of requests,
+# latency (sum, min, max and a histogram), status codes, errors and
+# bytes sent and received. Phases are the steps of a command, e.g.
+# login.token, register, inventory, download_info or transfer.
+#
+# Tracing is off unless a Tracer is handed to TolinoCloud, a disabled
+# tracer costs one attribute check per request. The collected metrics
+# can be exported as JSON or in the Prometheus text format, e.g. for
+# the textfile collector of node_exporter.
+
+
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+
+
+import os
+import json
+import time
+import bisect
+import threading
+
+class Tracer:
+
+    # upper bounds in seconds of the latency histogram buckets
+    buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+    def __init__(self, prefix = 'tolino'):
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.phases = {}
+
+    def record(self, phase, seconds, status = None, bytes_in = 0, bytes_out = 0, error = False):
+        with self.lock:
+            p = self.phases.get(phase)
+            if p is None:
+                p = self.phases[phase] = {
+                    'count'     : 0,
+                    'errors'    : 0,
+                    'seconds'   : 0.0,
+                    'min'       : None,
+                    'max'       : None,
+                    'buckets'   : [0] * (len(self.buckets) + 1),
+                    'bytes_in'  : 0,
+                    'bytes_out' : 0,
+                    'status'    : {}
+                }
+            p['count'] += 1
+            p['seconds'] += seconds
+            p['min'] = seconds if p['min'] is None else min(p['min'], seconds)
+            p['max'] = seconds if p['max'] is None else max(p['max'], seconds)
+            p['buckets'][bisect.bisect_left(self.buckets, seconds)] += 1
+            p['bytes_in'] += bytes_in
+            p['bytes_out'] += bytes_out
+            if status is not None:
+                p['status'][status] = p['status'].get(status, 0) + 1
+            if error or (status is not None and status >= 400):
+                p['errors'] += 1
+
+    def response(self, phase, r, body = True):
+        # a requests response: the time until its headers arrived, the
+        # size of the request body and, unless streamed, of the answer
+        sent = r.request.body
+        if sent is None:
+            sent = 0
+        elif isinstance(sent, (bytes, str)):
+            sent = len(sent)
+        else:
+            # a streamed body that counts what it handed out
+            sent = getattr(sent, 'sent', 0)
+        received = len(r.content) if body else 0
+        self.record(phase, r.elapsed.total_seconds(), r.status_code, received, sent)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'started' : self.started,
+                'phases'  : { phase : dict(p, status=dict(p['status']), buckets=list(p['buckets']))
+                    for phase, p in self.phases.items() }
+            }
+
+    def to_json(self):
+        s = self.snapshot()
+        s['phases'] = dict(sorted(s['phases'].items()))
+        for p in s['phases'].values():
+            p['buckets'] = dict(zip([str(b) for b in self.buckets] + ['+Inf'], p['buckets']))
+        return json.dumps(s, indent=2)
+
+    def to_prometheus(self):
+        s = self.snapshot()
+        name = self.prefix + '_' + '{}'
+        lines = []
+
+        def metric(metric, kind, help, samples):
+            lines.append('# HELP {} {}'.format(name.format(metric), help))
+            lines.append('# TYPE {} {}'.format(name.format(metric), kind))
+            for suffix, labels, value in samples:
+                lines.append('{}{}{{{}}} {}'.format(name.format(metric), suffix,
+                    ','.join('{}="{}"'.format(k, v) for k, v in labels), value))
+
+        phases = sorted(s['phases'].items())
+        metric('requests_total', 'counter', 'Requests per phase and status code.',
+            [('', (('phase', phase), ('code', code)), n)
+                for phase, p in phases for code, n in sorted(p['status'].items())])
+        metric('errors_total', 'counter', 'Failed requests per phase.',
+            [('', (('phase', phase),), p['errors']) for phase, p in phases])
+        samples = []
+        for phase, p in phases:
+            total = 0
+            for le, n in zip([str(b) for b in self.buckets] + ['+Inf'], p['buckets']):
+                total += n
+                samples.append(('_bucket', (('phase', phase), ('le', le)), total))
+            samples.append(('_sum', (('phase', phase),), repr(p['seconds'])))
+            samples.append(('_count', (('phase', phase),), p['count']))
+        metric('duration_seconds', 'histogram', 'Latency per phase.', samples)
+        metric('received_bytes_total', 'counter', 'Bytes received per phase.',
+            [('', (('phase', phase),), p['bytes_in']) for phase, p in phases])
+        metric('sent_bytes_total', 'counter', 'Bytes sent per phase.',
+            [('', (('phase', phase),), p['bytes_out']) for phase, p in phases])
+        return '\n'.join(lines) + '\n'
+
+    def write(self, filename):
+        # Prometheus text format for *.prom, JSON otherwise. The file is
+        # replaced atomically, so a collector never reads half of it.
+        filename = os.path.expanduser(filename)
+        data = self.to_prometheus() if filename.endswith('.prom') else self.to_json()
+        tmp = filename + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write(data)
+        os.replace(tmp, filename)